@@ -0,0 +1,23 @@
+"""Add column membership_version to cohort
+
+Revision ID: 2b4e7c0e5a1f
+Revises: 6f1b895840a
+Create Date: 2015-07-02 10:12:41.503127
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '2b4e7c0e5a1f'
+down_revision = '6f1b895840a'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.add_column('cohort', sa.Column(
+        'membership_version', sa.Integer(), nullable=False, server_default='0'))
+
+
+def downgrade():
+    op.drop_column('cohort', 'membership_version')
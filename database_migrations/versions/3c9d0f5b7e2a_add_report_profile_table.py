@@ -0,0 +1,30 @@
+"""add report_profile table
+
+Revision ID: 3c9d0f5b7e2a
+Revises: 2b4e7c0e5a1f
+Create Date: 2015-07-09 15:41:07.918264
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '3c9d0f5b7e2a'
+down_revision = '2b4e7c0e5a1f'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.create_table(
+        'report_profile',
+        sa.Column('report_id', sa.Integer(), nullable=False,
+                  primary_key=True, autoincrement=False),
+        sa.Column('node', sa.String(length=100), nullable=False, primary_key=True),
+        sa.Column('seconds', sa.Float(), nullable=False),
+        sa.Column('count', sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(['report_id'], ['report.id'])
+    )
+
+
+def downgrade():
+    op.drop_table('report_profile')
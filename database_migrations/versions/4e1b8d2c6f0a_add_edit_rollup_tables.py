@@ -0,0 +1,41 @@
+"""add edit_rollup and edit_rollup_coverage tables
+
+Revision ID: 4e1b8d2c6f0a
+Revises: 3c9d0f5b7e2a
+Create Date: 2015-07-20 11:02:44.318502
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '4e1b8d2c6f0a'
+down_revision = '3c9d0f5b7e2a'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.create_table(
+        'edit_rollup',
+        sa.Column('project', sa.String(length=45), nullable=False, primary_key=True),
+        sa.Column('user_id', sa.Integer(), nullable=False,
+                  primary_key=True, autoincrement=False),
+        sa.Column('day', sa.Date(), nullable=False, primary_key=True),
+        sa.Column('namespace', sa.Integer(), nullable=False,
+                  primary_key=True, autoincrement=False),
+        sa.Column('edits', sa.Integer(), nullable=False),
+        sa.Column('archived_edits', sa.Integer(), nullable=False),
+        sa.Column('creations', sa.Integer(), nullable=False),
+        sa.Column('archived_creations', sa.Integer(), nullable=False),
+    )
+    op.create_table(
+        'edit_rollup_coverage',
+        sa.Column('project', sa.String(length=45), nullable=False, primary_key=True),
+        sa.Column('start', sa.Date(), nullable=False),
+        sa.Column('end', sa.Date(), nullable=False),
+    )
+
+
+def downgrade():
+    op.drop_table('edit_rollup_coverage')
+    op.drop_table('edit_rollup')
@@ -0,0 +1,29 @@
+"""add midnight_edits and midnight_creations to edit_rollup
+
+Revision ID: 5a7c3e9d1b24
+Revises: 4e1b8d2c6f0a
+Create Date: 2015-07-27 10:14:05.802217
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '5a7c3e9d1b24'
+down_revision = '4e1b8d2c6f0a'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.add_column('edit_rollup', sa.Column(
+        'midnight_edits', sa.Integer(), nullable=False, server_default='0'))
+    op.add_column('edit_rollup', sa.Column(
+        'midnight_creations', sa.Integer(), nullable=False, server_default='0'))
+    # the days already counted have no midnight counts, count them again
+    op.execute('DELETE FROM edit_rollup')
+    op.execute('DELETE FROM edit_rollup_coverage')
+
+
+def downgrade():
+    op.drop_column('edit_rollup', 'midnight_creations')
+    op.drop_column('edit_rollup', 'midnight_edits')
@@ -21,6 +21,9 @@ from wikimetrics.models import (
     CohortTagStore,
     ReportStore,
     TaskErrorStore,
+    ReportProfileStore,
+    EditRollupStore,
+    EditRollupCoverageStore,
     Revision,
     Page,
     MediawikiUser,
@@ -685,6 +688,9 @@ class DatabaseTest(unittest.TestCase):
         self.session.query(CohortStore).delete()
         self.session.query(UserStore).delete()
         self.session.query(TaskErrorStore).delete()
+        self.session.query(ReportProfileStore).delete()
+        self.session.query(EditRollupStore).delete()
+        self.session.query(EditRollupCoverageStore).delete()
         self.session.query(ReportStore).delete()
         self.session.commit()
         self.session.remove()
@@ -0,0 +1,370 @@
+"""
+Benchmarks every metric in metric_classes against a synthetic mediawiki database.
+
+The database is generated by SyntheticWiki, with a power-law distribution of edits
+per user and of edits per page, some deleted pages (archive), reverts (repeated
+sha1s), and a newusers log entry for every user.  Every metric is then timed on
+random cohorts of several sizes and, for timeseries metrics, with several
+timeseries choices.  The results are written as JSON, to compare branches.
+
+This runs against the local test databases, like the rest of the tests, and is
+excluded from normal runs by the manual attribute:
+
+    BENCHMARK_OUTPUT=/tmp/benchmark-master.json \\
+        nosetests -a manual tests/manual/benchmark.py
+
+It is configured with these environment variables (see DEFAULTS):
+    BENCHMARK_EDITORS           : the number of users to generate
+    BENCHMARK_MEAN_EDITS        : the mean number of edits per user
+    BENCHMARK_SKEW              : the pareto shape of edits per user, the closer
+                                  to 1, the more edits are made by a few users
+    BENCHMARK_PAGES             : the number of pages to generate
+    BENCHMARK_DAYS              : the number of days the edits are spread over
+    BENCHMARK_DELETED_FRACTION  : the fraction of pages that are deleted
+    BENCHMARK_REVERT_FRACTION   : the fraction of edits that are reverts
+    BENCHMARK_SEED              : the seed of the generator
+    BENCHMARK_COHORT_SIZES      : comma separated cohort sizes
+    BENCHMARK_TIMESERIES        : comma separated timeseries choices
+    BENCHMARK_METRICS           : comma separated metric names, default all
+    BENCHMARK_REPEAT            : how many times to run each metric
+    BENCHMARK_OUTPUT            : the file to write the JSON results to
+"""
+import os
+import json
+import time
+import subprocess
+import numpy
+from datetime import datetime, timedelta
+from nose.plugins.attrib import attr
+from sqlalchemy import func
+from tests.fixtures import DatabaseTest
+from wikimetrics.enums import TimeseriesChoices
+from wikimetrics.metrics import metric_classes, TimeseriesMetric
+from wikimetrics.models import MediawikiUser, Logging, Page, Revision, Archive
+from wikimetrics.query_stats import query_context
+from wikimetrics.utils import format_date
+
+
+DEFAULTS = {
+    'EDITORS'           : '10000',
+    'MEAN_EDITS'        : '20',
+    'SKEW'              : '1.5',
+    'PAGES'             : '20000',
+    'DAYS'              : '365',
+    'DELETED_FRACTION'  : '0.05',
+    'REVERT_FRACTION'   : '0.05',
+    'SEED'              : '1',
+    'COHORT_SIZES'      : '100,1000,10000',
+    'TIMESERIES'        : ','.join([
+        TimeseriesChoices.NONE, TimeseriesChoices.DAY, TimeseriesChoices.MONTH
+    ]),
+    'METRICS'           : '',
+    'REPEAT'            : '3',
+    'OUTPUT'            : 'benchmark.json',
+}
+
+# metrics that do not query the database
+SKIPPED_METRICS = ('Metric', 'TimeseriesMetric', 'RandomMetric')
+
+INSERT_BATCH_SIZE = 10000
+
+
+def setting(name):
+    return os.environ.get('BENCHMARK_' + name, DEFAULTS[name])
+
+
+def list_setting(name):
+    return [value.strip() for value in setting(name).split(',') if value.strip()]
+
+
+class SyntheticWiki(object):
+    """
+    Generates the user, logging, page, revision, and archive rows of a mediawiki
+    database.  The same parameters and seed generate the same rows.
+    """
+
+    def __init__(self, editors, mean_edits, skew, pages, days,
+                 deleted_fraction, revert_fraction, seed,
+                 end=datetime(2014, 1, 1)):
+        self.editors = editors
+        self.mean_edits = mean_edits
+        self.skew = skew
+        self.pages = pages
+        self.days = days
+        self.deleted_fraction = deleted_fraction
+        self.revert_fraction = revert_fraction
+        self.end = end
+        self.start = end - timedelta(days=days)
+        self.random = numpy.random.RandomState(seed)
+
+    def edit_counts(self):
+        """
+        Returns
+            the number of edits of each user, pareto distributed with a mean of
+            about mean_edits, and at least 1
+        """
+        shape = max(self.skew, 1.01)
+        scale = self.mean_edits * (shape - 1) / shape
+        counts = (self.random.pareto(shape, self.editors) + 1) * scale
+        return numpy.maximum(counts.astype(numpy.int64), 1)
+
+    def page_weights(self):
+        """
+        Returns
+            the probability of each page to be edited, following Zipf's law
+        """
+        weights = 1.0 / numpy.arange(1, self.pages + 1)
+        return weights / weights.sum()
+
+    def timestamp(self, seconds):
+        return format_date(self.start + timedelta(seconds=int(seconds)))
+
+    def generate(self, first_user_id, first_page_id, first_rev_id):
+        """
+        Parameters
+            first_user_id   : the id of the first user to generate
+            first_page_id   : the id of the first page to generate
+            first_rev_id    : the id of the first revision to generate
+
+        Returns
+            a dictionary of lists of rows to insert, by table
+        """
+        span = self.days * 24 * 3600
+        counts = self.edit_counts()
+        user_ids = numpy.arange(first_user_id, first_user_id + self.editors)
+        registered = self.random.uniform(0, span, self.editors)
+
+        users = [
+            {
+                'user_id'           : int(user_id),
+                'user_name'         : 'Benchmark {0}'.format(user_id),
+                'user_registration' : self.timestamp(registered[u]),
+            }
+            for u, user_id in enumerate(user_ids)
+        ]
+        logging = [
+            {
+                'log_user'      : user['user_id'],
+                'log_timestamp' : user['user_registration'],
+                'log_title'     : user['user_name'],
+                'log_type'      : 'newusers',
+                'log_action'    : 'create',
+            }
+            for user in users
+        ]
+
+        # each user edits between their registration and the end
+        total = int(counts.sum())
+        editor = numpy.repeat(numpy.arange(self.editors), counts)
+        start = registered[editor]
+        seconds = start + self.random.uniform(0, 1, total) * (span - start)
+        page = self.random.choice(self.pages, size=total, p=self.page_weights())
+
+        # revision ids follow time, parents follow time within each page
+        by_time = numpy.argsort(seconds, kind='mergesort')
+        editor, seconds, page = editor[by_time], seconds[by_time], page[by_time]
+        rev_ids = numpy.arange(first_rev_id, first_rev_id + total)
+        by_page = numpy.lexsort((rev_ids, page))
+        parents = numpy.zeros(total, dtype=numpy.int64)
+        same_page = page[by_page][1:] == page[by_page][:-1]
+        parents[by_page[1:][same_page]] = rev_ids[by_page[:-1][same_page]]
+
+        # a revert restores the content of the revision before its parent
+        content = numpy.arange(total)
+        in_page = by_page[2:][page[by_page][2:] == page[by_page][:-2]]
+        before_parent = by_page[:-2][page[by_page][2:] == page[by_page][:-2]]
+        reverts = self.random.uniform(0, 1, len(in_page)) < self.revert_fraction
+        content[in_page[reverts]] = content[before_parent[reverts]]
+        lengths = self.random.lognormal(7, 1.5, total).astype(numpy.int64)
+
+        namespaces = self.random.choice(
+            [0, 1, 2, 3, 4], size=self.pages, p=[0.6, 0.15, 0.1, 0.1, 0.05]
+        )
+        deleted = self.random.uniform(0, 1, self.pages) < self.deleted_fraction
+        created = {}
+        for r in range(total):
+            if not parents[r]:
+                created[page[r]] = r
+
+        pages = [
+            {
+                'page_id'           : first_page_id + p,
+                'page_namespace'    : int(namespaces[p]),
+                'page_title'        : 'Benchmark page {0}'.format(p),
+                'page_touched'      : self.timestamp(seconds[created[p]]),
+            }
+            for p in sorted(created)
+            if not deleted[p]
+        ]
+        revisions = []
+        archive = []
+        for r in range(total):
+            p = page[r]
+            user_id = int(user_ids[editor[r]])
+            if deleted[p]:
+                archive.append({
+                    'ar_namespace'  : int(namespaces[p]),
+                    'ar_title'      : 'Benchmark page {0}'.format(p),
+                    'ar_user'       : user_id,
+                    'ar_user_text'  : 'Benchmark {0}'.format(user_id),
+                    'ar_timestamp'  : self.timestamp(seconds[r]),
+                    'ar_rev_id'     : int(rev_ids[r]),
+                    'ar_page_id'    : first_page_id + int(p),
+                    'ar_parent_id'  : int(parents[r]),
+                })
+            else:
+                revisions.append({
+                    'rev_id'        : int(rev_ids[r]),
+                    'rev_page'      : first_page_id + int(p),
+                    'rev_user'      : user_id,
+                    'rev_user_text' : 'Benchmark {0}'.format(user_id),
+                    'rev_timestamp' : self.timestamp(seconds[r]),
+                    'rev_len'       : int(lengths[r]),
+                    'rev_parent_id' : int(parents[r]),
+                    'rev_sha1'      : '{0:032x}'.format(int(content[r])),
+                })
+
+        return {
+            MediawikiUser   : users,
+            Logging         : logging,
+            Page            : pages,
+            Revision        : revisions,
+            Archive         : archive,
+        }
+
+    def populate(self, session):
+        """
+        Generates the rows after the ones already in the database, and inserts them
+
+        Parameters
+            session : sqlalchemy session open on a mediawiki database
+
+        Returns
+            the ids of the generated users
+        """
+        def next_id(column):
+            return (session.query(func.max(column)).scalar() or 0) + 1
+
+        rows = self.generate(
+            next_id(MediawikiUser.user_id),
+            next_id(Page.page_id),
+            max(next_id(Revision.rev_id), next_id(Archive.ar_rev_id)),
+        )
+        engine = session.bind.engine
+        for model in (MediawikiUser, Logging, Page, Revision, Archive):
+            table_rows = rows[model]
+            for start in range(0, len(table_rows), INSERT_BATCH_SIZE):
+                engine.execute(
+                    model.__table__.insert(),
+                    table_rows[start:start + INSERT_BATCH_SIZE]
+                )
+        return [user['user_id'] for user in rows[MediawikiUser]]
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD']).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class MetricsBenchmark(DatabaseTest):
+
+    def setUp(self):
+        DatabaseTest.setUp(self)
+        self.wiki = SyntheticWiki(
+            editors=int(setting('EDITORS')),
+            mean_edits=float(setting('MEAN_EDITS')),
+            skew=float(setting('SKEW')),
+            pages=int(setting('PAGES')),
+            days=int(setting('DAYS')),
+            deleted_fraction=float(setting('DELETED_FRACTION')),
+            revert_fraction=float(setting('REVERT_FRACTION')),
+            seed=int(setting('SEED')),
+        )
+        started = time.time()
+        self.user_ids = self.wiki.populate(self.mwSession)
+        self.generate_seconds = time.time() - started
+
+    def metric_parameters(self, metric_class):
+        """
+        Returns
+            the parameters of the runs of metric_class, one per timeseries choice
+            if it is a timeseries metric
+        """
+        parameters = {}
+        if hasattr(metric_class, 'start_date'):
+            parameters['start_date'] = self.wiki.start
+        if hasattr(metric_class, 'end_date'):
+            parameters['end_date'] = self.wiki.end
+
+        if not issubclass(metric_class, TimeseriesMetric):
+            return [parameters]
+        return [
+            dict(parameters, timeseries=timeseries)
+            for timeseries in list_setting('TIMESERIES')
+        ]
+
+    def time_metric(self, metric_class, parameters, user_ids):
+        runs = []
+        for run in range(int(setting('REPEAT'))):
+            metric = metric_class(**parameters)
+            with query_context(metric=metric_class.__name__) as context:
+                started = time.time()
+                results = metric(user_ids, self.mwSession)
+                seconds = time.time() - started
+            self.mwSession.rollback()
+            runs.append(dict(
+                seconds=seconds,
+                queries=context['queries'],
+                query_seconds=context['seconds'],
+                rows=context['rows'],
+            ))
+
+        timings = sorted(run['seconds'] for run in runs)
+        return {
+            'metric'        : metric_class.__name__,
+            'timeseries'    : parameters.get('timeseries', TimeseriesChoices.NONE),
+            'cohort_size'   : len(user_ids),
+            'results'       : len(results),
+            'min_seconds'   : timings[0],
+            'median_seconds': timings[len(timings) / 2],
+            'runs'          : runs,
+        }
+
+    @attr('manual')
+    def test_metrics(self):
+        names = list_setting('METRICS') or sorted(
+            name for name in metric_classes if name not in SKIPPED_METRICS
+        )
+        sizes = [
+            min(int(size), len(self.user_ids)) for size in list_setting('COHORT_SIZES')
+        ]
+        random = numpy.random.RandomState(int(setting('SEED')))
+        cohorts = [
+            sorted(random.choice(self.user_ids, size, replace=False).tolist())
+            for size in sizes
+        ]
+
+        benchmarks = []
+        for name in names:
+            for parameters in self.metric_parameters(metric_classes[name]):
+                for user_ids in cohorts:
+                    benchmark = self.time_metric(
+                        metric_classes[name], parameters, user_ids
+                    )
+                    print('{metric} {timeseries} {cohort_size}: {min_seconds:.3f}s'
+                          .format(**benchmark))
+                    benchmarks.append(benchmark)
+
+        output = {
+            'git_revision'      : git_revision(),
+            'run_at'            : format_date(datetime.utcnow()),
+            'settings'          : {name: setting(name) for name in DEFAULTS},
+            'revisions'         : self.mwSession.query(Revision).count(),
+            'archived'          : self.mwSession.query(Archive).count(),
+            'generate_seconds'  : self.generate_seconds,
+            'benchmarks'        : benchmarks,
+        }
+        with open(setting('OUTPUT'), 'w') as output_file:
+            json.dump(output, output_file, indent=4, sort_keys=True)
@@ -1,4 +1,5 @@
 # -*- coding: utf-8 -*-
+import mock
 from nose.tools import assert_equal, assert_true
 from tests.fixtures import DatabaseTest
 from wikimetrics.models.centralauth import CentralAuthLocalUser as LocalUser
@@ -108,3 +109,21 @@ class CentralAuthServiceTest(DatabaseTest):
             {'raw_id_or_name': username, 'project': wiki_1},
             {'raw_id_or_name': username, 'project': wiki_2},
         ], records)
+
+    @mock.patch('wikimetrics.api.centralauth.CENTRALAUTH_EXPANSION_BATCH_SIZE', 2)
+    def test_expand_in_batches(self):
+        usernames = ['User {0}'.format(i) for i in range(5)]
+        self.caSession.add_all(
+            [LocalUser(lu_name=username, lu_wiki='wiki2') for username in usernames]
+        )
+        self.caSession.commit()
+
+        records = self.expand(
+            [{'raw_id_or_name': username, 'project': 'wiki1'} for username in usernames],
+            self.caSession
+        )
+        assert_equal(len(records), 10)
+        assert_equal(
+            [r['project'] for r in records if r['raw_id_or_name'] == usernames[4]],
+            ['wiki1', 'wiki2']
+        )
@@ -0,0 +1,67 @@
+from unittest import TestCase
+from nose.tools import assert_equals, assert_true
+
+from wikimetrics.api import CohortSnapshotCache
+from wikimetrics.models import CohortSnapshot
+
+
+def make_snapshot(cohort_id, version, size):
+    return CohortSnapshot(cohort_id, 'enwiki', version, [
+        ('enwiki', user_id, 'User {0}'.format(user_id)) for user_id in range(size)
+    ])
+
+
+class CohortSnapshotCacheTest(TestCase):
+
+    def setUp(self):
+        self.snapshot_size = make_snapshot(1, 0, 10).memory_size()
+        self.cache = CohortSnapshotCache(max_bytes=2 * self.snapshot_size)
+        self.loads = []
+
+    def get(self, cohort_id, version):
+        def load():
+            self.loads.append((cohort_id, version))
+            return make_snapshot(cohort_id, version, 10)
+        return self.cache.get(cohort_id, version, load)
+
+    def test_hit_and_miss(self):
+        first = self.get(1, 0)
+        second = self.get(1, 0)
+
+        assert_true(first is second)
+        assert_equals(self.loads, [(1, 0)])
+        stats = self.cache.stats()
+        assert_equals(stats['hits'], 1)
+        assert_equals(stats['misses'], 1)
+        assert_equals(stats['entries'], 1)
+        assert_equals(stats['size'], self.snapshot_size)
+
+    def test_new_version_replaces_old_one(self):
+        self.get(1, 0)
+        self.get(1, 1)
+        self.get(1, 1)
+
+        assert_equals(self.loads, [(1, 0), (1, 1)])
+        assert_equals(self.cache.stats()['entries'], 1)
+        assert_equals(self.cache.stats()['evictions'], 0)
+
+    def test_least_recently_used_is_evicted(self):
+        self.get(1, 0)
+        self.get(2, 0)
+        # cohort 1 is now more recently used than cohort 2
+        self.get(1, 0)
+        self.get(3, 0)
+        self.get(1, 0)
+        self.get(2, 0)
+
+        assert_equals(self.loads, [(1, 0), (2, 0), (3, 0), (2, 0)])
+        assert_equals(self.cache.stats()['evictions'], 2)
+        assert_true(self.cache.stats()['size'] <= 2 * self.snapshot_size)
+
+    def test_disabled(self):
+        self.cache = CohortSnapshotCache(max_bytes=0)
+        self.get(1, 0)
+        self.get(1, 0)
+
+        assert_equals(self.loads, [(1, 0), (1, 0)])
+        assert_equals(self.cache.stats()['entries'], 0)
@@ -3,7 +3,7 @@ from nose.tools import assert_equals, assert_true, assert_false, raises
 from sqlalchemy.orm.exc import NoResultFound
 
 from tests.fixtures import DatabaseTest, mediawiki_project
-from wikimetrics.api import CohortService
+from wikimetrics.api import CohortService, cohort_snapshot_cache
 from wikimetrics.exceptions import Unauthorized, InvalidCohort
 from wikimetrics.models import (
     CohortStore, CohortUserStore, WikiUserStore, CohortWikiUserStore,
@@ -111,6 +111,49 @@ class CohortServiceTest(DatabaseTest):
 
         assert_equals(len(wikiusers), 4)
 
+    def test_get_with_snapshot(self):
+        c = self.cohort_service.get(
+            self.session, self.owner_user_id, by_id=self.cohort.id, snapshot=True
+        )
+        assert_equals(c.size, 4)
+        assert_equals(len(c.snapshot), 4)
+
+        by_project = list(self.cohort_service.get_users_by_project(c))
+        assert_equals(len(by_project), 1)
+        assert_equals(by_project[0][0], mediawiki_project)
+        assert_equals(set(by_project[0][1]), set(self.editor_user_ids))
+        assert_equals(
+            c.snapshot.usernames_by_key(),
+            self.cohort_service.get_wikiusernames_for_cohort(self.cohort.id, self.session)
+        )
+
+    def test_snapshot_is_stale_after_deleting_members(self):
+        snapshot = self.cohort_service.get_snapshot(self.cohort, self.session)
+        assert_true(snapshot.is_current(self.cohort))
+
+        wikiuser = self.session.query(WikiUserStore).first()
+        self.cohort_service.delete_cohort_wikiuser(
+            wikiuser.raw_id_or_name, self.cohort.id, self.owner_user_id, self.session)
+        self.session.refresh(self.cohort)
+
+        assert_false(snapshot.is_current(self.cohort))
+        assert_equals(
+            len(self.cohort_service.get_snapshot(self.cohort, self.session)), 3
+        )
+
+    def test_snapshot_leaves_out_members_without_user_id(self):
+        wikiuser = self.session.query(WikiUserStore).first()
+        user_id = wikiuser.mediawiki_userid
+        wikiuser.mediawiki_userid = None
+        self.session.commit()
+
+        snapshot = self.cohort_service.load_snapshot(self.cohort, self.session)
+        assert_equals(len(snapshot), 3)
+        assert_equals(
+            set(snapshot.user_ids.tolist()),
+            set(self.editor_user_ids) - set([user_id]),
+        )
+
     def test_get_wikiusers(self):
         users = self.cohort_service.get_wikiusers(self.fixed_cohort, self.session)
         assert_equals(users, self.editor_user_ids)
@@ -190,6 +233,23 @@ class CohortServiceTest(DatabaseTest):
         assert_equals(user_names[key1], user1.mediawiki_username)
         assert_equals(user_names[key2], user2.mediawiki_username)
 
+    def test_wikiusernames_for_users(self):
+        """
+        Names can be looked up for a batch of users of one project
+        """
+        users = self.cohort_service.get_wikiusers(self.fixed_cohort, self.session, 2)
+        user_names = self.cohort_service.get_wikiusernames_for_users(
+            self.fixed_cohort.id,
+            users[0].project,
+            [users[0].mediawiki_userid, 9999999],
+            self.session
+        )
+
+        assert_equals(
+            user_names,
+            {str(users[0].mediawiki_userid): users[0].mediawiki_username}
+        )
+
     def test_get_membership_contents(self):
         """
         The wikiuser properties must be returned
@@ -423,3 +483,53 @@ class CohortServiceTest(DatabaseTest):
             self.session, tag, self.empty_cohort.id, cohort_user.user_id)
 
         assert_equals(len(cohort_tags), 1)
+
+
+class CohortServiceCacheTest(DatabaseTest):
+    """
+    The test config disables the cohort snapshot cache, these tests turn it on
+    """
+
+    def setUp(self):
+        DatabaseTest.setUp(self)
+        self.common_cohort_1()
+        self.cohort_service = CohortService()
+        cohort_snapshot_cache.max_bytes = 10 * 1024 * 1024
+        cohort_snapshot_cache.clear()
+
+    def tearDown(self):
+        cohort_snapshot_cache.max_bytes = None
+        cohort_snapshot_cache.clear()
+        DatabaseTest.tearDown(self)
+
+    def test_snapshot_is_cached(self):
+        first = self.cohort_service.get_snapshot(self.cohort, self.session)
+        second = self.cohort_service.get_snapshot(self.cohort, self.session)
+
+        assert_true(first is second)
+        stats = self.cohort_service.get_cache_stats()
+        assert_equals(stats['hits'], 1)
+        assert_equals(stats['misses'], 1)
+        assert_equals(stats['entries'], 1)
+
+    def test_deleting_members_invalidates_the_cached_snapshot(self):
+        first = self.cohort_service.get_snapshot(self.cohort, self.session)
+        wikiuser = self.session.query(WikiUserStore).first()
+        self.cohort_service.delete_cohort_wikiuser(
+            wikiuser.raw_id_or_name, self.cohort.id, self.owner_user_id, self.session)
+        self.session.refresh(self.cohort)
+
+        second = self.cohort_service.get_snapshot(self.cohort, self.session)
+        assert_equals(len(first), 4)
+        assert_equals(len(second), 3)
+        assert_true(second.is_current(self.cohort))
+        # the stale version was replaced, not kept next to the new one
+        assert_equals(self.cohort_service.get_cache_stats()['entries'], 1)
+
+    def test_get_with_snapshot_uses_the_cache(self):
+        for i in range(2):
+            c = self.cohort_service.get(
+                self.session, self.owner_user_id, by_id=self.cohort.id, snapshot=True
+            )
+            assert_equals(c.size, 4)
+        assert_equals(self.cohort_service.get_cache_stats()['hits'], 1)
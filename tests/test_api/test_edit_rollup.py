@@ -0,0 +1,164 @@
+from datetime import date, datetime
+from nose.tools import assert_equal, assert_true, assert_false
+
+from tests.fixtures import DatabaseTest, mediawiki_project
+from wikimetrics.api import EditRollupService
+from wikimetrics.configurables import db
+from wikimetrics.enums import TimeseriesChoices
+from wikimetrics.metrics import NamespaceEdits, PagesCreated, RollingActiveEditor
+from wikimetrics.models import Revision, EditRollupStore, EditRollupCoverageStore
+
+
+class EditRollupServiceTest(DatabaseTest):
+
+    def setUp(self):
+        DatabaseTest.setUp(self)
+        self.common_cohort_1()
+        self.saved_config = {
+            key: db.config.get(key)
+            for key in ('EDIT_ROLLUP_PROJECTS', 'EDIT_ROLLUP_START_DATE')
+        }
+        db.config['EDIT_ROLLUP_PROJECTS'] = [mediawiki_project]
+        db.config['EDIT_ROLLUP_START_DATE'] = '2012-12-01'
+        self.service = EditRollupService()
+
+    def tearDown(self):
+        db.config.update(self.saved_config)
+        DatabaseTest.tearDown(self)
+
+    def build_and_forget_revisions(self):
+        self.service.build(mediawiki_project, until=date(2013, 3, 1))
+        # the rollup answers without the revisions from now on
+        self.mwSession.query(Revision).delete()
+        self.mwSession.commit()
+
+    def test_build_counts_days_incrementally(self):
+        assert_equal(self.service.build(mediawiki_project, until=date(2013, 1, 2)), 32)
+        assert_equal(self.service.build(mediawiki_project, until=date(2013, 3, 1)), 58)
+
+        coverage = self.session.query(EditRollupCoverageStore).get(mediawiki_project)
+        assert_equal(coverage.start, date(2012, 12, 1))
+        assert_equal(coverage.end, date(2013, 3, 1))
+        rows = self.session.query(EditRollupStore)\
+            .filter(EditRollupStore.user_id == self.editors[0].user_id)\
+            .order_by(EditRollupStore.day)\
+            .all()
+        assert_equal([(r.day, r.edits) for r in rows], [
+            (date(2012, 12, 31), 1),
+            (date(2013, 1, 1), 2),
+        ])
+
+    def test_covers_only_counted_days_at_midnight(self):
+        self.service.build(mediawiki_project, until=date(2013, 3, 1))
+        assert_true(self.service.covers(
+            self.mwSession, datetime(2013, 1, 1), datetime(2013, 2, 28)
+        ))
+        # the edits made right at the end date are counted on its day
+        assert_false(self.service.covers(
+            self.mwSession, datetime(2013, 1, 1), datetime(2013, 3, 1)
+        ))
+        assert_false(self.service.covers(
+            self.mwSession, datetime(2013, 1, 1, 12), datetime(2013, 2, 1)
+        ))
+
+    def assert_same_results(self, metric):
+        """
+        The metric gives the same results from the rollup as from the revisions
+        """
+        live = metric(self.editor_ids, self.mwSession)
+        self.build_and_forget_revisions()
+        assert_equal(metric(self.editor_ids, self.mwSession), live)
+        return live
+
+    def test_namespace_edits_at_midnight(self):
+        # editors 2 and 3 edit right at the start, editor 1 right at the end
+        live = self.assert_same_results(NamespaceEdits(
+            start_date='2013-01-01 00:00:00',
+            end_date='2013-01-02 00:00:00',
+        ))
+        assert_equal(
+            [live[editor.user_id]['edits'] for editor in self.editors], [2, 2, 0, 0]
+        )
+
+    def test_namespace_edits_timeseries_at_midnight(self):
+        self.assert_same_results(NamespaceEdits(
+            start_date='2013-01-01 00:00:00',
+            end_date='2013-02-01 00:00:00',
+            timeseries=TimeseriesChoices.DAY,
+        ))
+
+    def test_pages_created_at_midnight(self):
+        self.assert_same_results(PagesCreated(
+            start_date='2012-12-31 00:00:00',
+            end_date='2013-01-08 00:00:00',
+        ))
+
+    def test_rolling_active_editor_at_midnight(self):
+        self.assert_same_results(RollingActiveEditor(
+            end_date='2013-01-02 00:00:00',
+            rolling_days=1,
+            number_of_edits=2,
+        ))
+
+    def test_namespace_filter_runs_live(self):
+        self.build_and_forget_revisions()
+        metric = NamespaceEdits(
+            start_date='2013-01-01 00:00:00',
+            end_date='2013-01-03 00:00:00',
+            namespaces=[0],
+        )
+        results = metric(self.editor_ids, self.mwSession)
+        assert_equal(results[self.editors[1].user_id]['edits'], 0)
+
+    def test_namespace_edits_from_rollup(self):
+        self.build_and_forget_revisions()
+        metric = NamespaceEdits(
+            start_date='2013-01-01 00:00:00',
+            end_date='2013-01-03 00:00:00',
+        )
+        results = metric(self.editor_ids, self.mwSession)
+        assert_equal(results[self.editors[0].user_id]['edits'], 2)
+        assert_equal(results[self.editors[1].user_id]['edits'], 3)
+
+    def test_namespace_edits_not_covered_runs_live(self):
+        self.build_and_forget_revisions()
+        metric = NamespaceEdits(
+            start_date='2013-01-01 00:00:00',
+            end_date='2013-03-02 00:00:00',
+        )
+        results = metric(self.editor_ids, self.mwSession)
+        assert_equal(results[self.editors[0].user_id]['edits'], 0)
+
+    def test_rolling_active_editor_from_rollup(self):
+        self.build_and_forget_revisions()
+        metric = RollingActiveEditor(
+            end_date='2013-01-03 00:00:00',
+            rolling_days=2,
+            number_of_edits=3,
+        )
+        results = metric(self.editor_ids, self.mwSession)
+        assert_equal(results[self.editors[0].user_id]['rolling_active_editor'], 0)
+        assert_equal(results[self.editors[1].user_id]['rolling_active_editor'], 1)
+
+    def test_rolling_active_editor_timeseries_from_rollup(self):
+        self.build_and_forget_revisions()
+        metric = RollingActiveEditor(
+            start_date='2013-01-02 00:00:00',
+            end_date='2013-01-03 00:00:00',
+            timeseries=TimeseriesChoices.DAY,
+            rolling_days=2,
+            number_of_edits=3,
+        )
+        results = metric(self.editor_ids, self.mwSession)
+        day = '2013-01-02 00:00:00'
+        assert_equal(results[self.editors[0].user_id]['rolling_active_editor'][day], 0)
+        assert_equal(results[self.editors[1].user_id]['rolling_active_editor'][day], 1)
+
+    def test_rolling_active_editor_timeseries_at_midnight(self):
+        self.assert_same_results(RollingActiveEditor(
+            start_date='2012-12-31 00:00:00',
+            end_date='2013-01-09 00:00:00',
+            timeseries=TimeseriesChoices.DAY,
+            rolling_days=1,
+            number_of_edits=2,
+        ))
@@ -0,0 +1,78 @@
+import os
+import shutil
+import tempfile
+from datetime import datetime, timedelta
+from unittest import TestCase
+from nose.tools import assert_equals, assert_true
+
+from wikimetrics.api import MetricResultCache
+from wikimetrics.metrics import NamespaceEdits
+
+
+class MetricResultCacheTest(TestCase):
+
+    def setUp(self):
+        self.root_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root_dir)
+        self.cache = MetricResultCache(self.root_dir, max_bytes=10 ** 6, lag_hours=3)
+        self.metric = NamespaceEdits(
+            start_date=datetime(2013, 1, 1),
+            end_date=datetime(2013, 2, 1),
+        )
+        self.computed = 0
+
+    def compute(self):
+        self.computed += 1
+        return {1: {'edits': 3}, 2: {'edits': 0}}
+
+    def test_closed_range_is_cached(self):
+        first = self.cache.get(self.metric, 'wiki', [2, 1], self.compute)
+        second = self.cache.get(self.metric, 'wiki', [1, 2], self.compute)
+        assert_equals(self.computed, 1)
+        assert_equals(first, second)
+        assert_equals(self.cache.stats()['hits'], 1)
+
+    def test_key_changes_with_parameters_project_and_users(self):
+        key = self.cache.key(self.metric, 'wiki', [1, 2])
+        other = NamespaceEdits(
+            start_date=datetime(2013, 1, 1),
+            end_date=datetime(2013, 2, 1),
+            namespaces=[0, 1],
+        )
+        assert_true(self.cache.key(other, 'wiki', [1, 2]) != key)
+        assert_true(self.cache.key(self.metric, 'wiki2', [1, 2]) != key)
+        assert_true(self.cache.key(self.metric, 'wiki', [1, 2, 3]) != key)
+        self.metric.backfill = True
+        assert_true(self.cache.key(self.metric, 'wiki', [1, 2]) != key)
+
+    def test_recent_end_date_bypasses_cache(self):
+        recent = NamespaceEdits(
+            start_date=datetime(2013, 1, 1),
+            end_date=datetime.now() - timedelta(hours=1),
+        )
+        self.cache.get(recent, 'wiki', [1, 2], self.compute)
+        self.cache.get(recent, 'wiki', [1, 2], self.compute)
+        assert_equals(self.computed, 2)
+        assert_equals(self.cache.stats()['bypasses'], 2)
+        assert_equals(os.listdir(self.root_dir), [])
+
+    def test_least_recently_used_are_evicted(self):
+        self.cache.get(self.metric, 'wiki', [1], self.compute)
+        size = os.path.getsize(self.cache.get_path(
+            self.cache.key(self.metric, 'wiki', [1])
+        ))
+        self.cache.max_bytes = size * 2
+        self.cache.get(self.metric, 'wiki', [2], self.compute)
+        old = self.cache.get_path(self.cache.key(self.metric, 'wiki', [1]))
+        os.utime(old, (0, 0))
+        self.cache.get(self.metric, 'wiki', [3], self.compute)
+
+        assert_equals(len(os.listdir(self.root_dir)), 2)
+        assert_true(not os.path.exists(old))
+        assert_equals(self.cache.stats()['evictions'], 1)
+
+    def test_disabled_cache_always_computes(self):
+        self.cache.max_bytes = 0
+        self.cache.get(self.metric, 'wiki', [1, 2], self.compute)
+        self.cache.get(self.metric, 'wiki', [1, 2], self.compute)
+        assert_equals(self.computed, 2)
@@ -0,0 +1,38 @@
+import mock
+from unittest import TestCase
+from nose.tools import assert_equals
+
+from wikimetrics.api import ReportProfiler
+from wikimetrics.models import Report
+
+
+class ReportProfilerTest(TestCase):
+
+    def setUp(self):
+        self.profiler = ReportProfiler()
+
+    @mock.patch('wikimetrics.models.storage.ReportProfileStore.replace')
+    def test_flush_adds_up_timings(self, replace):
+        self.profiler.add(1, 'MetricReport enwiki', 2.0)
+        self.profiler.add(1, 'MetricReport enwiki', 3.0)
+        self.profiler.add(1, 'AggregateReport.finish', 0.5)
+        # reports that do not run under a stored report are not profiled
+        self.profiler.add(None, 'MetricReport enwiki', 1.0)
+        self.profiler.flush()
+
+        replace.assert_called_once_with([
+            {'report_id': 1, 'node': 'AggregateReport.finish', 'seconds': 0.5,
+             'count': 1},
+            {'report_id': 1, 'node': 'MetricReport enwiki', 'seconds': 5.0,
+             'count': 2},
+        ])
+        self.profiler.flush()
+        replace.assert_called_with([])
+
+    @mock.patch('wikimetrics.models.report_nodes.report.report_profiler')
+    def test_report_profile(self, profiler):
+        report = Report()
+        report.progress_report_id = 7
+        with report.profile('Report'):
+            pass
+        assert_equals(profiler.add.call_args[0][:2], (7, 'Report'))
@@ -0,0 +1,132 @@
+import os
+import time
+import shutil
+import tempfile
+import unittest
+from collections import OrderedDict
+from datetime import timedelta
+from decimal import Decimal
+from logging import RootLogger
+from mock import Mock
+from nose.tools import assert_equal, assert_true, assert_false
+
+from wikimetrics.api import ReportResultStore, IndividualResults
+from wikimetrics.enums import Aggregation
+from wikimetrics.utils import r, json_string
+
+
+class ReportResultStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.root_dir = tempfile.mkdtemp()
+        self.store = ReportResultStore(Mock(spec=RootLogger), self.root_dir)
+
+    def tearDown(self):
+        shutil.rmtree(self.root_dir)
+
+    def test_timeseries_results(self):
+        results = {
+            Aggregation.IND: {
+                '1|enwiki|3': {
+                    'edits': {'2013-01-01 00:00:00': 2, '2013-01-02 00:00:00': None},
+                    'bytes': {'2013-01-01 00:00:00': r(1.5), '2013-01-02 00:00:00': r(0)},
+                },
+                '2|dewiki|3': {
+                    'edits': {'2013-01-01 00:00:00': 10 ** 12, '2013-01-02 00:00:00': 0},
+                    'bytes': {'2013-01-01 00:00:00': r(-2), '2013-01-02 00:00:00': None},
+                },
+            },
+            Aggregation.SUM: {'edits': {'2013-01-01 00:00:00': r(2)}},
+        }
+        self.store.write('result-key', results)
+        stored = self.store.read('result-key')
+
+        assert_true(isinstance(stored[Aggregation.IND], IndividualResults))
+        assert_equal(stored, results)
+        assert_equal(
+            stored[Aggregation.IND]['2|dewiki|3']['bytes']['2013-01-01 00:00:00'],
+            Decimal('-2.0000')
+        )
+        assert_equal(json_string(stored), json_string(results))
+
+    def test_timeseries_keep_date_order(self):
+        dates = ['2013-01-{0:02d} 00:00:00'.format(day) for day in range(31, 0, -1)]
+        results = {
+            Aggregation.IND: {
+                '1|enwiki|3': {'edits': OrderedDict((date, 1) for date in dates)},
+                '2|enwiki|3': {'edits': OrderedDict((date, 2) for date in dates)},
+            },
+        }
+        self.store.write('result-key', results)
+        edits = self.store.read('result-key')[Aggregation.IND]['2|enwiki|3']['edits']
+
+        assert_true(isinstance(edits, OrderedDict))
+        assert_equal(edits.keys(), dates)
+
+    def test_simple_results(self):
+        results = {
+            Aggregation.IND: {
+                '1|enwiki|3': {'threshold': True, 'time_to_threshold': 4},
+                '2|enwiki|3': {'threshold': False, 'time_to_threshold': None},
+            },
+        }
+        self.store.write('result-key', results)
+        stored = self.store.read('result-key')
+
+        assert_equal(stored, results)
+        assert_equal(
+            sorted(stored[Aggregation.IND].rows()),
+            [
+                ('1', 'enwiki', '3', results[Aggregation.IND]['1|enwiki|3']),
+                ('2', 'enwiki', '3', results[Aggregation.IND]['2|enwiki|3']),
+            ]
+        )
+        assert_true(stored[Aggregation.IND]['1|enwiki|3']['threshold'] is True)
+
+    def test_results_that_do_not_fit_in_columns(self):
+        results = {
+            Aggregation.IND: {
+                '1|enwiki|3': {'edits': Decimal('1.5')},
+                '2|enwiki|3': {'edits': Decimal('1.50')},
+            },
+        }
+        self.store.write('result-key', results)
+        stored = self.store.read('result-key')
+
+        assert_equal(type(stored[Aggregation.IND]), dict)
+        assert_equal(stored, results)
+
+    def test_failure_results(self):
+        self.store.write('result-key', {'failure': 'cohort invalid'})
+        assert_equal(self.store.read('result-key'), {'failure': 'cohort invalid'})
+
+    def test_missing_results(self):
+        assert_false(self.store.exists('result-key'))
+        assert_equal(self.store.read('result-key'), None)
+        assert_equal(self.store.read('../result-key'), None)
+
+    def test_overwrite_and_remove(self):
+        self.store.write('result-key', {Aggregation.SUM: {'edits': 1}})
+        self.store.write('result-key', {Aggregation.SUM: {'edits': 2}})
+        assert_equal(self.store.read('result-key'), {Aggregation.SUM: {'edits': 2}})
+
+        self.store.remove('result-key')
+        assert_false(self.store.exists('result-key'))
+
+    def test_expire(self):
+        self.store.write('old-key', {Aggregation.SUM: {'edits': 1}})
+        self.store.write('new-key', {Aggregation.SUM: {'edits': 2}})
+        unfinished = os.path.join(self.root_dir, '.old-key.unfinished')
+        os.makedirs(unfinished)
+        long_ago = time.time() - timedelta(days=31).total_seconds()
+        for path in (self.store.get_result_path('old-key'), unfinished):
+            os.utime(path, (long_ago, long_ago))
+
+        assert_equal(self.store.expire(timedelta(days=30)), 1)
+        assert_false(self.store.exists('old-key'))
+        assert_false(os.path.exists(unfinished))
+        assert_equal(self.store.read('new-key'), {Aggregation.SUM: {'edits': 2}})
+
+    def test_expire_without_results(self):
+        store = ReportResultStore(Mock(spec=RootLogger), self.root_dir + '-missing')
+        assert_equal(store.expire(timedelta(days=30)), 0)
@@ -0,0 +1,60 @@
+import mock
+from unittest import TestCase
+from nose.tools import assert_equals, assert_true
+
+from wikimetrics.api import ReportSingleFlight
+
+
+class FakeRedis(object):
+
+    def __init__(self):
+        self.values = {}
+
+    def set(self, name, value, ex=None, nx=False):
+        if nx and name in self.values:
+            return None
+        self.values[name] = str(value)
+        return True
+
+    def get(self, name):
+        return self.values.get(name)
+
+    def exists(self, name):
+        return name in self.values
+
+    def delete(self, name):
+        self.values.pop(name, None)
+
+
+class ReportSingleFlightTest(TestCase):
+
+    def setUp(self):
+        self.redis = FakeRedis()
+        self.flight = ReportSingleFlight(self.redis, poll_interval=0, timeout=60)
+        self.key = self.flight.key(1, 3, {'name': 'NamespaceEdits'})
+
+    def test_key_depends_on_cohort_version_and_parameters(self):
+        assert_true(self.flight.key(1, 4, {'name': 'NamespaceEdits'}) != self.key)
+        assert_true(self.flight.key(1, 3, {'name': 'BytesAdded'}) != self.key)
+        assert_equals(self.flight.key(1, 3, {'name': 'NamespaceEdits'}), self.key)
+
+    def test_second_report_waits_for_the_first(self):
+        assert_equals(self.flight.lead(self.key, 10), None)
+        assert_equals(self.flight.lead(self.key, 11), '10')
+
+        def land(seconds):
+            self.flight.land(self.key, 10, 'result-10')
+
+        with mock.patch('time.sleep', side_effect=land):
+            assert_equals(self.flight.wait(self.key), 'result-10')
+        # the next identical report leads again
+        assert_equals(self.flight.lead(self.key, 12), None)
+
+    def test_failed_leader_lets_followers_run(self):
+        self.flight.lead(self.key, 10)
+        self.flight.land(self.key, 10, None)
+        assert_equals(self.flight.wait(self.key), None)
+
+    def test_redis_failure_runs_alone(self):
+        self.redis.set = mock.Mock(side_effect=Exception('redis is gone'))
+        assert_equals(self.flight.lead(self.key, 10), None)
@@ -0,0 +1,101 @@
+import mock
+import threading
+from unittest import TestCase
+from nose.tools import assert_equals, assert_raises, assert_true
+
+from wikimetrics.api import ReportStatusBuffer
+
+
+class ReportStatusBufferTest(TestCase):
+
+    def setUp(self):
+        self.buffer = ReportStatusBuffer(flush_delay=60, async_flush=False)
+        patcher = mock.patch('wikimetrics.configurables.db.get_engine')
+        self.engine = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.connection = self.engine.return_value.begin.return_value.__enter__()
+
+    def test_update_outside_batch_is_written(self):
+        self.buffer.update(1, status='STARTED')
+        assert_equals(self.connection.execute.call_count, 1)
+        assert_equals(self.buffer.pending, {})
+
+    def test_updates_in_batch_are_coalesced(self):
+        with self.buffer.batch():
+            # the first update is written, the last write was long ago
+            self.buffer.update(1, status='STARTED', queue_result_key='task')
+            self.buffer.update(1, status='PROGRESS 1/2 wiki')
+            self.buffer.update(1, result_key='result')
+            self.buffer.update(1, status='SUCCESS')
+            assert_equals(self.connection.execute.call_count, 1)
+
+        assert_equals(self.connection.execute.call_count, 2)
+        assert_equals(self.engine.return_value.begin.call_count, 2)
+        params = self.connection.execute.call_args[0][0].compile().params
+        assert_equals(params['status'], 'SUCCESS')
+        assert_equals(params['result_key'], 'result')
+
+    def test_nested_batches_flush_once(self):
+        with self.buffer.batch():
+            self.buffer.update(1, status='STARTED')
+            with self.buffer.batch():
+                self.buffer.update(2, status='STARTED')
+            assert_equals(self.buffer.pending.keys(), [2])
+        assert_equals(self.buffer.pending, {})
+        assert_equals(self.connection.execute.call_count, 2)
+
+    def test_failed_flush_keeps_updates(self):
+        self.connection.execute.side_effect = Exception('database is gone')
+        with self.buffer.batch():
+            self.buffer.last_flush = float('inf')
+            self.buffer.update(1, status='STARTED')
+            self.buffer.update(1, status='SUCCESS')
+            assert_raises(Exception, self.buffer.flush)
+            self.buffer.update(1, result_key='result')
+            assert_equals(self.buffer.pending, {
+                1: {'status': 'SUCCESS', 'result_key': 'result'}
+            })
+            self.connection.execute.side_effect = None
+
+    def test_flushes_are_written_in_order(self):
+        written = []
+        writing = threading.Event()
+        finish = threading.Event()
+
+        def execute(statement):
+            status = statement.compile().params['status']
+            if status == 'PROGRESS':
+                writing.set()
+                finish.wait(5)
+            written.append(status)
+        self.connection.execute.side_effect = execute
+
+        with self.buffer.batch():
+            self.buffer.last_flush = float('inf')
+            self.buffer.update(1, status='PROGRESS')
+            progress = threading.Thread(target=self.buffer.flush)
+            progress.start()
+            writing.wait(5)
+            self.buffer.update(1, status='SUCCESS')
+            success = threading.Thread(target=self.buffer.flush)
+            success.start()
+            finish.set()
+            progress.join(5)
+            success.join(5)
+
+        assert_equals(written, ['PROGRESS', 'SUCCESS'])
+
+    def test_update_without_later_updates_is_written_within_the_delay(self):
+        self.buffer = ReportStatusBuffer(flush_delay=0.1)
+        written = threading.Event()
+
+        def execute(statement):
+            if statement.compile().params['status'] == 'SUCCESS':
+                written.set()
+        self.connection.execute.side_effect = execute
+
+        with self.buffer.batch():
+            self.buffer.update(1, status='STARTED')
+            self.buffer.update(1, status='SUCCESS')
+            assert_equals(self.connection.execute.call_count, 1)
+            assert_true(written.wait(1))
@@ -9,7 +9,7 @@ from logging import RootLogger, getLogger
 from wikimetrics.api.batch import WriteReportTask, COALESCED_REPORT_FILE
 from wikimetrics.api import PublicReportFileManager
 from wikimetrics.exceptions import PublicReportIOError
-from wikimetrics.utils import json_string
+from wikimetrics.utils import json_string, format_date_for_public_report_file
 
 
 class WriteReportTaskTest(unittest.TestCase):
@@ -23,6 +23,8 @@ class WriteReportTaskTest(unittest.TestCase):
         file_manager.remove_file = Mock()
         file_manager.get_public_report_path = MagicMock(return_value=self.fake_path)
         file_manager.coalesce_recurrent_reports = MagicMock(return_value=self.results)
+        file_manager.append_run = MagicMock()
+        file_manager.update_coalesced_report = MagicMock()
         file_manager.remove_old_report_files = MagicMock()
         self.file_manager = file_manager
     
@@ -31,16 +33,22 @@ class WriteReportTaskTest(unittest.TestCase):
         Create a report on disk
         """
         today = date.today()
-        concatenated_report_filepath = os.path.join(self.fake_path,
-                                                    COALESCED_REPORT_FILE)
+        report_filepath = os.path.join(
+            self.fake_path, format_date_for_public_report_file(today)
+        )
         wr = WriteReportTask('123', today, self.results, self.file_manager)
         wr.run()
-        assert_equals(self.file_manager.write_data.call_count, 2)
+        assert_equals(self.file_manager.write_data.call_count, 1)
         assert_equals(self.file_manager.get_public_report_path.call_count, 1)
-        assert_equals(self.file_manager.coalesce_recurrent_reports.call_count, 1)
         assert_equals(self.file_manager.remove_old_report_files.call_count, 1)
-        self.file_manager.write_data.assert_called_with(concatenated_report_filepath,
+        self.file_manager.write_data.assert_called_with(report_filepath,
                                                         json_string(self.results))
+        # the new run is only logged, full_report.json is updated when requested
+        assert_equals(self.file_manager.coalesce_recurrent_reports.call_count, 0)
+        self.file_manager.append_run.assert_called_with(
+            '123', format_date_for_public_report_file(today), self.results
+        )
+        assert_equals(self.file_manager.update_coalesced_report.call_count, 0)
     
     @raises(PublicReportIOError)
     def test_problems_writing(self):
@@ -46,6 +46,13 @@ class CohortsControllerTest(WebTest):
         parsed = json.loads(response.data)
         assert_equal(parsed['cohorts'][0]['name'], self.cohort.name)
 
+    def test_cache_stats(self):
+        response = self.app.get('/cohorts/cache/stats')
+        parsed = json.loads(response.data)
+        assert_equal(response.status_code, 200)
+        assert_true('hits' in parsed)
+        assert_true('misses' in parsed)
+
     def test_list_includes_only_validated(self):
         # There is already one cohort, add one more validated and one not validated
         cohorts = [
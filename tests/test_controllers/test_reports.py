@@ -11,7 +11,7 @@ from datetime import date, timedelta
 from tests.fixtures import WebTest, mediawiki_project, second_mediawiki_project
 from wikimetrics.models import (
     ReportStore, WikiUserStore, CohortStore,
-    CohortWikiUserStore, MediawikiUser, TaskErrorStore
+    CohortWikiUserStore, MediawikiUser, TaskErrorStore, ReportProfileStore
 )
 from wikimetrics.api import PublicReportFileManager
 from wikimetrics.exceptions import InvalidCohort
@@ -166,6 +166,29 @@ class ReportsControllerTest(ControllerAsyncTest):
             '/reports should get the list of reports for the current user'
         )
 
+    def test_query_stats(self):
+        response = self.client.get('/reports/query-stats?limit=5')
+        parsed = json.loads(response.data)
+        assert_equal(response.status_code, 200)
+        assert_true(len(parsed['queries']) <= 5)
+        assert_true(all('seconds' in stat for stat in parsed['queries']))
+
+    def test_list_includes_profile(self):
+        response = self.client.get('/reports/list', follow_redirects=True)
+        report_ids = sorted(r['id'] for r in json.loads(response.data)['reports'])
+        ReportProfileStore.replace([{
+            'report_id': report_ids[0], 'node': 'MetricReport wiki',
+            'seconds': 1.5, 'count': 1,
+        }])
+
+        response = self.client.get('/reports/list', follow_redirects=True)
+        parsed = json.loads(response.data)
+        profiles = {r['id']: r['profile'] for r in parsed['reports']}
+        assert_equal(profiles[report_ids[0]], [
+            {'node': 'MetricReport wiki', 'seconds': 1.5, 'count': 1}
+        ])
+        assert_equal(profiles[report_ids[1]], [])
+
     def test_list_started(self):
         response = self.client.get('/reports/list', follow_redirects=True)
         parsed = json.loads(response.data)
@@ -65,6 +65,33 @@ class DatabaseSetupTest(TestCase):
         s = db.get_mw_session(mediawiki_project)
         s.execute('select 1').fetchall()
     
+    def test_mw_engines_share_host_pool(self):
+        wiki_engine = db.get_mw_engine(mediawiki_project)
+        dewiki_engine = db.get_mw_engine('dewiki')
+        assert_true(wiki_engine.pool is dewiki_engine.pool)
+        
+        database_template = db.config['MEDIAWIKI_DATABASE_TEMPLATE']
+        for project in [mediawiki_project, 'dewiki', mediawiki_project]:
+            database = db.get_mw_engine(project).execute(
+                'select database()'
+            ).scalar()
+            assert_equals(database, database_template.format(project))
+    
+    def test_mw_host_pool_is_sized_by_host_limit(self):
+        pool = db.get_mw_engine(mediawiki_project).pool
+        assert_equals(pool.size(), db.config['MEDIAWIKI_MAX_CONNECTIONS_PER_HOST'])
+        assert_equals(pool._max_overflow, db.config['MEDIAWIKI_MAX_OVERFLOW'])
+        assert_equals(pool._recycle, db.config['MEDIAWIKI_POOL_RECYCLE'])
+    
+    def test_mw_engine_for_unknown_host(self):
+        # second_mediawiki_project is not in the project host map
+        engine = db.get_mw_engine('wiki2')
+        assert_true(engine.pool is not db.get_mw_engine(mediawiki_project).pool)
+        assert_equals(
+            engine.execute('select database()').scalar(),
+            db.config['MEDIAWIKI_DATABASE_TEMPLATE'].format('wiki2'),
+        )
+    
     #def test_get_fresh_project_host_map(self):
         #project_host_map_cache_file = 'project_host_map.json'
         ## make sure any cached file is deleted
@@ -1,5 +1,7 @@
 import io
 import os
+import shutil
+import tempfile
 import unittest
 import json
 from mock import Mock
@@ -9,6 +11,7 @@ from logging import RootLogger
 from wikimetrics.configurables import app, db, get_absolute_path
 from wikimetrics.exceptions import PublicReportIOError
 from wikimetrics.api import PublicReportFileManager, COALESCED_REPORT_FILE
+from wikimetrics.api.file_manager import RUN_LOG_FILE, RUN_INDEX_FILE
 from wikimetrics.api.file_manager import _merge_run
 from wikimetrics.enums import Aggregation
 
@@ -101,6 +104,125 @@ class PublicReportFileMangerTest(unittest.TestCase):
         assert_equal({k for k in full_report['result'][Aggregation.IND]}, users_reported)
         assert_equal({k for k in full_report['result'][Aggregation.AVG]['edits']}, dates)
 
+    def write_runs(self, path, names):
+        """
+        Writes the test report files as runs of report 0000, like WriteReportTask
+        """
+        fixtures = os.sep.join((self.test_report_path, 'static', 'public', '0000'))
+        for name, f in zip(names, ['1.json', '2.json', '3.json']):
+            with open(os.sep.join((fixtures, f))) as json_file:
+                data = json_file.read()
+            self.api.write_data(os.sep.join((path, name)), data)
+            self.api.append_run('0000', name, json.loads(data))
+
+    def test_run_log(self):
+        """
+        The coalesced report is generated from the run log when it is asked for
+        """
+        self.api.root_dir = tempfile.mkdtemp()
+        try:
+            path = self.api.get_public_report_path('0000', recurrent=True, create=True)
+            names = ['2014-07-01', '2014-07-02', '2014-07-03']
+            self.write_runs(path, names[:2])
+            coalesced_path = self.api.get_coalesced_report_path('0000')
+            self.write_runs(path, names[2:])
+            assert_equal(coalesced_path, self.api.get_coalesced_report_path('0000'))
+
+            with open(coalesced_path) as json_file:
+                coalesced = json.load(json_file)
+            assert_equal(coalesced, self.api.coalesce_recurrent_reports('0000'))
+
+            index = self.api.read_run_index('0000')
+            assert_equal([run[0] for run in index['runs']], names)
+            assert_equal(index['coalesced_size'], index['log_size'])
+
+            since = self.api.coalesce_runs_since('0000', '2014-07-02')
+            with open(os.sep.join((path, names[2]))) as json_file:
+                assert_equal(since['result'], json.load(json_file)['result'])
+            assert_equal(self.api.coalesce_runs_since('0000', '2014-07-03'), {})
+
+            # old runs can be removed without being parsed as dates
+            self.api.remove_old_report_files('0000', days_ago=0)
+            assert_equal(
+                sorted(os.listdir(path)),
+                sorted([COALESCED_REPORT_FILE, RUN_INDEX_FILE, RUN_LOG_FILE])
+            )
+        finally:
+            shutil.rmtree(self.api.root_dir)
+
+    def test_run_index_is_rebuilt(self):
+        """
+        The run index is rebuilt from the run log if it does not match the log
+        """
+        self.api.root_dir = tempfile.mkdtemp()
+        try:
+            path = self.api.get_public_report_path('0000', recurrent=True, create=True)
+            self.write_runs(path, ['2014-07-01', '2014-07-02'])
+            index = self.api.read_run_index('0000')
+            os.remove(os.sep.join((path, RUN_INDEX_FILE)))
+            with open(os.sep.join((path, RUN_LOG_FILE)), 'ab') as log:
+                log.write('{"run": "2014-07-03", "rep')
+
+            rebuilt = self.api.read_run_index('0000')
+            assert_equal(rebuilt['runs'], index['runs'])
+            assert_equal(rebuilt['coalesced_size'], 0)
+
+            # the interrupted run is dropped when the next run is appended
+            self.write_runs(path, ['2014-07-03'])
+            runs = self.api.read_run_index('0000')['runs']
+            assert_equal(
+                [run[0] for run in runs],
+                ['2014-07-01', '2014-07-02', '2014-07-03']
+            )
+            with open(self.api.get_coalesced_report_path('0000')) as json_file:
+                assert_equal(len(json.load(json_file)['result']), 2)
+        finally:
+            shutil.rmtree(self.api.root_dir)
+
+    def test_rebuild_coalesced_report(self):
+        """
+        The coalesced report is rebuilt from the run log, even if it is corrupt
+        and the files of the runs were removed
+        """
+        self.api.root_dir = tempfile.mkdtemp()
+        try:
+            path = self.api.get_public_report_path('0000', recurrent=True, create=True)
+            self.write_runs(path, ['2014-07-01', '2014-07-02', '2014-07-03'])
+            with open(self.api.update_coalesced_report('0000')) as json_file:
+                coalesced = json.load(json_file)
+
+            self.api.remove_old_report_files('0000', days_ago=0)
+            self.api.write_data(os.sep.join((path, COALESCED_REPORT_FILE)), '{"res')
+            self.api.rebuild_coalesced_report('0000')
+            with open(os.sep.join((path, COALESCED_REPORT_FILE))) as json_file:
+                assert_equal(json.load(json_file), coalesced)
+
+            # a corrupt coalesced report is rebuilt when the next run is merged
+            self.api.write_data(os.sep.join((path, COALESCED_REPORT_FILE)), '{"res')
+            self.write_runs(path, ['2014-07-04'])
+            with open(self.api.update_coalesced_report('0000')) as json_file:
+                assert_equal(len(json.load(json_file)['result']), 2)
+        finally:
+            shutil.rmtree(self.api.root_dir)
+
+    def test_run_index_without_run_log(self):
+        """
+        The run index is emptied if the run log is missing
+        """
+        self.api.root_dir = tempfile.mkdtemp()
+        try:
+            path = self.api.get_public_report_path('0000', recurrent=True, create=True)
+            self.write_runs(path, ['2014-07-01', '2014-07-02'])
+            os.remove(os.sep.join((path, RUN_LOG_FILE)))
+
+            index = self.api.read_run_index('0000')
+            assert_equal(index['runs'], [])
+            assert_equal(index['log_size'], 0)
+            self.write_runs(path, ['2014-07-03'])
+            assert_equal(len(self.api.read_run_index('0000')['runs']), 1)
+        finally:
+            shutil.rmtree(self.api.root_dir)
+
     @raises(PublicReportIOError)
     def test_remove_recurrent_report(self):
         # Attempt to delete a non-existent recurrent report directory
@@ -9,10 +9,6 @@ from wikimetrics.enums import TimeseriesChoices
 
 
 class RollingActiveEditorTest(DatabaseTest):
-    """
-        TODO: add timeseries support and use the following tests:
-        gerrit.wikimedia.org/r/#/c/147312/5/tests/test_metrics/test_rolling_active_editor.py
-    """
     def runTest(self):
         pass
 
@@ -71,6 +67,70 @@ class RollingActiveEditorTest(DatabaseTest):
             results[self.editor_ids[x]][metric.id] for x in range(5)
         ])
 
+    def test_validates_timeseries(self):
+        metric = RollingActiveEditor(
+            start_date=self.r_plus_30,
+            end_date=s(d(self.r)),
+            timeseries=TimeseriesChoices.DAY,
+        )
+        assert_false(metric.validate())
+
+    def test_timeseries(self):
+        metric = RollingActiveEditor(
+            start_date='2014-01-29 00:00:00',
+            end_date='2014-02-01 00:00:00',
+            timeseries=TimeseriesChoices.DAY,
+        )
+        results = metric(self.editor_ids, self.mwSession)
+
+        days = ['2014-01-29 00:00:00', '2014-01-30 00:00:00', '2014-01-31 00:00:00']
+        assert_equal([
+            [results[self.editor_ids[x]][metric.id][day] for day in days]
+            for x in range(5)
+        ], [
+            [1, 1, 0],
+            [0, 0, 1],
+            [1, 1, 0],
+            [0, 0, 1],
+            # the edit at midnight counts as of the end of the 30th
+            [0, 1, 0],
+        ])
+
+    def test_timeseries_matches_each_day(self):
+        self.archive_revisions()
+        metric = RollingActiveEditor(
+            start_date='2014-01-29 00:00:00',
+            end_date='2014-02-01 00:00:00',
+            timeseries=TimeseriesChoices.DAY,
+            rolling_days=20,
+            number_of_edits=3,
+        )
+        results = metric(self.editor_ids, self.mwSession)
+
+        for day in range(29, 32):
+            as_of = datetime(2014, 1, day) + timedelta(days=1)
+            day_metric = RollingActiveEditor(
+                end_date=as_of, rolling_days=20, number_of_edits=3,
+            )
+            day_results = day_metric(self.editor_ids, self.mwSession)
+            for user_id in self.editor_ids:
+                assert_equal(
+                    results[user_id][metric.id][s(datetime(2014, 1, day))],
+                    day_results[user_id][metric.id],
+                )
+
+    def test_timeseries_wiki_cohort(self):
+        metric = RollingActiveEditor(
+            start_date='2014-01-31 00:00:00',
+            end_date='2014-02-01 00:00:00',
+            timeseries=TimeseriesChoices.DAY,
+        )
+        results = metric(None, self.mwSession)
+
+        assert_equal(set(results.keys()), set([
+            self.editor_ids[1], self.editor_ids[3]
+        ]))
+
     def test_normal_cohort_with_archived_revisions(self):
         self.archive_revisions()
         self.test_normal_cohort()
@@ -6,6 +6,7 @@ from wikimetrics.utils import format_pretty_date as s
 from wikimetrics.models import Revision, Logging, MediawikiUser
 from wikimetrics.metrics import RollingNewActiveEditor
 from wikimetrics.enums import TimeseriesChoices
+from wikimetrics.configurables import db
 
 
 class RollingNewActiveEditorTest(DatabaseTest):
@@ -91,6 +92,15 @@ class RollingNewActiveEditorTest(DatabaseTest):
         self.archive_revisions()
         self.test_normal_cohort()
 
+    def test_normal_cohort_through_temporary_table(self):
+        threshold = db.config['COHORT_TEMPORARY_TABLE_THRESHOLD']
+        db.config['COHORT_TEMPORARY_TABLE_THRESHOLD'] = 1
+        try:
+            self.archive_revisions()
+            self.test_normal_cohort()
+        finally:
+            db.config['COHORT_TEMPORARY_TABLE_THRESHOLD'] = threshold
+
     def test_wiki_cohort(self):
         # make one of the non-cohort users, who registered on self.r, active
         make_active = self.non_editors[0]
@@ -5,6 +5,8 @@ from nose.tools import assert_equal
 from tests.fixtures import DatabaseTest, i, tz_note
 from wikimetrics.utils import format_date, CENSORED
 from wikimetrics.metrics import Threshold
+from wikimetrics.configurables import db
+from wikimetrics.models import drop_cohort_tables
 
 
 class ThresholdTest(DatabaseTest):
@@ -77,6 +79,15 @@ class ThresholdTest(DatabaseTest):
         assert_equal(results[self.e1][CENSORED], False, tz_note)
         assert_equal(results[self.e2][CENSORED], False, tz_note)
     
+    def test_case1_24h_count1_through_temporary_table(self):
+        threshold = db.config['COHORT_TEMPORARY_TABLE_THRESHOLD']
+        db.config['COHORT_TEMPORARY_TABLE_THRESHOLD'] = 1
+        try:
+            self.test_case1_24h_count1()
+        finally:
+            db.config['COHORT_TEMPORARY_TABLE_THRESHOLD'] = threshold
+            drop_cohort_tables(self.mwSession)
+    
     def test_case1_72h_count1(self):
         metric = Threshold(
             namespaces=[0],
@@ -130,3 +141,18 @@ class ThresholdTest(DatabaseTest):
         
         assert_equal(results[self.e1][Threshold.time_to_threshold_id], 25, tz_note)
         assert_equal(results[self.e2][Threshold.time_to_threshold_id], None, tz_note)
+    
+    def test_time_to_threshold_of_each_editor(self):
+        metric = Threshold(
+            namespaces=[0],
+            threshold_hours=72,
+            number_of_edits=2,
+        )
+        results = metric(self.editor_ids, self.mwSession)
+        
+        assert_equal(results[self.e1][Threshold.id], True, tz_note)
+        assert_equal(results[self.e2][Threshold.id], True, tz_note)
+        assert_equal(results[self.e1][Threshold.time_to_threshold_id], 25, tz_note)
+        assert_equal(results[self.e2][Threshold.time_to_threshold_id], 40, tz_note)
+        assert_equal(results[self.e1][CENSORED], False, tz_note)
+        assert_equal(results[self.e2][CENSORED], False, tz_note)
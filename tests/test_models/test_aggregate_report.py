@@ -1,9 +1,13 @@
+from unittest import TestCase
 from nose.tools import assert_equals, assert_true
 
-from wikimetrics.utils import r
+from wikimetrics.utils import r, NO_RESULTS
 from wikimetrics.enums import Aggregation, TimeseriesChoices
 from wikimetrics.metrics import metric_classes, NamespaceEdits
 from wikimetrics.models import AggregateReport, CohortStore
+from wikimetrics.models.report_nodes.aggregate_report import (
+    ResultAccumulator, RunningStatistics
+)
 from ..fixtures import QueueDatabaseTest, DatabaseTest
 
 
@@ -48,6 +52,33 @@ class AggregateReportTest(QueueDatabaseTest):
             result[Aggregation.STD]['edits'],
             r(1.0)
         )
+    
+    def test_running_again_does_not_count_twice(self):
+        metric = metric_classes['NamespaceEdits'](
+            name='NamespaceEdits',
+            namespaces=[0, 1, 2],
+            start_date='2013-01-01 00:00:00',
+            end_date='2013-01-02 00:00:00',
+        )
+        options = {
+            'individualResults': False,
+            'aggregateResults': True,
+            'aggregateSum': True,
+            'aggregateAverage': True,
+            'aggregateStandardDeviation': False,
+        }
+        
+        ar = AggregateReport(
+            metric,
+            self.cohort,
+            options,
+            user_id=self.owner_user_id,
+        )
+        first = ar.task.delay(ar).get()
+        second = ar.task.delay(ar).get()
+        
+        assert_equals(first, second)
+        assert_equals(second[Aggregation.AVG]['edits'], r(1.0))
 
 
 class AggregateReportWithoutQueueTest(DatabaseTest):
@@ -308,6 +339,71 @@ class AggregateReportTimeseriesTest(QueueDatabaseTest):
             {'date3': r(1.15), 'date4': r(1.7)}
         )
 
+
+class ResultAccumulatorTest(TestCase):
+    
+    def test_streaming_matches_merged(self):
+        types = [Aggregation.SUM, Aggregation.AVG, Aggregation.STD]
+        first = {
+            'a|wiki|1': {'edits': {'date1': 1, 'date2': 2}, 'bytes': r(2.3)},
+            'b|wiki|1': {'edits': {'date1': 0, 'date2': 1}, 'bytes': 0},
+        }
+        second = {
+            'a|dewiki|1': {'edits': {'date1': 0, 'date2': 0}, 'bytes': r(3.4)},
+            'b|dewiki|1': {'edits': {'date1': None, 'date2': 7}, 'bytes': None},
+        }
+        merged = dict(first)
+        merged.update(second)
+        
+        streamed = ResultAccumulator()
+        streamed.add(first)
+        streamed.add(second)
+        at_once = ResultAccumulator()
+        at_once.add(merged)
+        
+        assert_equals(streamed.aggregate(types), at_once.aggregate(types))
+        assert_equals(streamed.aggregate(types)[Aggregation.SUM]['bytes'], r(5.7))
+        assert_equals(
+            streamed.aggregate(types)[Aggregation.STD]['edits'],
+            {'date1': r(0.4714), 'date2': r(2.6926)}
+        )
+    
+    def test_no_results_counted_once(self):
+        accumulator = ResultAccumulator()
+        accumulator.add({NO_RESULTS: {'edits': 0}})
+        accumulator.add({'a|wiki|1': {'edits': 4}})
+        accumulator.add({NO_RESULTS: {'edits': 0}})
+        
+        assert_equals(
+            accumulator.aggregate([Aggregation.AVG])[Aggregation.AVG]['edits'],
+            r(2.0)
+        )
+    
+    def test_running_statistics(self):
+        one_at_a_time = RunningStatistics()
+        for value in [1, 2, 3, 4]:
+            one_at_a_time.add(value)
+        blocks = RunningStatistics.from_sums(2, 3, 5)
+        blocks.merge(RunningStatistics.from_sums(2, 7, 25))
+        
+        for statistics in [one_at_a_time, blocks]:
+            assert_equals(statistics.count, 4)
+            assert_equals(statistics.mean, 2.5)
+            assert_equals(statistics.m2, 5)
+            assert_equals(statistics.total, 10)
+    
+    def test_running_statistics_of_decimals(self):
+        statistics = RunningStatistics()
+        for value in [r(0.1), r(0.2), 0.3, 4]:
+            statistics.add(value)
+        
+        aggregates = statistics.aggregate(
+            [Aggregation.SUM, Aggregation.AVG, Aggregation.STD]
+        )
+        assert_equals(aggregates[Aggregation.SUM], r(4.6))
+        assert_equals(aggregates[Aggregation.AVG], r(1.15))
+        assert_equals(aggregates[Aggregation.STD], r(1.6470))
+
 """
 NOTE: a sample output of AggregateReport:
 {
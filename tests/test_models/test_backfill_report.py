@@ -0,0 +1,183 @@
+from datetime import datetime, timedelta
+from unittest import TestCase
+from nose.tools import assert_equals, assert_true
+
+from tests.fixtures import DatabaseTest
+from wikimetrics.models import RunReport, ReportStore, BackfillReport
+from wikimetrics.metrics import NamespaceEdits, PagesCreated, RollingActiveEditor
+from wikimetrics.models.report_nodes.backfill_report import split_results_by_day
+from wikimetrics.enums import Aggregation, TimeseriesChoices
+from wikimetrics.utils import stringify, strip_time
+
+
+class SplitResultsByDayTest(TestCase):
+
+    def setUp(self):
+        self.days = [datetime(2013, 1, 1), datetime(2013, 1, 2)]
+        self.results = {
+            Aggregation.IND: {
+                '1|wiki|1': {'edits': {
+                    '2013-01-01 00:00:00': 2,
+                    '2013-01-02 00:00:00': 0,
+                }},
+                '2|wiki|1': {'edits': {
+                    '2013-01-01 00:00:00': 1,
+                    '2013-01-02 00:00:00': 3,
+                }},
+            },
+            Aggregation.SUM: {'edits': {
+                '2013-01-01 00:00:00': 3,
+                '2013-01-02 00:00:00': 3,
+            }},
+        }
+
+    def test_split_without_timeseries(self):
+        by_day = list(split_results_by_day(
+            self.results, self.days, TimeseriesChoices.NONE
+        ))
+        assert_equals(by_day, [
+            {
+                Aggregation.IND: {'1|wiki|1': {'edits': 2}, '2|wiki|1': {'edits': 1}},
+                Aggregation.SUM: {'edits': 3},
+            },
+            {
+                Aggregation.IND: {'1|wiki|1': {'edits': 0}, '2|wiki|1': {'edits': 3}},
+                Aggregation.SUM: {'edits': 3},
+            },
+        ])
+
+    def test_split_by_month(self):
+        by_day = list(split_results_by_day(
+            self.results, self.days, TimeseriesChoices.MONTH
+        ))
+        assert_equals(by_day[1], {
+            Aggregation.IND: {
+                '1|wiki|1': {'edits': {'2013-01-02 00:00:00': 0}},
+                '2|wiki|1': {'edits': {'2013-01-02 00:00:00': 3}},
+            },
+            Aggregation.SUM: {'edits': {'2013-01-02 00:00:00': 3}},
+        })
+
+    def test_split_by_hour(self):
+        slices = {
+            '2013-01-01 00:00:00': 1,
+            '2013-01-01 23:00:00': 2,
+            '2013-01-02 00:00:00': 3,
+        }
+        results = {Aggregation.SUM: {'edits': slices}}
+        by_day = list(split_results_by_day(results, self.days, TimeseriesChoices.HOUR))
+        assert_equals(by_day[0][Aggregation.SUM]['edits'].items(), [
+            ('2013-01-01 00:00:00', 1),
+            ('2013-01-01 23:00:00', 2),
+        ])
+        assert_equals(by_day[1][Aggregation.SUM]['edits'].items(), [
+            ('2013-01-02 00:00:00', 3),
+        ])
+
+
+class BackfillMidnightTest(DatabaseTest):
+    """
+    An edit made exactly at midnight belongs to the run of the day it ends
+    """
+
+    def setUp(self):
+        DatabaseTest.setUp(self)
+        self.create_test_cohort(
+            editor_count=1,
+            revisions_per_editor=2,
+            revision_timestamps=[[20130101000000, 20130102000000]],
+            user_registrations=20121231000000,
+            revision_lengths=10,
+            page_count=1,
+            page_timestamps=20130102000000,
+        )
+        self.days = [datetime(2013, 1, 1), datetime(2013, 1, 2)]
+
+    def assert_split_matches_daily_runs(self, metric_class, **parameters):
+        metric = metric_class(
+            start_date=self.days[0],
+            end_date=self.days[-1] + timedelta(days=1),
+            timeseries=TimeseriesChoices.DAY,
+            **parameters
+        )
+        metric.backfill = True
+        assert_true(metric.supports_backfill())
+        results = {Aggregation.IND: metric(self.editor_ids, self.mwSession)}
+        by_day = split_results_by_day(results, self.days, TimeseriesChoices.NONE)
+
+        for day, day_results in zip(self.days, by_day):
+            run = metric_class(
+                start_date=day, end_date=day + timedelta(days=1), **parameters
+            )
+            assert_equals(
+                day_results[Aggregation.IND], run(self.editor_ids, self.mwSession)
+            )
+
+    def test_hourly_timeseries_are_not_backfilled(self):
+        metric = NamespaceEdits(timeseries=TimeseriesChoices.HOUR)
+        assert_equals(metric.supports_backfill(), False)
+
+    def test_split_matches_daily_runs(self):
+        self.assert_split_matches_daily_runs(
+            RollingActiveEditor, rolling_days=1, number_of_edits=2
+        )
+
+    def test_namespace_edits_split_matches_daily_runs(self):
+        self.assert_split_matches_daily_runs(NamespaceEdits)
+
+    def test_pages_created_split_matches_daily_runs(self):
+        self.assert_split_matches_daily_runs(PagesCreated)
+
+
+class BackfillReportTest(DatabaseTest):
+
+    def setUp(self):
+        DatabaseTest.setUp(self)
+        self.common_cohort_1()
+        self.today = strip_time(datetime.today())
+
+        parameters = {
+            'metric': {
+                'start_date': self.today - timedelta(days=11),
+                'end_date': self.today,
+                'name': 'NamespaceEdits',
+            },
+            'recurrent': True,
+            'cohort': {'id': self.cohort.id, 'name': self.cohort.name},
+            'name': 'test-backfill-reports',
+        }
+        self.report = ReportStore(
+            recurrent=True,
+            created=self.today - timedelta(days=11),
+            parameters=stringify(parameters),
+            user_id=self.owner_user_id,
+        )
+        self.session.add(self.report)
+        self.session.commit()
+
+        # leave today and days 1 and 2 ago out, to have a gap in the missed days
+        runs = []
+        for d in range(3, 11):
+            runs.append(ReportStore(
+                recurrent_parent_id=self.report.id,
+                created=self.today - timedelta(days=d),
+                status='SUCCESS',
+                parameters=stringify(parameters),
+                user_id=self.owner_user_id,
+            ))
+        self.session.add_all(runs)
+        self.session.commit()
+
+    def test_create_backfills(self):
+        new_runs = RunReport.create_reports_for_missed_days(self.report, self.session)
+        reports = BackfillReport.create_backfills(self.report, new_runs)
+
+        assert_equals(len(reports), 2)
+        assert_true(isinstance(reports[0], RunReport))
+        assert_equals(reports[0].created, self.today - timedelta(days=11))
+        assert_true(isinstance(reports[1], BackfillReport))
+        assert_equals(
+            [run.created for run in reports[1].runs],
+            [self.today - timedelta(days=d) for d in (2, 1, 0)]
+        )
+        assert_equals(reports[1].days[0], self.today - timedelta(days=3))
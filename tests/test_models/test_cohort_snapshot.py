@@ -0,0 +1,54 @@
+import pickle
+from unittest import TestCase
+from nose.tools import assert_equals, assert_false, assert_true, raises
+
+from wikimetrics.models import CohortSnapshot
+from wikimetrics.models.storage import WikiUserKey
+
+
+class CohortSnapshotTest(TestCase):
+
+    def setUp(self):
+        self.snapshot = CohortSnapshot(3, 'enwiki', 0, [
+            ('dewiki', 5, 'Dan'),
+            ('enwiki', 1, 'Ann'),
+            ('enwiki', 2, 'Bob'),
+        ])
+
+    def test_len(self):
+        assert_equals(len(self.snapshot), 3)
+
+    def test_group_by_project(self):
+        by_project = [
+            (project, list(user_ids))
+            for project, user_ids in self.snapshot.group_by_project()
+        ]
+        assert_equals(by_project, [('dewiki', [5]), ('enwiki', [1, 2])])
+        assert_equals(type(by_project[0][1][0]), int)
+
+    def test_group_by_project_empty(self):
+        snapshot = CohortSnapshot(3, 'enwiki', 0, [])
+        assert_equals(snapshot.group_by_project(), [('enwiki', None)])
+
+    def test_usernames_by_key(self):
+        assert_equals(self.snapshot.usernames_by_key(), {
+            WikiUserKey(5, 'dewiki', 3): 'Dan',
+            WikiUserKey(1, 'enwiki', 3): 'Ann',
+            WikiUserKey(2, 'enwiki', 3): 'Bob',
+        })
+
+    @raises(ValueError)
+    def test_immutable_after_pickling(self):
+        snapshot = pickle.loads(pickle.dumps(self.snapshot, pickle.HIGHEST_PROTOCOL))
+        assert_equals(len(snapshot), 3)
+        snapshot.user_ids[0] = 10
+
+    def test_is_current(self):
+        class Store(object):
+            id = 3
+            membership_version = 0
+
+        cohort = Store()
+        assert_true(self.snapshot.is_current(cohort))
+        cohort.membership_version = 1
+        assert_false(self.snapshot.is_current(cohort))
@@ -1,7 +1,9 @@
-from nose.tools import assert_equals, assert_true
+from nose.tools import assert_equals, assert_true, raises
+from sqlalchemy.exc import OperationalError
+from wikimetrics.configurables import db
 from wikimetrics.metrics import metric_classes
 from wikimetrics.models import (
-    MetricReport
+    MetricReport, ReportStore
 )
 from ..fixtures import DatabaseTest
 
@@ -49,3 +51,93 @@ class MetricReportTest(DatabaseTest):
         )
         
         assert_true(str(mr).find('MetricReport') >= 0)
+    
+    def test_run_in_chunks(self):
+        metric = metric_classes['NamespaceEdits'](
+            name='NamespaceEdits',
+            namespaces=[0, 1, 2],
+            start_date='2013-01-01 00:00:00',
+            end_date='2013-01-02 00:00:00',
+        )
+        report = ReportStore(status='STARTED')
+        self.session.add(report)
+        self.session.commit()
+        mr = MetricReport(metric, self.cohort.id, self.editor_ids, 'wiki')
+        mr.progress_report_id = report.id
+        
+        chunk_size = db.config['METRIC_CHUNK_SIZE']
+        db.config['METRIC_CHUNK_SIZE'] = 3
+        try:
+            result = mr.run()
+        finally:
+            db.config['METRIC_CHUNK_SIZE'] = chunk_size
+        
+        assert_equals(len(result), 4)
+        assert_equals(result[self.editor(0)]['edits'], 2)
+        assert_equals(result[self.editor(1)]['edits'], 2)
+        self.session.expire_all()
+        assert_equals(self.session.query(ReportStore).get(report.id).status,
+                      'PROGRESS 2/2 wiki')
+    
+    def test_run_in_chunks_retries(self):
+        metric = FlakyMetric(metric_classes['NamespaceEdits'](
+            name='NamespaceEdits',
+            namespaces=[0, 1, 2],
+            start_date='2013-01-01 00:00:00',
+            end_date='2013-01-02 00:00:00',
+        ), failures=2)
+        mr = MetricReport(metric, self.cohort.id, self.editor_ids, 'wiki')
+        
+        chunk_size = db.config['METRIC_CHUNK_SIZE']
+        retries = db.config['METRIC_CHUNK_RETRIES']
+        db.config['METRIC_CHUNK_SIZE'] = 2
+        db.config['METRIC_CHUNK_RETRIES'] = 2
+        try:
+            result = mr.run()
+        finally:
+            db.config['METRIC_CHUNK_SIZE'] = chunk_size
+            db.config['METRIC_CHUNK_RETRIES'] = retries
+        
+        assert_equals(metric.calls, 4)
+        assert_equals(result[self.editor(0)]['edits'], 2)
+    
+    @raises(OperationalError)
+    def test_run_in_chunks_gives_up(self):
+        metric = FlakyMetric(metric_classes['NamespaceEdits'](
+            name='NamespaceEdits',
+            namespaces=[0, 1, 2],
+            start_date='2013-01-01 00:00:00',
+            end_date='2013-01-02 00:00:00',
+        ), failures=3)
+        mr = MetricReport(metric, self.cohort.id, self.editor_ids, 'wiki')
+        
+        chunk_size = db.config['METRIC_CHUNK_SIZE']
+        retries = db.config['METRIC_CHUNK_RETRIES']
+        db.config['METRIC_CHUNK_SIZE'] = 2
+        db.config['METRIC_CHUNK_RETRIES'] = 2
+        try:
+            mr.run()
+        finally:
+            db.config['METRIC_CHUNK_SIZE'] = chunk_size
+            db.config['METRIC_CHUNK_RETRIES'] = retries
+
+
+class FlakyMetric(object):
+    """
+    Wraps a metric, failing the first few times it is called
+    """
+    def __init__(self, metric, failures):
+        self.metric = metric
+        self.id = metric.id
+        self.default_result = metric.default_result
+        self.failures = failures
+        self.calls = 0
+    
+    def supports_chunking(self):
+        return True
+    
+    def __call__(self, user_ids, session):
+        self.calls += 1
+        if self.calls <= self.failures:
+            raise OperationalError('select', {}, Exception('lost connection'))
+        return self.metric(user_ids, session)
@@ -1,4 +1,6 @@
-from nose.tools import assert_equals, assert_true
+import time
+from nose.tools import assert_equals, assert_true, raises
+from wikimetrics.configurables import db
 from wikimetrics.metrics import metric_classes
 from wikimetrics.models import (
     MultiProjectMetricReport,
@@ -61,3 +63,64 @@ class MultiProjectMetricReportWithoutQueueTest(DatabaseTest):
         mr = MultiProjectMetricReport(self.cohort, metric)
         
         assert_true(str(mr).find('MultiProjectMetricReport') >= 0)
+    
+    def test_run_children_in_parallel_keeps_order(self):
+        metric = metric_classes['NamespaceEdits'](
+            name='NamespaceEdits',
+            namespaces=[0, 1, 2],
+            start_date='2013-05-01 00:00:00',
+            end_date='2013-09-01 00:00:00',
+        )
+        mr = MultiProjectMetricReport(self.cohort, metric)
+        mr.children = [
+            SlowChild('wiki', 0.05, {'a': 1}),
+            SlowChild('wiki2', 0.01, {'b': 2}),
+            SlowChild('dewiki', 0, {'a': 3}),
+        ]
+        
+        parallel = db.config['MEDIAWIKI_PARALLEL_PROJECTS']
+        db.config['MEDIAWIKI_PARALLEL_PROJECTS'] = 3
+        try:
+            child_results = mr.run_children()
+        finally:
+            db.config['MEDIAWIKI_PARALLEL_PROJECTS'] = parallel
+        
+        assert_equals(child_results, [{'a': 1}, {'b': 2}, {'a': 3}])
+        assert_equals(mr.finish(child_results), {'a': 3, 'b': 2})
+    
+    @raises(ValueError)
+    def test_run_children_in_parallel_raises(self):
+        metric = metric_classes['NamespaceEdits'](
+            name='NamespaceEdits',
+            namespaces=[0, 1, 2],
+            start_date='2013-05-01 00:00:00',
+            end_date='2013-09-01 00:00:00',
+        )
+        mr = MultiProjectMetricReport(self.cohort, metric)
+        mr.children = [
+            SlowChild('wiki', 0, {'a': 1}),
+            SlowChild('wiki2', 0, ValueError('failed')),
+        ]
+        
+        parallel = db.config['MEDIAWIKI_PARALLEL_PROJECTS']
+        db.config['MEDIAWIKI_PARALLEL_PROJECTS'] = 2
+        try:
+            mr.run_children()
+        finally:
+            db.config['MEDIAWIKI_PARALLEL_PROJECTS'] = parallel
+
+
+class SlowChild(object):
+    """
+    Stands in for a MetricReport, returns (or raises) result after sleeping
+    """
+    def __init__(self, project, seconds, result):
+        self.project = project
+        self.seconds = seconds
+        self.result = result
+    
+    def run(self):
+        time.sleep(self.seconds)
+        if isinstance(self.result, Exception):
+            raise self.result
+        return self.result
@@ -2,7 +2,8 @@
 from nose.tools import assert_equals, assert_true, assert_raises
 from wikimetrics.metrics import metric_classes
 from wikimetrics.models import (
-    Report, ReportNode, ReportLeaf, MetricReport, ReportStore, TaskErrorStore
+    Report, ReportNode, ReportLeaf, MetricReport, ReportStore, TaskErrorStore,
+    ReportProfileStore
 )
 from wikimetrics.models import queue_task
 from ..fixtures import QueueDatabaseTest, DatabaseTest
@@ -69,6 +70,22 @@ class QueueTaskTest(QueueDatabaseTest):
         assert_equals(te.task_id, fr.persistent_id)
         assert_equals(te.message, 'RuntimeError: message')
     
+    def test_queue_task_stores_profile(self):
+        fr = FakeReport()
+
+        def run_profiled():
+            for i in range(2):
+                with fr.profile('FakeReport.step'):
+                    pass
+            return 'hello world'
+
+        fr.callback = run_profiled
+        queue_task(fr)
+        profiles = ReportProfileStore.get_profiles(self.session, [fr.persistent_id])
+        assert_equals(len(profiles[fr.persistent_id]), 1)
+        assert_equals(profiles[fr.persistent_id][0]['node'], 'FakeReport.step')
+        assert_equals(profiles[fr.persistent_id][0]['count'], 2)
+    
     def test_set_status(self):
         fr = FakeReport()
         fr.set_status('STARTED')
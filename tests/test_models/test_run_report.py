@@ -1,4 +1,5 @@
 import time
+from copy import deepcopy
 from datetime import timedelta, datetime
 from sqlalchemy import func
 from nose.tools import assert_equals, assert_true, raises
@@ -9,11 +10,12 @@ from celery import states
 from tests.fixtures import QueueDatabaseTest, DatabaseTest
 from wikimetrics.api import ReplicationLagService
 from wikimetrics.models import RunReport, ReportStore, WikiUserStore, CohortWikiUserStore
+from wikimetrics.models.storage.report import RESULT_STORED
 from wikimetrics.exceptions import InvalidCohort
 from wikimetrics.metrics import metric_classes
 from wikimetrics.utils import stringify, strip_time
 from wikimetrics.enums import Aggregation, TimeseriesChoices
-from wikimetrics.configurables import queue
+from wikimetrics.configurables import queue, db
 from wikimetrics.schedules.daily import recurring_reports
 
 
@@ -252,6 +254,49 @@ class RunReportTest(QueueDatabaseTest):
             2,
         )
 
+    def test_identical_running_report_is_reused(self):
+        parameters = {
+            'name': 'Edits - test',
+            'cohort': {
+                'id': self.cohort.id,
+                'name': self.cohort.name,
+            },
+            'metric': {
+                'name': 'NamespaceEdits',
+                'namespaces': [0, 1, 2],
+                'start_date': '2013-01-01 00:00:00',
+                'end_date': '2013-01-02 00:00:00',
+                'individualResults': True,
+                'aggregateResults': True,
+                'aggregateSum': True,
+                'aggregateAverage': False,
+                'aggregateStandardDeviation': False,
+            },
+        }
+        first = RunReport(deepcopy(parameters), user_id=self.owner_user_id)
+        first.task.delay(first).get()
+        self.session.commit()
+        first_key = self.session.query(ReportStore).get(first.persistent_id).result_key
+
+        with patch(
+            'wikimetrics.models.report_nodes.run_report.report_single_flight'
+        ) as flight:
+            flight.enabled.return_value = True
+            flight.lead.return_value = str(first.persistent_id)
+            flight.wait.return_value = first_key
+            second = RunReport(deepcopy(parameters), user_id=self.owner_user_id)
+            with patch.object(second.children[0], 'run') as run:
+                results = second.task.delay(second).get()
+                assert_equals(run.call_count, 0)
+
+        self.session.commit()
+        second_store = self.session.query(ReportStore).get(second.persistent_id)
+        assert_true(second_store.result_key != first_key)
+        assert_equals(second_store.status, states.SUCCESS)
+        results = results[second_store.result_key]
+        assert_equals(results[Aggregation.IND][self.editor(0)]['edits'], 2)
+        assert_equals(results[Aggregation.SUM]['edits'], 4)
+
     def test_raises_invalid_cohort_for_any_metric(self):
         self.cohort.validated = False
         self.session.commit()
@@ -418,6 +463,44 @@ class RunReportTest(QueueDatabaseTest):
             2,
         )
 
+    def test_results_are_read_from_the_result_store(self):
+        parameters = {
+            'name': 'Edits - test',
+            'cohort': {
+                'id': self.cohort.id,
+                'name': self.cohort.name,
+            },
+            'metric': {
+                'name': 'NamespaceEdits',
+                'namespaces': [0, 1, 2],
+                'start_date': '2013-01-01 00:20:00',
+                'end_date': '2013-03-01 00:00:00',
+                'timeseries': TimeseriesChoices.MONTH,
+                'individualResults': True,
+                'aggregateResults': True,
+                'aggregateSum': True,
+                'aggregateAverage': False,
+                'aggregateStandardDeviation': False,
+            },
+        }
+        # as in production, where only the result store has the results
+        db.config['RESULT_STORE_QUEUE_RESULTS'] = False
+        try:
+            jr = RunReport(parameters, user_id=self.owner_user_id)
+            queue_results = jr.task.delay(jr).get()
+        finally:
+            db.config['RESULT_STORE_QUEUE_RESULTS'] = True
+        self.session.commit()
+        report = self.session.query(ReportStore).get(jr.persistent_id)
+
+        assert_true(set(queue_results.values()) == set([RESULT_STORED]))
+        results = report.get_result_safely(queue_results)
+        edits = results[Aggregation.IND][self.editor(0)]['edits']
+        assert_equals(edits.keys()[0], '2013-01-01 00:20:00')
+        assert_equals(edits.keys(), sorted(edits.keys()))
+        assert_equals(results[Aggregation.SUM]['edits']['2013-01-01 00:20:00'], 8)
+        assert_equals(results[Aggregation.SUM]['edits']['2013-02-01 00:00:00'], 2)
+
     # TODO: This is weird, the exception seems to be thrown
     # But the line is still showing as not covered by tests
     def test_invalid_metric(self):
@@ -1,6 +1,8 @@
 import unittest
 import mock
 import os
+from sqlalchemy import create_engine, select
+from sqlalchemy.dialects import mysql
 from nose.tools import assert_equal, raises, assert_true, assert_false, nottest
 from wikimetrics.configurables import app, get_absolute_path
 from tests.fixtures import WebTest, QueueDatabaseTest, DatabaseTest, mediawiki_project
@@ -9,6 +11,8 @@ from wikimetrics.models import (
     CohortStore, WikiUserStore, UserStore,
     MediawikiUser, ValidateCohort, normalize_project,
 )
+from wikimetrics.models.validate_cohort import update_wiki_users, write_validation_results
+from wikimetrics.models.centralauth import CentralAuthLocalUser
 from wikimetrics.utils import parse_username
 
 
@@ -332,6 +336,36 @@ class ValidateCohortQueueTest(QueueDatabaseTest):
         assert_equal(self.session.query(WikiUserStore).filter(
             WikiUserStore.raw_id_or_name == 'Nonexisting2').one().valid, False)
 
+    def test_deferred_centralauth_expansion(self):
+        self.caSession.add_all([
+            CentralAuthLocalUser(
+                lu_name='Editor test-specific-0', lu_wiki=mediawiki_project
+            ),
+            CentralAuthLocalUser(lu_name='Editor test-specific-0', lu_wiki='otherwiki'),
+        ])
+        self.caSession.commit()
+
+        cohort_upload = CohortUpload()
+        cohort_upload.name.data = 'deferred_centralauth_cohort'
+        cohort_upload.project.data = mediawiki_project
+        cohort_upload.centralauth.data = True
+        cohort_upload.centralauth_deferred = True
+        cohort_upload.records = [
+            {'raw_id_or_name': 'Editor test-specific-0', 'project': mediawiki_project},
+        ]
+
+        v = ValidateCohort.from_upload(cohort_upload, self.owner_user_id)
+        assert_true(v.expand_centralauth)
+        v.task.delay(v).get()
+        self.session.commit()
+
+        wikiusers = self.session.query(WikiUserStore).filter(
+            WikiUserStore.raw_id_or_name == 'Editor test-specific-0').all()
+        assert_equal(
+            sorted(wu.project for wu in wikiusers),
+            sorted([mediawiki_project, 'otherwiki'])
+        )
+
     def test_from_upload_exception(self):
         cohort_upload = CohortUpload()
         cohort_upload.name.data = 'small_cohort'
@@ -348,3 +382,88 @@ class BasicTests(unittest.TestCase):
         cohort = CohortStore(id=1)
         v = ValidateCohort(cohort)
         assert_equal(str(v), '<ValidateCohort("1")>')
+
+
+class ValidateCohortBatchesTest(unittest.TestCase):
+
+    def test_validate_batches_in_parallel(self):
+        cohort = MockCohort()
+        cohort.id = 1
+        cohort.validate_as_user_ids = False
+        v = ValidateCohort(cohort)
+        batches = [
+            ('enwiki', [(1, 'A'), (2, 'B')]),
+            ('enwiki', [(3, 'C')]),
+            ('dewiki', [(4, 'D')]),
+        ]
+        config = {'MEDIAWIKI_PARALLEL_PROJECTS': 4}
+
+        with mock.patch.dict('wikimetrics.configurables.db.config', config),\
+                mock.patch('wikimetrics.configurables.db.get_project_host_map',
+                           return_value={'enwiki': 's1', 'dewiki': 's5'}),\
+                mock.patch('wikimetrics.configurables.db.get_mw_session') as sessions,\
+                mock.patch('wikimetrics.models.validate_cohort.validate_users') as vu:
+            v.validate_batches(batches)
+
+        assert_equal(
+            sorted(call[0] for call in vu.call_args_list),
+            sorted((wikiusers, project, False) for project, wikiusers in batches)
+        )
+        # each worker gives its mediawiki connection back
+        assert_equal(sessions.return_value.remove.call_count, 3)
+
+
+class WriteValidationResultsTest(unittest.TestCase):
+
+    def test_update_wiki_users_is_one_statement(self):
+        outcomes = [
+            (1, 'A', 10, True, None),
+            (2, None, None, False, 'invalid user_name'),
+        ]
+        sql = str(update_wiki_users(outcomes).compile(dialect=mysql.dialect()))
+        assert_equal(sql.count('UPDATE'), 1)
+        assert_equal(sql.count('UNION ALL'), 1)
+        assert_false('INSERT' in sql)
+        assert_true('WHERE wiki_user.id = validated.id' in sql)
+        assert_true(
+            'wiki_user.mediawiki_username=coalesce(validated.mediawiki_username, '
+            'wiki_user.mediawiki_username)' in sql
+        )
+
+    @mock.patch('wikimetrics.models.validate_cohort.VALIDATION_BATCH_SIZE', 2)
+    def test_write_validation_results_by_batch(self):
+        connection = mock.Mock()
+        connection.dialect.name = 'mysql'
+        outcomes = [(i, None, None, False, 'invalid user_id') for i in range(5)]
+        write_validation_results(connection, outcomes)
+
+        assert_equal(connection.execute.call_count, 3)
+        statement = connection.execute.call_args_list[0][0][0]
+        sql = str(statement.compile(dialect=mysql.dialect()))
+        assert_equal(sql.count('UNION ALL'), 1)
+
+    def test_invalid_wiki_users_keep_their_mediawiki_user(self):
+        engine = create_engine('sqlite://')
+        table = WikiUserStore.__table__
+        table.create(engine)
+        engine.execute(table.insert(), [
+            {'id': 1, 'raw_id_or_name': 'A', 'project': 'enwiki',
+             'mediawiki_username': 'A', 'mediawiki_userid': 10, 'valid': True},
+            {'id': 2, 'raw_id_or_name': 'B', 'project': 'enwiki',
+             'mediawiki_username': 'B', 'mediawiki_userid': 20, 'valid': True},
+        ])
+        with engine.begin() as connection:
+            write_validation_results(connection, [
+                (1, 'A2', 11, True, None),
+                (2, None, None, False, 'invalid user_name'),
+                (3, 'C', 30, True, None),
+            ])
+
+        rows = engine.execute(select([
+            table.c.id, table.c.mediawiki_username, table.c.mediawiki_userid,
+            table.c.valid, table.c.reason_invalid,
+        ]).order_by(table.c.id)).fetchall()
+        assert_equal([tuple(row) for row in rows], [
+            (1, 'A2', 11, True, None),
+            (2, 'B', 20, False, 'invalid user_name'),
+        ])
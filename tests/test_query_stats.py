@@ -0,0 +1,109 @@
+import json
+from unittest import TestCase
+from mock import MagicMock
+from nose.tools import assert_equal, assert_true
+from sqlalchemy import create_engine
+
+from wikimetrics.query_stats import (
+    QueryStats, query_context, instrument_engine, query_stats, REDIS_KEY
+)
+
+
+class QueryStatsTest(TestCase):
+
+    def setUp(self):
+        self.stats = QueryStats()
+
+    def test_record_without_context(self):
+        self.stats.record('wikimetrics', 0.5, 3, 100)
+        assert_equal(self.stats.as_list(), [{
+            'database': 'wikimetrics', 'metric': None, 'project': None,
+            'queries': 1, 'seconds': 0.5, 'rows': 3, 'bytes_sent': 100,
+        }])
+
+    def test_record_in_nested_contexts(self):
+        with query_context(metric='edits', project='enwiki', cohort=1) as outer:
+            self.stats.record('mediawiki', 1.0, 10, 100)
+            with query_context(chunk=1) as inner:
+                self.stats.record('mediawiki', 2.0, 20, 200)
+            self.stats.record('wikimetrics', 0.5, 1, 10)
+
+        assert_equal(inner['project'], 'enwiki')
+        assert_equal(inner['chunk'], 1)
+        assert_equal(inner['queries'], 1)
+        assert_equal(outer['queries'], 3)
+        assert_equal(outer['rows'], 31)
+
+        stats = self.stats.as_list()
+        assert_equal(len(stats), 2)
+        # the most time consuming first
+        assert_equal(stats[0]['database'], 'mediawiki')
+        assert_equal(stats[0]['metric'], 'edits')
+        assert_equal(stats[0]['seconds'], 3.0)
+        assert_equal(stats[1]['database'], 'wikimetrics')
+
+    def test_publish_and_collect(self):
+        redis = MagicMock()
+        with query_context(metric='edits', project='enwiki', cohort=1):
+            self.stats.record('mediawiki', 1.5, 10, 100)
+        self.stats.publish(redis)
+
+        pipeline = redis.pipeline.return_value
+        field = json.dumps(['mediawiki', 'edits', 'enwiki', 'seconds'])
+        pipeline.hincrbyfloat.assert_called_once_with(REDIS_KEY, field, 1.5)
+        assert_equal(pipeline.hincrby.call_count, 3)
+        assert_equal(pipeline.execute.call_count, 1)
+
+        # only new queries are published the next time
+        self.stats.publish(redis)
+        assert_equal(pipeline.execute.call_count, 1)
+
+        redis.hgetall.return_value = {
+            json.dumps(['mediawiki', 'edits', 'enwiki', counter]): value
+            for counter, value in
+            [('queries', '2'), ('seconds', '3.5'), ('rows', '20'), ('bytes_sent', '9')]
+        }
+        # published by cohort before
+        redis.hgetall.return_value[
+            json.dumps(['mediawiki', 'edits', 'enwiki', 1, 'queries'])
+        ] = '1'
+        assert_equal(self.stats.collect(redis), [{
+            'database': 'mediawiki', 'metric': 'edits', 'project': 'enwiki',
+            'queries': 3, 'seconds': 3.5, 'rows': 20, 'bytes_sent': 9,
+        }])
+
+    def test_cohorts_are_aggregated_together(self):
+        for cohort in range(3):
+            with query_context(metric='edits', project='enwiki', cohort=cohort):
+                self.stats.record('mediawiki', 1.0, 10, 100)
+        redis = MagicMock()
+        self.stats.publish(redis)
+
+        pipeline = redis.pipeline.return_value
+        field = json.dumps(['mediawiki', 'edits', 'enwiki', 'queries'])
+        pipeline.hincrby.assert_any_call(REDIS_KEY, field, 3)
+        assert_equal(pipeline.hincrby.call_count, 3)
+
+    def test_failed_publish_is_kept(self):
+        redis = MagicMock()
+        redis.pipeline.return_value.execute.side_effect = Exception('redis is gone')
+        self.stats.record('wikimetrics', 1.0, 1, 10)
+        try:
+            self.stats.publish(redis)
+        except Exception:
+            pass
+        assert_equal(len(self.stats.unpublished), 1)
+
+    def test_instrument_engine(self):
+        query_stats.clear()
+        engine = create_engine('sqlite://')
+        instrument_engine(engine, 'test')
+        with query_context(metric='instrumented'):
+            engine.execute('select 1').fetchall()
+
+        stats = [s for s in query_stats.as_list() if s['database'] == 'test']
+        assert_equal(len(stats), 1)
+        assert_equal(stats[0]['metric'], 'instrumented')
+        assert_equal(stats[0]['queries'], 1)
+        assert_true(stats[0]['bytes_sent'] > 0)
+        query_stats.clear()
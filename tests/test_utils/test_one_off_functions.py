@@ -1,7 +1,9 @@
 # -*- coding: utf-8 -*-
+import threading
+import time
 from datetime import datetime, timedelta, date
 import decimal
-from nose.tools import assert_true, assert_equal
+from nose.tools import assert_true, assert_equal, assert_raises, raises
 from unittest import TestCase
 from wikimetrics.utils import (
     stringify,
@@ -16,6 +18,8 @@ from wikimetrics.utils import (
     parse_tag,
     chunk,
     update_dict,
+    parallel_map,
+    check_cancelled,
 )
 from wikimetrics.metrics import NamespaceEdits
 
@@ -180,3 +184,79 @@ class TestUtil(TestCase):
         assert_equal(target['list'], [1, 2, 3, 4, 5])
         assert_equal(target['value'], 3)
         assert_equal(target['value1'], 2)
+
+    def test_parallel_map_keeps_order(self):
+        def slow_square(x):
+            time.sleep(0.01 * (5 - x))
+            return x * x
+        
+        squares = parallel_map(slow_square, range(5), 3, poll_interval=0.01)
+        assert_equal(squares, [0, 1, 4, 9, 16])
+    
+    def test_parallel_map_serial(self):
+        threads = set()
+        
+        def record_thread(x):
+            threads.add(threading.current_thread())
+            return x
+        
+        assert_equal(parallel_map(record_thread, range(4), 1), range(4))
+        assert_equal(threads, set([threading.current_thread()]))
+    
+    def test_parallel_map_max_per_group(self):
+        lock = threading.Lock()
+        running = {'even': 0, 'odd': 0}
+        most = {'even': 0, 'odd': 0}
+        
+        def parity(x):
+            return 'even' if x % 2 == 0 else 'odd'
+        
+        def count_running(x):
+            with lock:
+                running[parity(x)] += 1
+                most[parity(x)] = max(most[parity(x)], running[parity(x)])
+            time.sleep(0.01)
+            with lock:
+                running[parity(x)] -= 1
+            return x
+        
+        results = parallel_map(
+            count_running, range(10), 6,
+            group=parity, max_per_group=2, poll_interval=0.01,
+        )
+        assert_equal(results, range(10))
+        assert_true(most['even'] <= 2)
+        assert_true(most['odd'] <= 2)
+    
+    @raises(ValueError)
+    def test_parallel_map_raises(self):
+        def fail_on_three(x):
+            if x == 3:
+                raise ValueError('three')
+            return x
+        
+        parallel_map(fail_on_three, range(6), 3, poll_interval=0.01)
+    
+    def test_parallel_map_cancels_running_calls(self):
+        failed = threading.Event()
+        steps = []
+        
+        def steps_until_cancelled(x):
+            if x == 0:
+                time.sleep(0.05)
+                failed.set()
+                raise ValueError('zero')
+            for step in range(100):
+                check_cancelled()
+                steps.append(step)
+                failed.wait(0.01)
+        
+        assert_raises(
+            ValueError,
+            parallel_map, steps_until_cancelled, range(3), 3, poll_interval=0.01,
+        )
+        done = len(steps)
+        # the running calls stopped, and were waited for
+        time.sleep(0.05)
+        assert_equal(len(steps), done)
+        assert_true(done < 100)
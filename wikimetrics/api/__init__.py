@@ -1,8 +1,15 @@
 from file_manager import *
+from result_store import *
+from status_buffer import *
+from report_profiler import *
+from single_flight import *
 from centralauth import *
+from cohort_cache import *
+from metric_cache import *
 from cohorts import *
 from tags import *
 from replication_lag import *
+from edit_rollup import *
 from reports import *
 from batch import *
 
@@ -1,4 +1,6 @@
 import os
+import json
+import time
 import celery
 from celery.exceptions import SoftTimeLimitExceeded
 from celery.utils.log import get_task_logger
@@ -6,6 +8,7 @@ from celery import current_task
 # TODO split configurables, you should be able to import just the queue
 from wikimetrics.configurables import queue, get_absolute_path
 from wikimetrics.api import PublicReportFileManager, COALESCED_REPORT_FILE
+from wikimetrics.api.report_profiler import report_profiler
 from wikimetrics.utils import format_date_for_public_report_file, json_string
 
 # This is the hack you need if you use instance methods as celery tasks
@@ -20,15 +23,24 @@ task_logger = get_task_logger(__name__)
 
 
 @queue.task()
-def write_report_task(report_id, created, results):
-    
+def write_report_task(report_id, created, results, profile_report_id=None):
+    """
+    profile_report_id is the stored report the time spent writing is added to,
+    which for recurrent reports is the run, not the report_id written to
+    """
     task_logger.info('Writing report {0} to disk.Running on celery as task id {1}'.format(
         report_id,
         current_task.request.id,
     ))
     
+    start = time.time()
     write_task = WriteReportTask(report_id, created, results)
     write_task.run()
+    report_profiler.add(profile_report_id, 'WriteReportTask', time.time() - start)
+    try:
+        report_profiler.flush()
+    except Exception:
+        task_logger.exception('could not store the profile of {0}'.format(report_id))
 
 
 class WriteReportTask(object):
@@ -73,7 +85,7 @@ class WriteReportTask(object):
         try:
             # TODO kind of cumbersome api on file_manager, look into simplifying
             self.file_manager.write_data(self.filepath, self.results)
-            self.create_coalesced_report()
+            self.log_run()
             self.file_manager.remove_old_report_files(self.report_id)
         except SoftTimeLimitExceeded:
             task_logger.error('timeout exceeded for {0}'.format(
@@ -81,15 +93,13 @@ class WriteReportTask(object):
             ))
             raise
     
-    def create_coalesced_report(self):
+    def log_run(self):
         """
-        Creates coalesced report.
-        
-        for CR: should we create the report everytime or make sure to create it
-        only if coalesced report on disk is more than one day old?.
+        Appends this run to the run log of the report, which costs the same
+        whatever the history of the report.  full_report.json is only brought up
+        to date with the log when it is requested, see
+        file_manager.get_coalesced_report_path.
         """
-        data = self.file_manager.coalesce_recurrent_reports(self.report_id)
-        
-        if data is not None:
-            coalesced_report_file_path = os.path.join(self.path, COALESCED_REPORT_FILE)
-            self.file_manager.write_data(coalesced_report_file_path, json_string(data))
+        self.file_manager.append_run(
+            self.report_id, self.created_string, json.loads(self.results)
+        )
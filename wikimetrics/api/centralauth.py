@@ -1,7 +1,11 @@
 from wikimetrics.configurables import db
 from wikimetrics.models.centralauth import CentralAuthLocalUser as LocalUser
 from wikimetrics.utils import parse_username
-from wikimetrics.utils import deduplicate_by_key
+from wikimetrics.utils import deduplicate_by_key, chunk
+
+
+# user names are looked up in localuser this many at a time
+CENTRALAUTH_EXPANSION_BATCH_SIZE = 1000
 
 
 class CentralAuthService(object):
@@ -20,7 +24,8 @@ class CentralAuthService(object):
          {'raw_id_or_name': 'JSmith (WMF)', 'project': 'dewiki'},
          {'raw_id_or_name': 'JSmith (WMF)', 'project': 'frwiktionary'}]
 
-        The method uses the centralauth database for that.
+        The method uses the centralauth database for that, looking up the
+        distinct user names CENTRALAUTH_EXPANSION_BATCH_SIZE at a time.
         If a cohort user is not in the centralauth localuser table,
         it will be returned as is.
 
@@ -33,19 +38,19 @@ class CentralAuthService(object):
             List of expanded cohort users, formatted like
             {'raw_id_or_name': raw_id_or_name, 'project': project}.
         '''
-        expanded_cohort = set([])
-        for cohort_user in cohort_users:
-            user_tuple = (cohort_user['raw_id_or_name'], cohort_user['project'])
-            expanded_cohort.add(user_tuple)
+        expanded_cohort = set(
+            (cohort_user['raw_id_or_name'], cohort_user['project'])
+            for cohort_user in cohort_users
+        )
+        usernames = sorted(set(username for username, project in expanded_cohort))
 
+        for batch in chunk(usernames, CENTRALAUTH_EXPANSION_BATCH_SIZE):
             ca_local_users = (
                 ca_session
                 .query(LocalUser.lu_name, LocalUser.lu_wiki)
-                .filter(LocalUser.lu_name == cohort_user['raw_id_or_name']).all()
+                .filter(LocalUser.lu_name.in_(batch)).all()
             )
-            if len(ca_local_users) > 0:
-                ca_local_users = set([(x[0], x[1]) for x in ca_local_users])
-                expanded_cohort = expanded_cohort.union(ca_local_users)
+            expanded_cohort.update((x[0], x[1]) for x in ca_local_users)
 
         expanded_cohort = [{
             'raw_id_or_name' : x[0],
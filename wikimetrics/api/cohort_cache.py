@@ -0,0 +1,110 @@
+from threading import Lock
+from collections import OrderedDict
+from wikimetrics.configurables import db
+
+__all__ = [
+    'CohortSnapshotCache',
+    'cohort_snapshot_cache',
+]
+
+
+class CohortSnapshotCache(object):
+    """
+    Process-wide least recently used cache of CohortSnapshots, keyed by
+    (cohort_id, membership_version).  Changing the members of a cohort bumps its
+    version, so a cached snapshot is never served for a newer version of a cohort.
+    Older versions of a cohort are dropped as soon as a newer one is cached.
+
+    The total memory_size of the cached snapshots is kept under
+    COHORT_CACHE_MAX_BYTES, evicting the least recently used snapshots first.
+    Setting it to 0 disables the cache.  This is thread safe.
+    """
+
+    def __init__(self, max_bytes=None):
+        """
+        Parameters
+            max_bytes   : the memory budget, defaults to COHORT_CACHE_MAX_BYTES
+        """
+        self.max_bytes = max_bytes
+        self.lock = Lock()
+        self.clear()
+
+    def get_max_bytes(self):
+        if self.max_bytes is not None:
+            return self.max_bytes
+        return db.config.get('COHORT_CACHE_MAX_BYTES', 0)
+
+    def clear(self):
+        with self.lock:
+            self.entries = OrderedDict()
+            self.sizes = dict()
+            self.size = 0
+            self.hits = 0
+            self.misses = 0
+            self.evictions = 0
+
+    def get(self, cohort_id, version, load):
+        """
+        Parameters
+            cohort_id   : the id of the cohort
+            version     : the membership_version of the cohort
+            load        : function that reads the CohortSnapshot on a miss
+
+        Returns
+            the cached CohortSnapshot of this version of the cohort, or the one
+            returned by load, which is then cached
+        """
+        key = (cohort_id, version)
+        with self.lock:
+            snapshot = self.entries.pop(key, None)
+            if snapshot is not None:
+                # re-inserting makes it the most recently used
+                self.entries[key] = snapshot
+                self.hits += 1
+                return snapshot
+            self.misses += 1
+
+        snapshot = load()
+        self.put(key, snapshot)
+        return snapshot
+
+    def put(self, key, snapshot):
+        max_bytes = self.get_max_bytes()
+        size = snapshot.memory_size()
+        if size > max_bytes:
+            return
+
+        with self.lock:
+            for cached_key in self.entries.keys():
+                if cached_key[0] == key[0]:
+                    self.remove(cached_key)
+            while self.entries and self.size + size > max_bytes:
+                self.remove(next(iter(self.entries)))
+                self.evictions += 1
+            self.entries[key] = snapshot
+            self.sizes[key] = size
+            self.size += size
+
+    def remove(self, key):
+        # callers hold the lock
+        del self.entries[key]
+        self.size -= self.sizes.pop(key)
+
+    def stats(self):
+        """
+        Returns
+            a dictionary with the hit, miss, and eviction counters, and how
+            many snapshots and bytes are cached
+        """
+        with self.lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'entries': len(self.entries),
+                'size': self.size,
+                'max_size': self.get_max_bytes(),
+            }
+
+
+cohort_snapshot_cache = CohortSnapshotCache()
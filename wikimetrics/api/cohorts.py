@@ -1,14 +1,18 @@
+from datetime import datetime
 from sqlalchemy.orm.exc import NoResultFound
 from sqlalchemy import func, distinct
 from wikimetrics.configurables import db
 from wikimetrics.exceptions import Unauthorized, InvalidCohort, DatabaseError
-from wikimetrics.models import cohort_classes, ValidatedCohort, WikiCohort
+from wikimetrics.models import (
+    cohort_classes, ValidatedCohort, WikiCohort, CohortSnapshot
+)
 from wikimetrics.models.storage import (
     CohortStore, CohortUserStore, UserStore,
     WikiUserStore, WikiUserKey, CohortWikiUserStore,
     CohortTagStore
 )
 from wikimetrics.enums import CohortUserRole
+from cohort_cache import cohort_snapshot_cache
 
 
 class CohortService(object):
@@ -18,11 +22,72 @@ class CohortService(object):
         * CohortStorage which is the way we persist cohorts to the database
     """
 
-    def convert(self, cohort):
+    def convert(self, cohort, snapshot=False):
         """
         Converts a CohortStore object into a logical Cohort object
+
+        Parameters
+            cohort      : a CohortStore object
+            snapshot    : if True, load a CohortSnapshot of the members with the
+                          cohort, and take the size of the cohort from it
+        """
+        if not snapshot:
+            return cohort_classes[cohort.class_name](cohort, len(cohort))
+
+        members = self.get_snapshot(cohort)
+        logical_cohort = cohort_classes[cohort.class_name](cohort, len(members))
+        logical_cohort.snapshot = members
+        return logical_cohort
+
+    def get_snapshot(self, cohort, session=None):
+        """
+        Gets a snapshot of the valid members of a cohort from the process-wide
+        cohort_snapshot_cache, reading it with load_snapshot on a miss
+
+        Parameters
+            cohort  : a CohortStore object
+            session : the session cohort belongs to, defaults to db.get_session()
+
+        Returns
+            A CohortSnapshot of the current version of the cohort's members
+        """
+        return cohort_snapshot_cache.get(
+            cohort.id,
+            cohort.membership_version,
+            lambda: self.load_snapshot(cohort, session),
+        )
+
+    def get_cache_stats(self):
+        """
+        Returns
+            the counters of the process-wide cohort_snapshot_cache
+        """
+        return cohort_snapshot_cache.stats()
+
+    def load_snapshot(self, cohort, session=None):
+        """
+        Reads all the valid members of a cohort with a single query.  Members
+        without a mediawiki user id can not be measured and are left out.
+
+        Parameters
+            cohort  : a CohortStore object
+            session : the session cohort belongs to, defaults to db.get_session()
+
+        Returns
+            A CohortSnapshot of the cohort's members
         """
-        return cohort_classes[cohort.class_name](cohort, len(cohort))
+        session = session or db.get_session()
+        members = cohort.filter_wikiuser_query(
+            session.query(
+                WikiUserStore.project,
+                WikiUserStore.mediawiki_userid,
+                WikiUserStore.mediawiki_username,
+            )
+        ).filter(WikiUserStore.mediawiki_userid != None)\
+            .order_by(WikiUserStore.project).all()
+        return CohortSnapshot(
+            cohort.id, cohort.default_project, cohort.membership_version, members
+        )
 
     # TODO: check ownership of the cohort
     # TODO: once we have logical models for wikiusers, we may want to eagerly
@@ -74,9 +139,38 @@ class CohortService(object):
 
         return user_names
 
+    def get_wikiusernames_for_users(self, cohort_id, project, user_ids, session):
+        """
+        Retrieves the names of some of the wikiusers in a cohort, so the UI can
+        look names up a batch at a time instead of loading the whole cohort
+
+        Parameters:
+            cohort_id
+            project     : the project all the user_ids are on
+            user_ids    : list of mediawiki user ids
+            session
+        Returns:
+            Dictionary of user names keyed by user id, as a string like in
+            WikiUserKey.  Users that are not found are left out.
+        """
+        if not user_ids:
+            return {}
+
+        results = session.query(WikiUserStore.mediawiki_userid,
+                                WikiUserStore.mediawiki_username)\
+            .filter(WikiUserStore.validating_cohort == cohort_id)\
+            .filter(WikiUserStore.project == project)\
+            .filter(WikiUserStore.mediawiki_userid.in_(user_ids))\
+            .all()
+
+        return {str(r[0]): r[1] for r in results}
+
     # TODO: check ownership of the cohort
     def get_users_by_project(self, cohort):
         """
+        Groups the users of a cohort by project, from the cohort's snapshot if it
+        was loaded with one, or else from the cached snapshot of its current version
+
         Parameters
             cohort  : a logical Cohort object
 
@@ -87,8 +181,13 @@ class CohortService(object):
         if cohort is None:
             return None
 
+        # callers may still pass a CohortStore, which has no snapshot
+        snapshot = getattr(cohort, 'snapshot', None)
+        if snapshot is not None:
+            return snapshot.group_by_project()
+
         c = self.fetch(cohort)
-        return c.group_by_project()
+        return self.get_snapshot(c).group_by_project()
 
     # TODO: check ownership of the cohort
     def fetch(self, cohort):
@@ -118,7 +217,10 @@ class CohortService(object):
         return db_session.query(CohortStore).filter(CohortStore.name == name).first()
 
     def get(self, db_session, user_id, **kargs):
-        """Same as _get but checks validity of the cohort"""
+        """
+        Same as _get but checks validity of the cohort.  Pass snapshot=True to also
+        load the cohort's members, see convert.
+        """
         cohort = self._get(db_session, user_id, **kargs)
         if self.is_invalid(cohort) is True:
             raise InvalidCohort('This cohort is not valid')
@@ -128,7 +230,7 @@ class CohortService(object):
         """Same as _get, also ignores validity of the cohort"""
         return self._get(db_session, user_id, **kargs)
 
-    def _get(self, db_session, user_id, by_id=None, by_name=None):
+    def _get(self, db_session, user_id, by_id=None, by_name=None, snapshot=False):
         """
         Gets a Cohort but first checks permissions on it.
 
@@ -137,6 +239,7 @@ class CohortService(object):
             user_id     : the user that should have access to the cohort
             by_id       : the cohort id to get.  <by_id> or <by_name> is True
             by_name     : the cohort name to get.  <by_id> or <by_name> is True
+            snapshot    : whether to load a CohortSnapshot with the cohort
 
         Returns
             If found, an appropriate data object instance from models.cohorts
@@ -164,7 +267,7 @@ class CohortService(object):
             raise Unauthorized('You are not allowed to use this cohort')
 
         if role in CohortUserRole.SAFE_ROLES:
-            return self.convert(cohort)
+            return self.convert(cohort, snapshot=snapshot)
         else:
             raise Unauthorized('You are not allowed to use this cohort')
 
@@ -422,6 +525,15 @@ class CohortService(object):
                 .query(WikiUserStore)
                 .filter(WikiUserStore.id.in_(ids_to_delete))
                 .delete(synchronize_session='fetch'))
+            # a new version makes existing snapshots of the cohort stale
+            session.execute(
+                CohortStore.__table__.update()
+                .values(
+                    changed=datetime.now(),
+                    membership_version=CohortStore.membership_version + 1,
+                )
+                .where(CohortStore.id == cohort_id)
+            )
             session.commit()
         except DatabaseError, e:
             session.rollback()
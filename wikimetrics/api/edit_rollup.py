@@ -0,0 +1,346 @@
+from contextlib import contextmanager
+from datetime import datetime, timedelta, time
+from sqlalchemy import func, case, cast, and_, Integer
+from sqlalchemy.orm import Session
+from celery.utils.log import get_task_logger
+
+from wikimetrics.configurables import db
+from wikimetrics.models.mediawiki import (
+    Revision, Archive, Page, MediawikiUserGroups, drop_cohort_tables,
+)
+from wikimetrics.models.storage import EditRollupStore, EditRollupCoverageStore
+
+__all__ = [
+    'EditRollupService',
+]
+
+task_logger = get_task_logger(__name__)
+
+INSERT_BATCH_SIZE = 10000
+
+
+class EditRollupService(object):
+    """
+    Builds EditRollupStore, the daily edits of each user of the projects listed in
+    EDIT_ROLLUP_PROJECTS, and answers counting metrics from it.
+
+    The rollup is built by build, a day at a time from EDIT_ROLLUP_START_DATE,
+    up to the start of the replication lag window.  Each run continues from the
+    last day counted, so it only reads the new days from the replicas.
+
+    Metrics can use it when covers is True for the range they count.  Days are
+    calendar days, so ranges must start and end at midnight.  The edits made
+    right at a midnight are also counted apart, so count_query can include or
+    exclude each end of a range, and answer like the revision table would.
+
+    Days are never counted again, so the rollup does not follow what changes
+    on the replicas afterwards:
+        * deleting or restoring a page moves its revisions between the revision
+          and archive tables, so only the sum of edits and archived_edits, and
+          of creations and archived_creations, stays right.  Metrics should
+          only use the rollup when they count deleted pages as well.
+        * moving a page changes the namespace of all its revisions, so the
+          namespace of a rollup row may be out of date.  Metrics should not
+          use the rollup when they count some namespaces only.
+    """
+
+    def get_projects(self):
+        return db.config.get('EDIT_ROLLUP_PROJECTS') or []
+
+    def get_start_date(self):
+        start = db.config.get('EDIT_ROLLUP_START_DATE') or '2001-01-15'
+        return datetime.strptime(str(start), '%Y-%m-%d').date()
+
+    def get_lag_start(self):
+        lag = timedelta(hours=db.config.get('REPLICATION_LAG_THRESHOLD', 3))
+        return (datetime.now() - lag).date()
+
+    @contextmanager
+    def session(self):
+        """
+        Yields a new session on the wikimetrics database.  Metrics run in worker
+        threads, so this does not use the thread's scoped session, and drops the
+        temporary tables that Metric.filter may create on its connection.
+        """
+        session = Session(bind=db.get_engine())
+        try:
+            yield session
+        finally:
+            try:
+                drop_cohort_tables(session)
+            finally:
+                session.close()
+
+    def covers(self, mw_session, start_date, end_date):
+        """
+        Parameters
+            mw_session  : the session the metric runs on, see get_mw_session
+            start_date  : the start of the range the metric counts
+            end_date    : the end of that range
+
+        Returns
+            True if the rollup of the project of mw_session counted all the days
+            from the day of start_date to the day of end_date, both included,
+            and start_date and end_date are both at midnight
+        """
+        project = db.get_mw_project(mw_session)
+        if project is None or project not in self.get_projects():
+            return False
+        if start_date is None or end_date is None:
+            return False
+        if start_date.time() != time() or end_date.time() != time():
+            return False
+
+        with self.session() as session:
+            coverage = session.query(EditRollupCoverageStore).get(project)
+            return (
+                coverage is not None and
+                coverage.start <= start_date.date() and
+                end_date.date() < coverage.end
+            )
+
+    def count_query(self, session, mw_session, start_date, end_date, columns,
+                    midnight_column, include_start=False, at_least=None):
+        """
+        Parameters
+            session         : a session from self.session
+            mw_session      : the session the metric runs on, see get_mw_session
+            start_date      : the start of the range to count, at midnight
+            end_date        : the end of the range to count, at midnight, included
+            columns         : the names of the EditRollupStore columns to add up
+            midnight_column : the name of the column counting those right at
+                              midnight, midnight_edits or midnight_creations
+            include_start   : whether to count those made right at start_date
+            at_least        : if set, only return users with at least this total
+
+        Returns
+            a query of (user_id, total) by user, with a total above 0, that
+            metrics can filter and slice by timeseries on EditRollupStore.user_id
+            and EditRollupStore.day.  The edits made right at end_date count
+            on its day, like a timeseries of the revision table would.
+        """
+        day_total = sum(getattr(EditRollupStore, column) for column in columns)
+        midnight = getattr(EditRollupStore, midnight_column)
+        whens = []
+        if not include_start:
+            # an empty range if start_date is end_date
+            start_total = day_total - midnight if start_date < end_date else 0
+            whens.append((EditRollupStore.day == start_date.date(), start_total))
+        whens.append((EditRollupStore.day == end_date.date(), midnight))
+        total = func.sum(case(whens, else_=day_total))
+        query = session.query(
+            EditRollupStore.user_id,
+            cast(total, Integer).label('count'),
+        )\
+            .filter(EditRollupStore.project == db.get_mw_project(mw_session))\
+            .filter(EditRollupStore.day >= start_date.date())\
+            .filter(EditRollupStore.day <= end_date.date())\
+            .group_by(EditRollupStore.user_id)\
+            .having(total > 0)
+        if at_least is not None:
+            query = query.having(total >= at_least)
+        return query
+
+    def active_editors(self, metric, mw_session, user_ids, start_date, end_date,
+                       number_of_edits):
+        """
+        Parameters
+            metric          : the metric asking, its filter is used on user_ids
+            mw_session      : the session the metric runs on, see get_mw_session
+            user_ids        : the users to count, or None for all of them
+            start_date      : the start of the range to count, included
+            end_date        : the end of the range to count, included
+            number_of_edits : the edits, deleted or not, that make a user active
+
+        Returns
+            the ids of the users that are active and are not bots
+        """
+        with self.session() as session:
+            query = self.count_query(
+                session, mw_session, start_date, end_date,
+                ['edits', 'archived_edits'], 'midnight_edits',
+                include_start=True, at_least=number_of_edits,
+            )
+            query = metric.filter(query, user_ids, column=EditRollupStore.user_id)
+            active = [row[0] for row in query.all()]
+
+        bots = self.bots(metric, mw_session, active)
+        return [user_id for user_id in active if user_id not in bots]
+
+    def daily_edits(self, metric, mw_session, user_ids, start_date, end_date):
+        """
+        Parameters
+            metric          : the metric asking, its filter is used on user_ids
+            mw_session      : the session the metric runs on, see get_mw_session
+            user_ids        : the users to count, or None for all of them
+            start_date      : the first day to count
+            end_date        : the last day to count
+
+        Returns
+            a dictionary from the ids of the users that are not bots to a
+            dictionary from each day they edited on to a tuple of their edits,
+            deleted or not, and the edits made right at the midnight starting it
+        """
+        with self.session() as session:
+            query = session.query(
+                EditRollupStore.user_id,
+                EditRollupStore.day,
+                cast(func.sum(
+                    EditRollupStore.edits + EditRollupStore.archived_edits
+                ), Integer),
+                cast(func.sum(EditRollupStore.midnight_edits), Integer),
+            )\
+                .filter(EditRollupStore.project == db.get_mw_project(mw_session))\
+                .filter(EditRollupStore.day >= start_date.date())\
+                .filter(EditRollupStore.day <= end_date.date())\
+                .group_by(EditRollupStore.user_id, EditRollupStore.day)
+            query = metric.filter(query, user_ids, column=EditRollupStore.user_id)
+            edits = {}
+            for user_id, day, count, midnight in query.all():
+                edits.setdefault(user_id, {})[day] = (count, midnight)
+
+        bots = self.bots(metric, mw_session, edits.keys())
+        return {
+            user_id: days
+            for user_id, days in edits.iteritems()
+            if user_id not in bots
+        }
+
+    def bots(self, metric, mw_session, user_ids):
+        """
+        Returns
+            the set of the user_ids that are in the bot group
+        """
+        if not user_ids:
+            return set()
+        bots = mw_session.query(MediawikiUserGroups.ug_user)\
+            .filter(MediawikiUserGroups.ug_group == 'bot')
+        bots = metric.filter(bots, user_ids, column=MediawikiUserGroups.ug_user)
+        return set(row[0] for row in bots.all())
+
+    def build(self, project, until=None):
+        """
+        Counts the days of project that were not counted yet, a few days per
+        query, see EDIT_ROLLUP_DAYS_PER_QUERY
+
+        Parameters
+            project : the mediawiki project to count
+            until   : the day to stop at, excluded, defaults to the day the
+                      replication lag window starts on
+
+        Returns
+            the number of days counted
+        """
+        until = until or self.get_lag_start()
+        days_per_query = db.config.get('EDIT_ROLLUP_DAYS_PER_QUERY') or 1
+        session = db.get_session()
+        coverage = session.query(EditRollupCoverageStore).get(project)
+        start = coverage.end if coverage else self.get_start_date()
+        first = coverage.start if coverage else start
+        session.commit()
+
+        mw_session = db.get_mw_session(project)
+        day = start
+        while day < until:
+            end = min(day + timedelta(days=days_per_query), until)
+            rows = self.count(mw_session, project, day, end)
+            mw_session.rollback()
+            self.write(project, first, day, end, rows)
+            task_logger.info('counted {0} rollup rows of {1} from {2} to {3}'.format(
+                len(rows), project, day, end
+            ))
+            day = end
+        return max((until - start).days, 0)
+
+    def count(self, mw_session, project, start, end):
+        """
+        Returns
+            the EditRollupStore rows of the days of project from start to end
+        """
+        start_date = datetime.combine(start, time())
+        end_date = datetime.combine(end, time())
+        rows = {}
+
+        def add(query, edits, creations):
+            for user_id, day, namespace, count, created, midnight, created_at_midnight\
+                    in query.all():
+                row = rows.get((user_id, day, namespace))
+                if row is None:
+                    row = rows[(user_id, day, namespace)] = {
+                        'project': project,
+                        'user_id': user_id,
+                        'day': day,
+                        'namespace': namespace,
+                        'edits': 0,
+                        'archived_edits': 0,
+                        'creations': 0,
+                        'archived_creations': 0,
+                        'midnight_edits': 0,
+                        'midnight_creations': 0,
+                    }
+                row[edits] += count
+                row[creations] += int(created or 0)
+                row['midnight_edits'] += int(midnight or 0)
+                row['midnight_creations'] += int(created_at_midnight or 0)
+
+        def sums(timestamp, parent_id):
+            at_midnight = timestamp.like('%000000')
+            return [
+                func.count(),
+                func.sum(case([(parent_id == 0, 1)], else_=0)),
+                func.sum(case([(at_midnight, 1)], else_=0)),
+                func.sum(case([(and_(at_midnight, parent_id == 0), 1)], else_=0)),
+            ]
+
+        revision_day = func.date(Revision.rev_timestamp)
+        revisions = mw_session.query(
+            Revision.rev_user,
+            revision_day,
+            Page.page_namespace,
+            *sums(Revision.rev_timestamp, Revision.rev_parent_id)
+        )\
+            .join(Page)\
+            .filter(Revision.rev_timestamp >= start_date)\
+            .filter(Revision.rev_timestamp < end_date)\
+            .group_by(Revision.rev_user, revision_day, Page.page_namespace)
+        add(revisions, 'edits', 'creations')
+
+        archive_day = func.date(Archive.ar_timestamp)
+        archived = mw_session.query(
+            Archive.ar_user,
+            archive_day,
+            Archive.ar_namespace,
+            *sums(Archive.ar_timestamp, Archive.ar_parent_id)
+        )\
+            .filter(Archive.ar_timestamp >= start_date)\
+            .filter(Archive.ar_timestamp < end_date)\
+            .group_by(Archive.ar_user, archive_day, Archive.ar_namespace)
+        add(archived, 'archived_edits', 'archived_creations')
+
+        return rows.values()
+
+    def write(self, project, first, start, end, rows):
+        """
+        Replaces the rollup of the days from start to end with rows, and extends
+        the coverage of project to end, in one transaction
+        """
+        rollup = EditRollupStore.__table__
+        coverage = EditRollupCoverageStore.__table__
+        with db.get_engine().begin() as connection:
+            connection.execute(rollup.delete()
+                               .where(rollup.c.project == project)
+                               .where(rollup.c.day >= start)
+                               .where(rollup.c.day < end))
+            for batch in range(0, len(rows), INSERT_BATCH_SIZE):
+                connection.execute(
+                    rollup.insert(), rows[batch:batch + INSERT_BATCH_SIZE]
+                )
+            updated = connection.execute(
+                coverage.update()
+                .where(coverage.c.project == project)
+                .values(end=end)
+            )
+            if not updated.rowcount:
+                connection.execute(
+                    coverage.insert(), project=project, start=first, end=end
+                )
@@ -1,12 +1,17 @@
 import os
 import os.path
 import json
+import fcntl
 import shutil
 import collections
 
+from uuid import uuid4
+from contextlib import contextmanager
 from datetime import timedelta
 from wikimetrics.exceptions import PublicReportIOError
-from wikimetrics.utils import update_dict, parse_date_from_public_report_file, today
+from wikimetrics.utils import (
+    update_dict, parse_date_from_public_report_file, today, json_string
+)
 from wikimetrics.enums import Aggregation, TimeseriesChoices
 # TODO ultils imports flask response -> fix
 
@@ -16,6 +21,15 @@ RESERVED_FILENAME_CHARACTERS = {' ', os.sep, ':', '<', '>', '"', '/', '\\', '|',
 # Filename used for coalesced report files
 COALESCED_REPORT_FILE = 'full_report.json'
 
+# Append-only log of the runs of a recurrent report, one json object per line
+RUN_LOG_FILE = 'runs.log'
+
+# Small index of the runs in RUN_LOG_FILE, see PublicReportFileManager.append_run
+RUN_INDEX_FILE = 'runs_index.json'
+
+# Files in a recurrent report's directory that are not the output of a single run
+RECURRENT_REPORT_FILES = {COALESCED_REPORT_FILE, RUN_LOG_FILE, RUN_INDEX_FILE}
+
 
 class PublicReportFileManager():
     """
@@ -71,7 +85,8 @@ class PublicReportFileManager():
 
     def write_data(self, file_path, data):
         """
-        Writes data to a given path
+        Writes data to a given path.  The data is written to a hidden temporary file
+        that is then renamed to file_path, so readers never see a partial file.
         
         Parameters
            file_path : The path to which we are writing the public report
@@ -81,10 +96,17 @@ class PublicReportFileManager():
             PublicReportIOError
             if an IOError was raised when creating the public report
         """
+        directory, filename = os.path.split(file_path)
+        temporary_path = os.path.join(directory, '.{0}.{1}'.format(
+            filename, uuid4().hex
+        ))
         try:
-            with open(file_path, 'w') as saved_report:
+            with open(temporary_path, 'w') as saved_report:
                 saved_report.write(data)
-        except IOError:
+            os.rename(temporary_path, file_path)
+        except EnvironmentError:
+            if os.path.isfile(temporary_path):
+                os.remove(temporary_path)
             msg = 'Could not create public report at: {0}'.format(file_path)
             self.logger.exception(msg)
             raise PublicReportIOError(msg)
@@ -171,7 +193,8 @@ class PublicReportFileManager():
             raise PublicReportIOError(msg)
 
         for filename in os.listdir(path):
-            if filename != COALESCED_REPORT_FILE:
+            # hidden files are being written, see write_data
+            if filename not in RECURRENT_REPORT_FILES and not filename.startswith('.'):
                 file_date = parse_date_from_public_report_file(filename)
                 if file_date <= limit_day:
                     full_path = os.sep.join((path, filename))
@@ -200,9 +223,11 @@ class PublicReportFileManager():
 
             # Get a list of filenames with COALESCED_REPORT_FILE at 1st position,
             # so that new individual reports override the current full report.
-            filenames = os.listdir(path)
-            if COALESCED_REPORT_FILE in filenames:
-                filenames.remove(COALESCED_REPORT_FILE)
+            filenames = [
+                f for f in os.listdir(path)
+                if f not in RECURRENT_REPORT_FILES and not f.startswith('.')
+            ]
+            if os.path.isfile(os.sep.join((path, COALESCED_REPORT_FILE))):
                 filenames.insert(0, COALESCED_REPORT_FILE)
 
             for f in filenames:
@@ -226,6 +251,258 @@ class PublicReportFileManager():
             self.logger.exception(msg)
             raise PublicReportIOError(msg)
 
+    @contextmanager
+    def lock_recurrent_report(self, report_id):
+        """
+        Holds an exclusive lock on the directory of a recurrent report, so runs of
+        the report that finish at the same time update its coalesced report one
+        after the other.  The lock is released when the with block exits.
+        
+        Parameters
+            report_id : unique identifier for the report, a string
+        """
+        path = self.get_public_report_path(report_id, recurrent=True)
+        try:
+            directory = os.open(path, os.O_RDONLY)
+        except OSError:
+            msg = 'Could not lock recurrent report at "{0}"'.format(path)
+            self.logger.exception(msg)
+            raise PublicReportIOError(msg)
+        try:
+            fcntl.flock(directory, fcntl.LOCK_EX)
+            yield
+        finally:
+            os.close(directory)
+
+    def rebuild_coalesced_report(self, report_id):
+        """
+        Rebuilds the coalesced report of a recurrent report from scratch, out of
+        its run log, without reading the current coalesced report.  Use this to
+        repair a coalesced report; update_coalesced_report keeps it up to date.
+        Reports that have no run log yet are rebuilt from their files.
+        
+        Parameters
+            report_id : unique identifier for the report, a string
+        """
+        with self.lock_recurrent_report(report_id):
+            index = self.read_run_index(report_id)
+            coalesced = self.coalesce_run_log(report_id, index)
+            self.write_coalesced_report(report_id, coalesced, index)
+    
+    def append_run(self, report_id, run_name, data):
+        """
+        Appends one run of a recurrent report to the report's run log, and records
+        where it is in the run index.  This costs the same whatever the history of
+        the report.  The coalesced report is not touched, update_coalesced_report
+        merges the runs appended since it was written when it is requested.
+        
+        Parameters
+            report_id : unique identifier for the report, a string
+            run_name  : identifies the run, the name of its own report file
+            data      : the json result of the run, as loaded from its file
+        """
+        path = self.get_public_report_path(report_id, recurrent=True)
+        log_path = os.path.join(path, RUN_LOG_FILE)
+        line = json.dumps({'run': run_name, 'report': data}) + '\n'
+        
+        with self.lock_recurrent_report(report_id):
+            index = self.read_run_index(report_id)
+            offset = index['log_size']
+            try:
+                with open(log_path, 'ab') as log:
+                    # drops the end of an interrupted write, see read_run_index
+                    log.truncate(offset)
+                    log.write(line)
+            except IOError:
+                msg = 'Could not append to run log at: {0}'.format(log_path)
+                self.logger.exception(msg)
+                raise PublicReportIOError(msg)
+            
+            index['runs'].append([run_name, offset, len(line)])
+            index['log_size'] = offset + len(line)
+            self.write_data(os.path.join(path, RUN_INDEX_FILE), json.dumps(index))
+    
+    def read_run_index(self, report_id):
+        """
+        Reads the run index of a recurrent report.  If the index does not match the
+        run log, for example because a write was interrupted, the index is rebuilt
+        from the log.  Call this while holding lock_recurrent_report.
+        
+        Parameters
+            report_id : unique identifier for the report, a string
+        
+        Returns
+            A dictionary with:
+                runs            : list of [run name, offset, length] in the log
+                log_size        : size of the complete runs in the log
+                coalesced_size  : size of the log the coalesced report was built for
+        """
+        path = self.get_public_report_path(report_id, recurrent=True)
+        index_path = os.path.join(path, RUN_INDEX_FILE)
+        log_path = os.path.join(path, RUN_LOG_FILE)
+        log_size = os.path.getsize(log_path) if os.path.isfile(log_path) else 0
+        
+        index = {'runs': [], 'log_size': 0, 'coalesced_size': 0}
+        if os.path.isfile(index_path):
+            try:
+                with open(index_path, 'r') as index_file:
+                    index.update(json.load(index_file))
+            except (IOError, ValueError):
+                self.logger.exception('Could not read "{0}"'.format(index_path))
+                index['log_size'] = None
+        
+        if index['log_size'] != log_size:
+            index['runs'] = []
+            offset = 0
+            if not os.path.isfile(log_path):
+                index['log_size'] = index['coalesced_size'] = 0
+                return index
+            with open(log_path, 'rb') as log:
+                for line in log:
+                    if not line.endswith('\n'):
+                        # the end of an interrupted write, the next append drops it
+                        break
+                    index['runs'].append([json.loads(line)['run'], offset, len(line)])
+                    offset += len(line)
+            index['log_size'] = offset
+            index['coalesced_size'] = min(index['coalesced_size'], offset)
+        return index
+    
+    def read_runs(self, report_id, offset=0, since=None):
+        """
+        Reads runs of a recurrent report from its run log, in the order they ran.
+        
+        Parameters
+            report_id : unique identifier for the report, a string
+            offset    : where to start reading in the log
+            since     : if given, only runs named after this are read
+        
+        Returns
+            A generator of the json results of the runs
+        """
+        path = self.get_public_report_path(report_id, recurrent=True)
+        log_path = os.path.join(path, RUN_LOG_FILE)
+        if not os.path.isfile(log_path):
+            return
+        
+        with open(log_path, 'rb') as log:
+            log.seek(offset)
+            for line in log:
+                if not line.endswith('\n'):
+                    break
+                run = json.loads(line)
+                if since is None or run['run'] > since:
+                    yield run['report']
+    
+    def get_coalesced_report_path(self, report_id):
+        """
+        Parameters
+            report_id : unique identifier for the report, a string
+        
+        Returns
+            The path to the coalesced report, brought up to date with the run log,
+            see update_coalesced_report
+        """
+        return self.update_coalesced_report(report_id)
+    
+    def update_coalesced_report(self, report_id):
+        """
+        Brings the coalesced report of a recurrent report up to date with the runs
+        appended to its run log since it was last written, see append_run.  Only
+        those runs are merged into it.  If it can not be read, it is rebuilt from
+        the whole run log.
+        
+        Parameters
+            report_id : unique identifier for the report, a string
+        
+        Returns
+            The path to the up to date coalesced report
+        """
+        path = self.get_public_report_path(report_id, recurrent=True)
+        if not os.path.isdir(path):
+            msg = '"{0}" is not a scheduled report'.format(path)
+            self.logger.exception(msg)
+            raise PublicReportIOError(msg)
+        coalesced_path = os.path.join(path, COALESCED_REPORT_FILE)
+        
+        with self.lock_recurrent_report(report_id):
+            index = self.read_run_index(report_id)
+            if os.path.isfile(coalesced_path):
+                if index['coalesced_size'] == index['log_size']:
+                    return coalesced_path
+                try:
+                    with open(coalesced_path, 'r') as saved_report:
+                        coalesced = json.load(saved_report)
+                    for run in self.read_runs(report_id, index['coalesced_size']):
+                        _merge_run(coalesced, run)
+                except (IOError, ValueError, KeyError):
+                    msg = 'Could not update "{0}", rebuilding it'.format(coalesced_path)
+                    self.logger.exception(msg)
+                    coalesced = self.coalesce_run_log(report_id, index)
+            else:
+                coalesced = self.coalesce_run_log(report_id, index)
+            self.write_coalesced_report(report_id, coalesced, index)
+        
+        return coalesced_path
+    
+    def coalesce_run_log(self, report_id, index):
+        """
+        Coalesces all the runs in the run log of a recurrent report.  Reports
+        written before there was a run log are coalesced from their files, see
+        coalesce_recurrent_reports.  Call this while holding lock_recurrent_report.
+        
+        Parameters
+            report_id : unique identifier for the report, a string
+            index     : the run index, as returned by read_run_index
+        
+        Returns
+            A JSON object containing the coalesced reports
+        """
+        if not index['log_size']:
+            return self.coalesce_recurrent_reports(report_id)
+        coalesced = {}
+        for run in self.read_runs(report_id):
+            _merge_run(coalesced, run)
+        return coalesced
+    
+    def write_coalesced_report(self, report_id, coalesced, index):
+        """
+        Writes the coalesced report of a recurrent report, and records in its run
+        index that it includes the whole run log.  Call this while holding
+        lock_recurrent_report.
+        """
+        path = self.get_public_report_path(report_id, recurrent=True)
+        self.write_data(os.path.join(path, COALESCED_REPORT_FILE), json_string(coalesced))
+        index['coalesced_size'] = index['log_size']
+        self.write_data(os.path.join(path, RUN_INDEX_FILE), json.dumps(index))
+    
+    def coalesce_runs_since(self, report_id, since):
+        """
+        Coalesces only the runs of a recurrent report named after since, for
+        clients that already have the earlier runs.
+        
+        Parameters
+            report_id : unique identifier for the report, a string
+            since     : the name of the last run not to include, a date string
+        
+        Returns
+            A JSON object containing the coalesced runs
+        """
+        path = self.get_public_report_path(report_id, recurrent=True)
+        if not os.path.isdir(path):
+            msg = '"{0}" is not a scheduled report'.format(path)
+            self.logger.exception(msg)
+            raise PublicReportIOError(msg)
+        
+        with self.lock_recurrent_report(report_id):
+            index = self.read_run_index(report_id)
+            runs = [run for run in index['runs'] if run[0] > since]
+            offset = runs[0][1] if runs else index['log_size']
+            coalesced = {}
+            for run in self.read_runs(report_id, offset, since):
+                _merge_run(coalesced, run)
+        return coalesced
+
 
 def _merge_run(coalesced, data):
     """
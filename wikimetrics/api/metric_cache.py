@@ -0,0 +1,218 @@
+import os
+import os.path
+import json
+import hashlib
+import cPickle as pickle
+from uuid import uuid4
+from threading import Lock
+from datetime import datetime, timedelta
+
+import numpy
+
+from wikimetrics.configurables import db, get_absolute_path
+
+__all__ = [
+    'MetricResultCache',
+    'metric_result_cache',
+]
+
+# bump this when metrics change the results they compute for the same parameters
+CACHE_VERSION = 1
+CACHE_FILE_SUFFIX = '.pickle'
+
+
+class MetricResultCache(object):
+    """
+    Caches the results of running a metric on the users of a project, on disk, so
+    re-running a report does not query the mediawiki databases again.  Results are
+    keyed by a hash of the metric's class and parameters, the project, and the user
+    ids it ran on, so any change to the cohort's membership is a different key.
+
+    Only results that can not change are cached: a metric whose end_date is
+    within REPLICATION_LAG_THRESHOLD hours of now may still see new edits arrive
+    on the replicas, so it always runs.
+
+    Each result is a file under METRIC_CACHE_PATH.  Their total size is kept under
+    METRIC_CACHE_MAX_BYTES, evicting the least recently used first.  Setting it to
+    0 disables the cache.  Files are written to a temporary name and then renamed,
+    so all the processes of a host can share the directory.
+    """
+
+    def __init__(self, root_dir=None, max_bytes=None, lag_hours=None):
+        """
+        Parameters
+            root_dir    : defaults to METRIC_CACHE_PATH
+            max_bytes   : defaults to METRIC_CACHE_MAX_BYTES
+            lag_hours   : defaults to REPLICATION_LAG_THRESHOLD
+        """
+        self.root_dir = root_dir
+        self.max_bytes = max_bytes
+        self.lag_hours = lag_hours
+        self.lock = Lock()
+        self.hits = 0
+        self.misses = 0
+        self.bypasses = 0
+        self.evictions = 0
+
+    def get_root_dir(self):
+        if self.root_dir is not None:
+            return self.root_dir
+        root_dir = db.config.get('METRIC_CACHE_PATH', './generated/metric_cache')
+        # relative paths do not depend on the directory the worker was started in
+        return os.path.normpath(os.path.join(get_absolute_path(), root_dir))
+
+    def get_max_bytes(self):
+        if self.max_bytes is not None:
+            return self.max_bytes
+        return db.config.get('METRIC_CACHE_MAX_BYTES', 0)
+
+    def get_lag_hours(self):
+        if self.lag_hours is not None:
+            return self.lag_hours
+        return db.config.get('REPLICATION_LAG_THRESHOLD', 3)
+
+    def get(self, metric, project, user_ids, compute):
+        """
+        Parameters
+            metric      : an instance of a Metric class
+            project     : the project the metric runs on
+            user_ids    : the user ids the metric runs on
+            compute     : function that runs the metric on a miss
+
+        Returns
+            the cached results of the metric, or the ones returned by compute,
+            which are then cached if they can not change
+        """
+        if not self.is_cacheable(metric):
+            with self.lock:
+                self.bypasses += 1
+            return compute()
+
+        key = self.key(metric, project, user_ids)
+        results = self.read(key)
+        if results is not None:
+            with self.lock:
+                self.hits += 1
+            return results
+
+        with self.lock:
+            self.misses += 1
+        results = compute()
+        self.write(key, results)
+        return results
+
+    def is_cacheable(self, metric):
+        """
+        Returns
+            True if the cache is enabled and the metric ends before the
+            replication lag window, so its results are final
+        """
+        if self.get_max_bytes() <= 0:
+            return False
+        end_date = getattr(metric, 'end_date', None)
+        if end_date is None or end_date.data is None:
+            return False
+        lag_start = datetime.now() - timedelta(hours=self.get_lag_hours())
+        return end_date.data < lag_start
+
+    def key(self, metric, project, user_ids):
+        """
+        Returns
+            a hash of everything the results of the metric depend on
+        """
+        parameters = {
+            name: value for name, value in metric.data.items()
+            if name != 'csrf_token'
+        }
+        if getattr(metric, 'backfill', False):
+            parameters['backfill'] = True
+        users = numpy.array(sorted(user_ids or []), dtype=numpy.int64)
+        digest = hashlib.sha1(json.dumps(
+            [CACHE_VERSION, type(metric).__name__, parameters, project],
+            sort_keys=True,
+            default=str,
+        ))
+        digest.update(users.tostring())
+        return digest.hexdigest()
+
+    def get_path(self, key):
+        return os.path.join(self.get_root_dir(), key + CACHE_FILE_SUFFIX)
+
+    def read(self, key):
+        path = self.get_path(key)
+        try:
+            with open(path, 'rb') as cached:
+                results = pickle.load(cached)
+            # reading makes it the most recently used
+            os.utime(path, None)
+            return results
+        except (IOError, OSError, EOFError, pickle.UnpicklingError):
+            return None
+
+    def write(self, key, results):
+        root_dir = self.get_root_dir()
+        if not os.path.isdir(root_dir):
+            try:
+                os.makedirs(root_dir)
+            except OSError:
+                # another process created it
+                if not os.path.isdir(root_dir):
+                    raise
+        temporary_path = os.path.join(root_dir, '.{0}.{1}'.format(key, uuid4().hex))
+        try:
+            with open(temporary_path, 'wb') as out:
+                pickle.dump(results, out, pickle.HIGHEST_PROTOCOL)
+            os.rename(temporary_path, self.get_path(key))
+        except:
+            if os.path.exists(temporary_path):
+                os.remove(temporary_path)
+            raise
+        self.evict()
+
+    def evict(self):
+        """
+        Removes the least recently used results until the cache fits in
+        METRIC_CACHE_MAX_BYTES
+        """
+        root_dir = self.get_root_dir()
+        entries = []
+        for name in os.listdir(root_dir):
+            if not name.endswith(CACHE_FILE_SUFFIX) or name.startswith('.'):
+                continue
+            try:
+                stat = os.stat(os.path.join(root_dir, name))
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, name))
+
+        size = sum(entry[1] for entry in entries)
+        max_bytes = self.get_max_bytes()
+        for mtime, entry_size, name in sorted(entries):
+            if size <= max_bytes:
+                break
+            try:
+                os.remove(os.path.join(root_dir, name))
+            except OSError:
+                # another process evicted it
+                pass
+            size -= entry_size
+            with self.lock:
+                self.evictions += 1
+
+    def stats(self):
+        """
+        Returns
+            a dictionary with the hit, miss, bypass, and eviction counters of
+            this process
+        """
+        with self.lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'bypasses': self.bypasses,
+                'evictions': self.evictions,
+                'max_size': self.get_max_bytes(),
+            }
+
+
+metric_result_cache = MetricResultCache()
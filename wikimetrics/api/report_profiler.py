@@ -0,0 +1,51 @@
+from threading import Lock
+from wikimetrics.models.storage import ReportProfileStore
+
+__all__ = [
+    'ReportProfiler',
+    'report_profiler',
+]
+
+
+class ReportProfiler(object):
+    """
+    Adds up the time spent by the nodes of report trees, by stored report and
+    node name, until they are written to ReportProfileStore by flush.  There is
+    one per process, see report_profiler.  This is thread safe, so reports
+    running in worker threads can share it.
+    """
+
+    def __init__(self):
+        self.lock = Lock()
+        self.timings = {}
+
+    def add(self, report_id, node, seconds):
+        """
+        Parameters
+            report_id   : the id of the stored report the node runs under
+            node        : the name of the node, like "MetricReport enwiki"
+            seconds     : the time it took
+        """
+        if report_id is None:
+            return
+        with self.lock:
+            timing = self.timings.setdefault((report_id, node), [0, 0])
+            timing[0] += seconds
+            timing[1] += 1
+
+    def flush(self):
+        """
+        Writes the timings added since the last flush, replacing the ones of
+        previous runs of the same reports
+        """
+        with self.lock:
+            timings = self.timings
+            self.timings = {}
+        ReportProfileStore.replace([
+            {'report_id': report_id, 'node': node[:100], 'seconds': seconds,
+             'count': count}
+            for (report_id, node), (seconds, count) in sorted(timings.items())
+        ])
+
+
+report_profiler = ReportProfiler()
@@ -19,4 +19,7 @@ class ReportService(object):
         report_id_to_write = report.persistent_id
         if report.recurrent_parent_id is not None:
             report_id_to_write = report.recurrent_parent_id
-        write_report_task.delay(report_id_to_write, report.created, data)
+        write_report_task.delay(
+            report_id_to_write, report.created, data,
+            profile_report_id=report.persistent_id
+        )
@@ -0,0 +1,417 @@
+import os
+import os.path
+import json
+import time
+import shutil
+import collections
+import cPickle as pickle
+from uuid import uuid4
+from decimal import Decimal
+
+import numpy
+
+from wikimetrics.enums import Aggregation
+
+__all__ = [
+    'ReportResultStore',
+    'IndividualResults',
+]
+
+# Files written for each result
+META_FILE = 'meta.json'
+RESULTS_FILE = 'results.pickle'
+
+# integers outside of this range do not fit in an int64 column
+MAX_INT64 = numpy.iinfo(numpy.int64).max
+
+
+class ReportResultStore(object):
+    """
+    Stores the results of reports on disk, one directory per result key, so they
+    can be read without going through the queue's result backend and are kept
+    after the queue expires them.
+
+    Individual results ({'user_id|project|cohort_id': {submetric: value}}) are
+    stored as columns: integer user ids, indexes into the list of projects and
+    cohorts, and one numeric array per submetric, with one column per date for
+    timeseries.  These are memory-mapped when read back, and exposed through
+    IndividualResults, which builds each user's row only when it is asked for.
+    Everything else in the result (aggregates, failures) is small and is pickled.
+    Individual results that do not fit in columns are pickled as well.
+
+    Please do not add static methods as we want to be able to
+    mock this class easily
+    """
+
+    def __init__(self, logger, root_dir):
+        """
+        Parameters
+            logger      :
+            root_dir    : path of the directory under which results are stored
+        """
+        self.logger = logger
+        self.root_dir = root_dir
+
+    def get_result_path(self, result_key):
+        """
+        Returns
+            the path to the directory holding the result with this key, or None if
+            the key could not have been created by a report (see report_result)
+        """
+        result_key = str(result_key or '')
+        if not result_key or result_key != os.path.basename(result_key):
+            return None
+        if result_key.startswith('.'):
+            return None
+        return os.path.join(self.root_dir, result_key)
+
+    def exists(self, result_key):
+        path = self.get_result_path(result_key)
+        return path is not None and os.path.isdir(path)
+
+    def write(self, result_key, results):
+        """
+        Writes results to a temporary directory and then renames it, so readers
+        never see a partially written result.
+
+        Parameters
+            result_key  : the unique identifier of the report that computed results
+            results     : the dictionary compiled by the report's finish step
+        """
+        path = self.get_result_path(result_key)
+        if path is None:
+            raise ValueError('invalid result key: {0}'.format(result_key))
+
+        if not os.path.isdir(self.root_dir):
+            os.makedirs(self.root_dir)
+        temporary_path = os.path.join(
+            self.root_dir, '.{0}.{1}'.format(result_key, uuid4().hex)
+        )
+        os.makedirs(temporary_path)
+        try:
+            meta = {'individual': None}
+            other_results = results
+            if isinstance(results, dict) and Aggregation.IND in results:
+                encoded = encode_individual(results[Aggregation.IND])
+                if encoded is not None:
+                    meta['individual'], arrays = encoded
+                    for name, array in arrays.items():
+                        numpy.save(os.path.join(temporary_path, name + '.npy'), array)
+                    other_results = {
+                        k: v for k, v in results.items() if k != Aggregation.IND
+                    }
+
+            with open(os.path.join(temporary_path, RESULTS_FILE), 'wb') as out:
+                pickle.dump(other_results, out, pickle.HIGHEST_PROTOCOL)
+            with open(os.path.join(temporary_path, META_FILE), 'w') as out:
+                json.dump(meta, out)
+
+            if os.path.isdir(path):
+                shutil.rmtree(path)
+            os.rename(temporary_path, path)
+        except:
+            shutil.rmtree(temporary_path, ignore_errors=True)
+            raise
+
+    def read(self, result_key):
+        """
+        Returns
+            the results stored for result_key, with individual results as an
+            IndividualResults mapping, or None if nothing is stored for this key
+        """
+        if not self.exists(result_key):
+            return None
+        path = self.get_result_path(result_key)
+
+        try:
+            with open(os.path.join(path, META_FILE), 'r') as meta_file:
+                meta = json.load(meta_file)
+            with open(os.path.join(path, RESULTS_FILE), 'rb') as results_file:
+                results = pickle.load(results_file)
+        except (IOError, ValueError, pickle.UnpicklingError):
+            self.logger.exception('Could not read result {0}'.format(result_key))
+            return None
+
+        if meta['individual'] is not None:
+            results[Aggregation.IND] = IndividualResults(meta['individual'], path)
+        return results
+
+    def remove(self, result_key):
+        if self.exists(result_key):
+            shutil.rmtree(self.get_result_path(result_key))
+
+    def expire(self, max_age):
+        """
+        Removes the results written more than max_age ago, and the temporary
+        directories left behind by writes that did not finish.  Reports are never
+        deleted, so this is what keeps root_dir from growing without bound.
+
+        Parameters
+            max_age     : a timedelta
+
+        Returns
+            the number of results removed
+        """
+        if not os.path.isdir(self.root_dir):
+            return 0
+        oldest = time.time() - max_age.total_seconds()
+        removed = 0
+        for name in os.listdir(self.root_dir):
+            path = os.path.join(self.root_dir, name)
+            try:
+                if not os.path.isdir(path) or os.path.getmtime(path) >= oldest:
+                    continue
+                shutil.rmtree(path)
+            except OSError:
+                # another worker removed or rewrote it
+                self.logger.exception('Could not expire result {0}'.format(name))
+                continue
+            if not name.startswith('.'):
+                removed += 1
+        return removed
+
+
+class IndividualResults(collections.Mapping):
+    """
+    Read-only dictionary of individual results backed by memory-mapped columns.
+    Keys are WikiUserKey strings and values are {submetric: value} rows, as in
+    the results computed by AggregateReport.  Rows are built when accessed,
+    so iterating with iteritems or rows does not load every row in memory.
+    """
+
+    def __init__(self, meta, path):
+        def load(name):
+            return numpy.load(os.path.join(path, name + '.npy'), mmap_mode='r')
+
+        self.projects = [utf8(project) for project in meta['projects']]
+        self.cohorts = [utf8(cohort) for cohort in meta['cohorts']]
+        self.user_ids = load('user_ids')
+        self.project_index = load('projects')
+        self.cohort_index = load('cohorts')
+        self.submetrics = [
+            Column(column, load('submetric_{0}'.format(i)), load('missing_{0}'.format(i)))
+            for i, column in enumerate(meta['submetrics'])
+        ]
+        self.positions = None
+
+    def __len__(self):
+        return len(self.user_ids)
+
+    def __iter__(self):
+        for i in xrange(len(self)):
+            yield self.key(i)
+
+    def __contains__(self, key):
+        return key in self.get_positions()
+
+    def __getitem__(self, key):
+        return self.row(self.get_positions()[key])
+
+    def get_positions(self):
+        if self.positions is None:
+            self.positions = {key: i for i, key in enumerate(self)}
+        return self.positions
+
+    def key(self, i):
+        return '|'.join((
+            str(self.user_ids[i]),
+            self.projects[self.project_index[i]],
+            self.cohorts[self.cohort_index[i]],
+        ))
+
+    def row(self, i):
+        return {column.name: column.value(i) for column in self.submetrics}
+
+    def iteritems(self):
+        for i in xrange(len(self)):
+            yield self.key(i), self.row(i)
+
+    def itervalues(self):
+        for i in xrange(len(self)):
+            yield self.row(i)
+
+    def rows(self):
+        """
+        Yields
+            (user_id, project, cohort_id, row) for each user, without building keys
+        """
+        for i in xrange(len(self)):
+            yield (
+                str(self.user_ids[i]),
+                self.projects[self.project_index[i]],
+                self.cohorts[self.cohort_index[i]],
+                self.row(i),
+            )
+
+
+class Column(object):
+    """
+    One submetric of the individual results, see encode_column
+    """
+
+    def __init__(self, meta, data, missing):
+        self.name = utf8(meta['name'])
+        self.dates = meta['dates'] and [utf8(date) for date in meta['dates']]
+        self.data = data
+        self.missing = missing
+        kind = meta['kind']
+        if kind == 'decimal':
+            exponent = meta['exponent']
+            self.convert = lambda value: Decimal(value).scaleb(exponent)
+        elif kind == 'bool':
+            self.convert = bool
+        else:
+            self.convert = None
+
+    def value(self, i):
+        values = self.data[i].tolist()
+        missing = self.missing[i].tolist()
+        convert = self.convert
+        if self.dates is None:
+            if missing:
+                return None
+            return convert(values) if convert else values
+
+        # timeseries are ordered by date, as they were computed
+        return collections.OrderedDict(
+            (date, None if is_missing else (convert(value) if convert else value))
+            for date, value, is_missing in zip(self.dates, values, missing)
+        )
+
+
+def utf8(text):
+    """
+    Strings come back from json as unicode, turn them back into the str they were
+    """
+    return text.encode('utf-8')
+
+
+def encode_individual(individual):
+    """
+    Splits individual results into columns, see ReportResultStore
+
+    Parameters
+        individual  : dictionary of {'user_id|project|cohort_id': {submetric: value}}
+                      where values are numbers, None, or {date: number or None}
+
+    Returns
+        a tuple of (meta dictionary, dictionary of numpy arrays by file name),
+        or None if the results can not be stored as columns
+    """
+    keys = individual.keys()
+    projects, cohorts = {}, {}
+    user_ids = numpy.empty(len(keys), dtype=numpy.int64)
+    project_index = numpy.empty(len(keys), dtype=numpy.int32)
+    cohort_index = numpy.empty(len(keys), dtype=numpy.int32)
+
+    submetrics = []
+    if keys:
+        if not isinstance(individual[keys[0]], dict):
+            return None
+        submetrics = individual[keys[0]].keys()
+    for i, key in enumerate(keys):
+        parts = key.split('|')
+        if len(parts) != 3 or not parts[0].isdigit() or str(int(parts[0])) != parts[0]:
+            return None
+        if int(parts[0]) > MAX_INT64 or not isinstance(individual[key], dict):
+            return None
+        if len(individual[key]) != len(submetrics):
+            return None
+
+        user_ids[i] = int(parts[0])
+        project_index[i] = projects.setdefault(parts[1], len(projects))
+        cohort_index[i] = cohorts.setdefault(parts[2], len(cohorts))
+
+    meta = {
+        'projects': sorted(projects, key=projects.get),
+        'cohorts': sorted(cohorts, key=cohorts.get),
+        'submetrics': [],
+    }
+    arrays = {
+        'user_ids': user_ids,
+        'projects': project_index,
+        'cohorts': cohort_index,
+    }
+    for s, submetric in enumerate(submetrics):
+        try:
+            values = [individual[key][submetric] for key in keys]
+        except KeyError:
+            return None
+
+        dates = None
+        if values and isinstance(values[0], dict):
+            dates = values[0].keys()
+            try:
+                values = [[value[date] for date in dates] for value in values]
+            except (TypeError, KeyError):
+                return None
+            if any(len(value) != len(dates) for value in values):
+                return None
+        elif any(isinstance(value, dict) for value in values):
+            return None
+
+        encoded = encode_column(values, len(dates) if dates is not None else None)
+        if encoded is None:
+            return None
+        column_meta, data, missing = encoded
+        column_meta.update({'name': submetric, 'dates': dates})
+        meta['submetrics'].append(column_meta)
+        arrays['submetric_{0}'.format(s)] = data
+        arrays['missing_{0}'.format(s)] = missing
+
+    return meta, arrays
+
+
+def encode_column(values, width):
+    """
+    Stores one submetric as a numpy array of a single type, so that it reads back
+    exactly as it was computed: booleans, integers, floats, or Decimals that all
+    have the same exponent (as rounded by utils.r) stored as scaled integers.
+
+    Parameters
+        values  : list of values, or of lists of values by date if width is not None
+        width   : the number of dates in a timeseries, None otherwise
+
+    Returns
+        a tuple of (meta dictionary, numpy array of values, numpy array of booleans
+        that are True where the value is None), or None if the values do not
+        all have the same type
+    """
+    if width is not None:
+        flat = [value for by_date in values for value in by_date]
+    else:
+        flat = values
+
+    missing = numpy.array([value is None for value in flat], dtype=numpy.bool_)
+    present = [value for value in flat if value is not None]
+    types = set(type(value) for value in present)
+
+    meta = {}
+    if types <= set([bool]):
+        meta['kind'], dtype = 'bool', numpy.bool_
+    elif types <= set([int, long]):
+        meta['kind'], dtype = 'int', numpy.int64
+    elif types == set([float]):
+        meta['kind'], dtype = 'float', numpy.float64
+    elif types == set([Decimal]):
+        exponents = set(value.as_tuple().exponent for value in present)
+        if len(exponents) != 1 or not isinstance(list(exponents)[0], int):
+            return None
+        # zero keeps no sign when it is scaled back up
+        if any(value.is_signed() and not value for value in present):
+            return None
+        exponent = exponents.pop()
+        meta['kind'], meta['exponent'], dtype = 'decimal', exponent, numpy.int64
+        flat = [None if value is None else int(value.scaleb(-exponent)) for value in flat]
+    else:
+        return None
+
+    if dtype is numpy.int64 and any(
+        abs(value) > MAX_INT64 for value in flat if value is not None
+    ):
+        return None
+    data = numpy.array([0 if value is None else value for value in flat], dtype=dtype)
+    if width is not None:
+        data = data.reshape((len(values), width))
+        missing = missing.reshape((len(values), width))
+    return meta, data, missing
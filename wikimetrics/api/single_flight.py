@@ -0,0 +1,135 @@
+import json
+import time
+import hashlib
+from celery.utils.log import get_task_logger
+from wikimetrics.configurables import db, queue
+
+__all__ = [
+    'ReportSingleFlight',
+    'report_single_flight',
+]
+
+task_logger = get_task_logger(__name__)
+
+REDIS_KEY = 'wikimetrics:flight:{0}'
+LANDED_KEY = 'wikimetrics:flight:{0}:landed'
+
+
+class ReportSingleFlight(object):
+    """
+    Lets reports that compute the same thing at the same time share one
+    computation.  Identical reports (same metric parameters on the same version
+    of the same cohort, see key) that run while the first one is still running
+    wait for it, and then make their results from its stored result instead of
+    querying the mediawiki databases again.  Each report still has its own
+    ReportStore, status, result, and public file.
+
+    The running reports are shared through redis, so this works across all the
+    queue workers:
+        * lead sets the key of the report, if no other report set it
+        * land publishes the result_key of the leader, for LANDED_TTL seconds,
+          and releases the key
+        * wait polls until the leader lands, or gives up if its key expired or
+          was released without a result, in which case the report runs itself
+
+    If redis fails, reports just run on their own.  REPORT_SINGLE_FLIGHT turns
+    this off.
+    """
+
+    LANDED_TTL = 60
+
+    def __init__(self, redis=None, poll_interval=1, timeout=None):
+        """
+        Parameters
+            redis           : a redis client, defaults to the queue's result backend
+            poll_interval   : seconds between checks of a waiting report
+            timeout         : seconds before the key of a leader that never landed
+                              expires, defaults to CELERYD_TASK_TIME_LIMIT
+        """
+        self.redis = redis
+        self.poll_interval = poll_interval
+        self.timeout = timeout
+
+    def get_redis(self):
+        if self.redis is not None:
+            return self.redis
+        return queue.backend.client
+
+    def get_timeout(self):
+        if self.timeout is not None:
+            return self.timeout
+        return queue.conf.get('CELERYD_TASK_TIME_LIMIT') or 3600
+
+    def enabled(self):
+        return db.config.get('REPORT_SINGLE_FLIGHT', False)
+
+    def key(self, cohort_id, cohort_version, metric_parameters):
+        """
+        Returns
+            a hash of everything the results of a report depend on
+        """
+        return hashlib.sha1(json.dumps(
+            [cohort_id, cohort_version, metric_parameters],
+            sort_keys=True,
+            default=str,
+        )).hexdigest()
+
+    def lead(self, key, report_id):
+        """
+        Parameters
+            key         : the key of the report, see key
+            report_id   : the id of the ReportStore of the report
+
+        Returns
+            None if this report should compute its results, or else the id of the
+            report it should wait for
+        """
+        try:
+            redis = self.get_redis()
+            if redis.set(
+                REDIS_KEY.format(key), report_id, nx=True, ex=self.get_timeout()
+            ):
+                # so reports waiting for this one do not get an older result
+                redis.delete(LANDED_KEY.format(key))
+                return None
+            return redis.get(REDIS_KEY.format(key))
+        except Exception:
+            task_logger.exception('could not check for identical running reports')
+            return None
+
+    def land(self, key, report_id, result_key):
+        """
+        Releases the key of a leading report.  If result_key is not None, the
+        reports waiting for it make their results from this stored result.
+        """
+        try:
+            redis = self.get_redis()
+            if result_key is not None:
+                redis.set(LANDED_KEY.format(key), result_key, ex=self.LANDED_TTL)
+            if redis.get(REDIS_KEY.format(key)) == str(report_id):
+                redis.delete(REDIS_KEY.format(key))
+        except Exception:
+            task_logger.exception('could not release report {0}'.format(report_id))
+
+    def wait(self, key):
+        """
+        Returns
+            the result_key of the leading report once it landed, or None if it
+            finished without a stored result or never landed
+        """
+        redis = self.get_redis()
+        while True:
+            try:
+                result_key = redis.get(LANDED_KEY.format(key))
+                if result_key is not None:
+                    return result_key
+                if not redis.exists(REDIS_KEY.format(key)):
+                    # the leader may have landed since the first check
+                    return redis.get(LANDED_KEY.format(key))
+            except Exception:
+                task_logger.exception('could not wait for an identical report')
+                return None
+            time.sleep(self.poll_interval)
+
+
+report_single_flight = ReportSingleFlight()
@@ -0,0 +1,140 @@
+import time
+import threading
+from contextlib import contextmanager
+from collections import OrderedDict
+from celery.utils.log import get_task_logger
+from wikimetrics.configurables import db
+from wikimetrics.models.storage import ReportStore
+
+__all__ = [
+    'ReportStatusBuffer',
+    'report_status_buffer',
+]
+
+task_logger = get_task_logger(__name__)
+
+
+class ReportStatusBuffer(object):
+    """
+    Coalesces the updates a report tree makes to its stored reports (status,
+    queue_result_key, result_key) and writes them in one transaction.
+
+    Outside of `batch`, updates are written right away.  Inside it, they are
+    kept, the latest value of each column of each report winning, and written:
+        * when the batch ends, so a finished task has written all its updates
+        * when an update comes REPORT_STATUS_FLUSH_DELAY seconds or more after
+          the last write, so the status shown in the UI is never older than that
+        * every REPORT_STATUS_FLUSH_DELAY seconds by a background thread, so an
+          update with no updates after it is not kept until the batch ends
+
+    There is one buffer per process, see report_status_buffer.  This is thread
+    safe, so reports running in worker threads can share it.
+    """
+
+    def __init__(self, flush_delay=None, async_flush=True):
+        """
+        Parameters
+            flush_delay : defaults to REPORT_STATUS_FLUSH_DELAY
+            async_flush : whether to start the background thread, if there is a
+                          flush delay
+        """
+        self.flush_delay = flush_delay
+        self.async_flush = async_flush
+        self.lock = threading.Lock()
+        # held while writing, so an older flush never commits after a newer one
+        self.flush_lock = threading.Lock()
+        self.pending = OrderedDict()
+        self.depth = 0
+        self.last_flush = 0
+        self.flush_thread = None
+
+    def get_flush_delay(self):
+        if self.flush_delay is not None:
+            return self.flush_delay
+        return db.config.get('REPORT_STATUS_FLUSH_DELAY', 0)
+
+    @contextmanager
+    def batch(self):
+        """
+        Buffers the updates made inside this context, see the class docstring.
+        Batches can be nested, updates are written when the outermost one ends.
+        """
+        with self.lock:
+            self.depth += 1
+        if self.async_flush and self.get_flush_delay() > 0:
+            self.start_flush_thread()
+        try:
+            yield self
+        finally:
+            with self.lock:
+                self.depth -= 1
+                done = self.depth == 0
+            if done:
+                self.flush()
+
+    def update(self, report_id, **values):
+        """
+        Parameters
+            report_id   : the id of the ReportStore to update
+            values      : the new values of its columns
+        """
+        with self.lock:
+            if report_id in self.pending:
+                self.pending[report_id].update(values)
+            else:
+                self.pending[report_id] = values
+            buffering = self.depth > 0
+            overdue = time.time() - self.last_flush >= self.get_flush_delay()
+        if not buffering or overdue:
+            self.flush()
+
+    def flush(self):
+        """
+        Writes all the pending updates in one transaction.  If that fails, they
+        are kept to be written with the next flush, under any newer updates.
+        Flushes are written one after the other, in the order they took their
+        updates, so the last status written is always the newest one.
+        """
+        with self.flush_lock:
+            with self.lock:
+                pending = self.pending
+                self.pending = OrderedDict()
+                self.last_flush = time.time()
+            if not pending:
+                return
+
+            table = ReportStore.__table__
+            try:
+                with db.get_engine().begin() as connection:
+                    for report_id, values in pending.items():
+                        connection.execute(
+                            table.update().values(**values)
+                            .where(table.c.id == report_id)
+                        )
+            except Exception:
+                with self.lock:
+                    for report_id, newer in self.pending.items():
+                        pending.setdefault(report_id, {}).update(newer)
+                    self.pending = pending
+                raise
+
+    def start_flush_thread(self):
+        with self.lock:
+            if self.flush_thread is not None and self.flush_thread.is_alive():
+                return
+            self.flush_thread = threading.Thread(
+                target=self.flush_periodically, name='report-status-flush'
+            )
+            self.flush_thread.daemon = True
+            self.flush_thread.start()
+
+    def flush_periodically(self):
+        while True:
+            time.sleep(self.get_flush_delay() or 1)
+            try:
+                self.flush()
+            except Exception:
+                task_logger.exception('could not write buffered report statuses')
+
+
+report_status_buffer = ReportStatusBuffer()
@@ -3,6 +3,7 @@ import os
 import yaml
 import subprocess
 from celery.signals import task_postrun
+from celery.utils.log import get_task_logger
 from mwoauth import ConsumerToken
 
 
@@ -211,6 +212,13 @@ def task_postrun(*args, **kwargs):
     for project, session in db.mediawiki_sessions.items():
         session.remove()
 
+    # share the query stats of this worker, see wikimetrics.query_stats
+    from wikimetrics.query_stats import query_stats
+    try:
+        query_stats.publish(queue.backend.client)
+    except Exception:
+        get_task_logger(__name__).exception('could not publish query stats')
+
 
 def get_absolute_path():
     """
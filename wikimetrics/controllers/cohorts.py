@@ -68,6 +68,14 @@ def cohorts_list():
     } for c in cohorts])
 
 
+@app.route('/cohorts/cache/stats')
+def cohort_cache_stats():
+    """
+    Shows the hit and miss counters of this process's cohort snapshot cache
+    """
+    return json_response(g.cohort_service.get_cache_stats())
+
+
 @app.route('/cohorts/<string:cohort_id>/membership')
 def cohort_membership(cohort_id):
     """
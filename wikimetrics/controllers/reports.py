@@ -1,22 +1,38 @@
 import json
-from copy import deepcopy
-from csv import DictWriter
+from csv import writer as writer_for_csv
+from itertools import islice
+from collections import defaultdict
 from StringIO import StringIO
 from sqlalchemy import or_
 from sqlalchemy.orm.exc import NoResultFound
-from flask import render_template, request, redirect, url_for, Response, g, flash
+from flask import (
+    render_template, request, redirect, url_for, Response, g, flash, stream_with_context,
+    send_file
+)
 from flask.ext.login import current_user
-from wikimetrics.configurables import app, db
+from wikimetrics.configurables import app, db, queue
 from wikimetrics.forms import ProgramMetricsForm
 from wikimetrics.models import (
     Report, RunReport, RunProgramMetricsReport, ReportStore,
-    WikiUserKey, TaskErrorStore, ValidateCohort
+    WikiUserKey, TaskErrorStore, ValidateCohort, ReportProfileStore
 )
 from wikimetrics.utils import (
-    json_response, json_error, json_redirect, thirty_days_ago
+    json_response, json_error, json_redirect, thirty_days_ago,
+    parse_date_from_public_report_file
 )
+from wikimetrics.exceptions import PublicReportIOError
+from wikimetrics.controllers.authentication import is_public
+from wikimetrics.query_stats import query_stats
 from wikimetrics.enums import Aggregation, TimeseriesChoices
-from wikimetrics.api import PublicReportFileManager, CohortService, CentralAuthService
+from wikimetrics.api import (
+    PublicReportFileManager, CohortService, CentralAuthService, IndividualResults
+)
+
+
+# user names are looked up for this many users at a time when writing csv results
+USER_NAME_BATCH_SIZE = 1000
+# and the csv is sent in chunks of about this many characters
+CSV_CHUNK_SIZE = 64 * 1024
 
 
 @app.before_request
@@ -69,6 +85,32 @@ def set_public_report(report_id):
     return json_response(message='Update successful')
 
 
+@app.route('/reports/public/<int:report_id>/full_report.json')
+@is_public
+def public_recurrent_report(report_id):
+    """
+    Serves the coalesced results of a public recurrent report.  full_report.json is
+    brought up to date with the runs logged since it was last requested.  With
+    ?since=YYYY-MM-DD only the runs after that date are coalesced and returned,
+    so clients that already have the earlier runs do not download them again.
+    """
+    since = request.args.get('since')
+    try:
+        if since:
+            parse_date_from_public_report_file(since)
+            res = json_response(g.file_manager.coalesce_runs_since(report_id, since))
+        else:
+            path = g.file_manager.get_coalesced_report_path(report_id)
+            res = send_file(path, mimetype='application/json', cache_timeout=0)
+        # public reports are read by dashboards on other domains
+        res.headers['Access-Control-Allow-Origin'] = '*'
+        return res
+    except ValueError:
+        return json_error('since should be a date like 2014-07-01: {0}'.format(since))
+    except PublicReportIOError:
+        return json_error('no public recurrent report with id: {0}'.format(report_id))
+
+
 @app.route('/reports/')
 def reports_index():
     """
@@ -118,6 +160,9 @@ def reports_list():
             TaskErrorStore.task_type == 'report',
             TaskErrorStore.task_type == None))\
         .all()
+    profiles = ReportProfileStore.get_profiles(
+        db_session, [r.ReportStore.id for r in report_tuples]
+    )
     # TODO: update status for all reports at all times (not just show_in_ui ones)
     # update status for each report and build response
     reports = []
@@ -126,12 +171,35 @@ def reports_list():
         report.update_status()
         report_dict = report._asdict()
         report_dict['error_message'] = report_tuple.message
+        report_dict['profile'] = profiles.get(report.id, [])
         reports.append(report_dict)
 
     # TODO fix json_response to deal with ReportStore objects
     return json_response(reports=reports)
 
 
+@app.route('/reports/query-stats')
+def reports_query_stats():
+    """
+    Shows the time, rows, and bytes of the queries sent by all the processes,
+    by database, metric, and project, the most time consuming first.
+    If the queue's redis is not reachable, only this process's queries are shown.
+    Pass limit to see only that many of them.
+    """
+    try:
+        redis = queue.backend.client
+        query_stats.publish(redis)
+        stats, source = query_stats.collect(redis), 'all'
+    except Exception:
+        app.logger.exception('could not collect query stats')
+        stats, source = query_stats.as_list(), 'local'
+
+    limit = request.args.get('limit', type=int)
+    if limit:
+        stats = stats[:limit]
+    return json_response(source=source, queries=stats)
+
+
 @app.route('/reports/program-global-metrics', methods=['GET', 'POST'])
 def program_metrics_reports_request():
     """
@@ -195,6 +263,24 @@ def get_celery_task(result_key):
         return (None, None)
 
 
+def get_report_result(celery_task, pj):
+    """
+    Gets the results of a report from the result store, falling back to the
+    result of its celery task for reports that are not in the result store.
+
+    Parameters
+        celery_task : the celery task object, as returned by get_celery_task
+        pj          : the database report object, as returned by get_celery_task
+
+    Returns
+        The results of the report, or None if they are not ready
+    """
+    task_result = pj.get_stored_result()
+    if task_result is None and celery_task.ready() and celery_task.successful():
+        task_result = pj.get_result_safely(celery_task.get())
+    return task_result
+
+
 @app.route('/reports/status/<result_key>')
 def report_status(result_key):
     celery_task, pj = get_celery_task(result_key)
@@ -207,19 +293,17 @@ def report_result_csv(result_key):
     if not celery_task:
         return json_error('no task exists with id: {0}'.format(result_key))
 
-    if celery_task.ready() and celery_task.successful():
-        result = celery_task.get()
-        task_result = pj.get_result_safely(result)
+    task_result = get_report_result(celery_task, pj)
+    if task_result is not None:
         p = pj.pretty_parameters()
 
-        user_names = get_usernames_for_task_result(task_result)
-
         if 'Metric_timeseries' in p and p['Metric_timeseries'] != TimeseriesChoices.NONE:
-            csv_io = get_timeseries_csv(task_result, pj, p, user_names)
+            csv_rows = get_timeseries_csv(task_result, pj, p)
         else:
-            csv_io = get_simple_csv(task_result, pj, p, user_names)
+            csv_rows = get_simple_csv(task_result, pj, p)
 
-        res = Response(csv_io.getvalue(), mimetype='text/csv')
+        # the csv is written as it is sent, instead of being built up in memory
+        res = Response(stream_with_context(get_csv_lines(csv_rows)), mimetype='text/csv')
         res.headers['Content-Disposition'] =\
             'attachment; filename={0}.csv'.format(pj.name)
         return res
@@ -256,23 +340,107 @@ def get_usernames_for_task_result(task_result):
     return user_names
 
 
-def get_timeseries_csv(task_result, pj, parameters, user_names):
+def get_individual_rows(individual_results):
+    """
+    Parameters
+        individual_results  : the individual results of a report, keyed by WikiUserKey
+
+    Returns
+        A generator of (user_id, user_name, project, row) for each user.  User names
+        are looked up USER_NAME_BATCH_SIZE users at a time.
+    """
+    if isinstance(individual_results, IndividualResults):
+        rows = individual_results.rows()
+    else:
+        rows = (
+            (key.user_id, key.user_project, key.cohort_id, row)
+            for key, row in (
+                (WikiUserKey.fromstr(key), row)
+                for key, row in individual_results.iteritems()
+            )
+        )
+
+    session = db.get_session()
+    while True:
+        batch = list(islice(rows, USER_NAME_BATCH_SIZE))
+        if not batch:
+            break
+
+        user_ids = defaultdict(list)
+        for user_id, project, cohort_id, row in batch:
+            user_ids[(project, cohort_id)].append(user_id)
+        user_names = {
+            (project, cohort_id): g.cohort_service.get_wikiusernames_for_users(
+                cohort_id, project, ids, session
+            )
+            for (project, cohort_id), ids in user_ids.items()
+        }
+
+        for user_id, project, cohort_id, row in batch:
+            user_name = user_names[(project, cohort_id)].get(user_id, '')
+            yield user_id, user_name, project, row
+
+
+def get_parameter_rows(parameters):
+    """
+    Parameters
+        parameters  : a dictionary of pj.parameters
+
+    Returns
+        A generator of csv rows listing the parameters, separated from the results
+    """
+    # generate some empty rows to separate the result
+    # from the parameters
+    yield []
+    yield []
+    yield ['parameters']
+
+    for key, value in sorted(parameters.items()):
+        yield [key, value]
+
+
+def get_csv_lines(rows):
+    """
+    Parameters
+        rows    : an iterable of lists of values
+
+    Returns
+        A generator of strings of csv lines, CSV_CHUNK_SIZE characters or more at a
+        time, for a streamed response
+    """
+    csv_io = StringIO()
+    writer = writer_for_csv(csv_io)
+    for row in rows:
+        writer.writerow(row)
+        if csv_io.tell() >= CSV_CHUNK_SIZE:
+            yield csv_io.getvalue()
+            csv_io.seek(0)
+            csv_io.truncate()
+    yield csv_io.getvalue()
+
+
+def pad(row, width):
+    """
+    Fills a row with empty values so it has the same length as the csv header
+    """
+    return row + [''] * (width - len(row))
+
+
+def get_timeseries_csv(task_result, pj, parameters):
     """
     Parameters
         task_result : the result dictionary from Celery
         pj          : a pointer to the permanent job
         parameters  : a dictionary of pj.parameters
-        user_names  : dictionary of user names (keyed by (user_id, project))
 
     Returns
-        A StringIO instance representing timeseries CSV
+        A generator of the rows of a timeseries CSV, as lists of values
     """
-    csv_io = StringIO()
+    columns = []
     if task_result:
-        columns = []
-
-        if Aggregation.IND in task_result:
-            columns = task_result[Aggregation.IND].values()[0].values()[0].keys()
+        if task_result.get(Aggregation.IND):
+            first_row = next(task_result[Aggregation.IND].itervalues())
+            columns = next(first_row.itervalues()).keys()
         elif Aggregation.SUM in task_result:
             columns = task_result[Aggregation.SUM].values()[0].keys()
         elif Aggregation.AVG in task_result:
@@ -280,89 +448,46 @@ def get_timeseries_csv(task_result, pj, parameters, user_names):
         elif Aggregation.STD in task_result:
             columns = task_result[Aggregation.STD].values()[0].keys()
 
-        # if task_result is not empty find header in first row
-        fieldnames = ['user_id', 'user_name', 'project', 'submetric'] + sorted(columns)
-    else:
-        fieldnames = ['user_id', 'user_name', 'project', 'submetric']
-    writer = DictWriter(csv_io, fieldnames)
-
-    # collect rows to output in CSV
-    task_rows = []
+    # if task_result is not empty find header in first row
+    columns = sorted(columns)
+    fieldnames = ['user_id', 'user_name', 'project', 'submetric'] + columns
+    yield fieldnames
 
     # Individual Results
     if Aggregation.IND in task_result:
-        # fold user_id into dict so we can use DictWriter to escape things
-        for wiki_user_key_str, row in task_result[Aggregation.IND].iteritems():
-            wiki_user_key = WikiUserKey.fromstr(wiki_user_key_str)
-            user_id = wiki_user_key.user_id
-            project = wiki_user_key.user_project
-            # careful tuple stores user_id like a string
-            user_name = user_names.get(wiki_user_key, '')
-            for subrow in row.keys():
-                task_row = row[subrow].copy()
-                task_row['user_id'] = user_id
-                task_row['user_name'] = user_name
-                task_row['project'] = project
-                task_row['submetric'] = subrow
-                task_rows.append(task_row)
+        individual_rows = get_individual_rows(task_result[Aggregation.IND])
+        for user_id, user_name, project, row in individual_rows:
+            for submetric, values in row.iteritems():
+                yield [user_id, user_name, project, submetric] + [
+                    values.get(column, '') for column in columns
+                ]
 
     # Aggregate Results
-    if Aggregation.SUM in task_result:
-        row = task_result[Aggregation.SUM]
-        for subrow in row.keys():
-            task_row = row[subrow].copy()
-            task_row['user_id'] = Aggregation.SUM
-            task_row['submetric'] = subrow
-            task_rows.append(task_row)
-
-    if Aggregation.AVG in task_result:
-        row = task_result[Aggregation.AVG]
-        for subrow in row.keys():
-            task_row = row[subrow].copy()
-            task_row['user_id'] = Aggregation.AVG
-            task_row['submetric'] = subrow
-            task_rows.append(task_row)
-
-    if Aggregation.STD in task_result:
-        row = task_result[Aggregation.STD]
-        for subrow in row.keys():
-            task_row = row[subrow].copy()
-            task_row['user_id'] = Aggregation.STD
-            task_row['submetric'] = subrow
-            task_rows.append(task_row)
+    for aggregate in (Aggregation.SUM, Aggregation.AVG, Aggregation.STD):
+        if aggregate in task_result:
+            for submetric, values in task_result[aggregate].iteritems():
+                yield [aggregate, '', '', submetric] + [
+                    values.get(column, '') for column in columns
+                ]
 
-    # generate some empty rows to separate the result
-    # from the parameters
-    task_rows.append({})
-    task_rows.append({})
-    task_rows.append({'user_id': 'parameters'})
-
-    for key, value in sorted(parameters.items()):
-        task_rows.append({'user_id': key , fieldnames[1]: value})
-
-    writer.writeheader()
-    writer.writerows(task_rows)
-    return csv_io
+    for row in get_parameter_rows(parameters):
+        yield pad(row, len(fieldnames))
 
 
-def get_simple_csv(task_result, pj, parameters, user_names):
+def get_simple_csv(task_result, pj, parameters):
     """
     Parameters
         task_result : the result dictionary from Celery
         pj          : a pointer to the permanent job
         parameters  : a dictionary of pj.parameters
-        user_names  : dictionary of user names (keyed by WikiUserKey)
 
     Returns
-        A StringIO instance representing simple CSV
+        A generator of the rows of a simple CSV, as lists of values
     """
-
-    csv_io = StringIO()
+    columns = []
     if task_result:
-        columns = []
-
-        if Aggregation.IND in task_result:
-            columns = task_result[Aggregation.IND].values()[0].keys()
+        if task_result.get(Aggregation.IND):
+            columns = next(task_result[Aggregation.IND].itervalues()).keys()
         elif Aggregation.SUM in task_result:
             columns = task_result[Aggregation.SUM].keys()
         elif Aggregation.AVG in task_result:
@@ -370,58 +495,26 @@ def get_simple_csv(task_result, pj, parameters, user_names):
         elif Aggregation.STD in task_result:
             columns = task_result[Aggregation.STD].keys()
 
-        # if task_result is not empty find header in first row
-        fieldnames = ['user_id', 'user_name', 'project'] + columns
-    else:
-        fieldnames = ['user_id', 'user_name', 'project']
-    writer = DictWriter(csv_io, fieldnames)
+    # if task_result is not empty find header in first row
+    fieldnames = ['user_id', 'user_name', 'project'] + columns
+    yield fieldnames
 
-    # collect rows to output in CSV
-    task_rows = []
     # Individual Results
     if Aggregation.IND in task_result:
-        # fold user_id into dict so we can use DictWriter to escape things
-        for wiki_user_key_str, row in task_result[Aggregation.IND].iteritems():
-            wiki_user_key = WikiUserKey.fromstr(wiki_user_key_str)
-            user_id = wiki_user_key.user_id
-            project = wiki_user_key.user_project
-
-            # careful tuple stores user_id like a string
-            user_name = user_names.get(wiki_user_key, '')
-            task_row = row.copy()
-            task_row['user_id'] = user_id
-            task_row['user_name'] = user_name
-            task_row['project'] = project
-            task_rows.append(task_row)
+        individual_rows = get_individual_rows(task_result[Aggregation.IND])
+        for user_id, user_name, project, row in individual_rows:
+            yield [user_id, user_name, project] + [
+                row.get(column, '') for column in columns
+            ]
 
     # Aggregate Results
-    if Aggregation.SUM in task_result:
-        task_row = task_result[Aggregation.SUM].copy()
-        task_row['user_id'] = Aggregation.SUM
-        task_rows.append(task_row)
-
-    if Aggregation.AVG in task_result:
-        task_row = task_result[Aggregation.AVG].copy()
-        task_row['user_id'] = Aggregation.AVG
-        task_rows.append(task_row)
+    for aggregate in (Aggregation.SUM, Aggregation.AVG, Aggregation.STD):
+        if aggregate in task_result:
+            row = task_result[aggregate]
+            yield [aggregate, '', ''] + [row.get(column, '') for column in columns]
 
-    if Aggregation.STD in task_result:
-        task_row = task_result[Aggregation.STD].copy()
-        task_row['user_id'] = Aggregation.STD
-        task_rows.append(task_row)
-
-    # generate some empty rows to separate the result
-    # from the parameters
-    task_rows.append({})
-    task_rows.append({})
-    task_rows.append({'user_id': 'parameters'})
-
-    for key, value in sorted(parameters.items()):
-        task_rows.append({'user_id': key , fieldnames[1]: value})
-
-    writer.writeheader()
-    writer.writerows(task_rows)
-    return csv_io
+    for row in get_parameter_rows(parameters):
+        yield pad(row, len(fieldnames))
 
 
 @app.route('/reports/result/<result_key>.json')
@@ -430,11 +523,11 @@ def report_result_json(result_key):
     if not celery_task:
         return json_error('no task exists with id: {0}'.format(result_key))
 
-    if celery_task.ready() and celery_task.successful():
-        result = celery_task.get()
-        json_result = pj.get_json_result(result)
-        if Aggregation.IND in result[result_key]:
-            user_names = get_usernames_for_task_result(result[result_key])
+    task_result = get_report_result(celery_task, pj)
+    if task_result is not None:
+        json_result = pj.get_json_result({result_key: task_result})
+        if Aggregation.IND in task_result:
+            user_names = get_usernames_for_task_result(task_result)
             json_result_with_names = add_user_names_to_json(json_result,
                                                             user_names)
             return json_response(json_result_with_names)
@@ -452,16 +545,12 @@ def add_user_names_to_json(json_result, user_names):
     Returns
         The result dict, with user names added to the WikiUserKey id strings
     """
-    new_individual_ids = {}
-    for individual in json_result['result'][Aggregation.IND]:
-        user_name = user_names[WikiUserKey.fromstr(individual)]
-        new_id_string = '{}|{}'.format(user_name, individual)
-        new_individual_ids[individual] = new_id_string
-
-    json_with_names = deepcopy(json_result)
+    # copy only what changes, individual results can be read from the result store
+    json_with_names = dict(json_result)
+    json_with_names['result'] = dict(json_result['result'])
     json_with_names['result'][Aggregation.IND] = {
-        new_individual_ids[key]: value for (key, value) in
-        json_result['result'][Aggregation.IND].items()}
+        '{}|{}'.format(user_names[WikiUserKey.fromstr(key)], key): value
+        for key, value in json_result['result'][Aggregation.IND].iteritems()}
     return json_with_names
 
 
@@ -7,7 +7,7 @@ It uses Flask's handy config module to configure itself.
 import json
 import os
 
-from threading import Lock
+from threading import Lock, RLock
 from os.path import exists
 from urllib2 import urlopen
 
@@ -17,6 +17,7 @@ from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy import exc
 from sqlalchemy import event
 from sqlalchemy.pool import Pool, NullPool
+from wikimetrics.query_stats import instrument_engine
 
 __all__ = [
     'Database',
@@ -82,7 +83,11 @@ class Database(object):
         self.wikimetrics_session = None
 
         self.mediawiki_engines = {}
+        self.mediawiki_host_engines = {}
         self.mediawiki_sessions = {}
+        # mediawiki sessions and engines can be requested from several threads
+        # at once, see MultiProjectMetricReport
+        self.mediawiki_lock = RLock()
 
         self.centralauth_engine = None
         self.centralauth_sessionmaker = None
@@ -108,6 +113,7 @@ class Database(object):
                 connect_args={"charset" : "utf8"},
                 pool_size=self.config['WIKIMETRICS_POOL_SIZE'],
             )
+            self.instrument(self.wikimetrics_engine, 'wikimetrics')
 
         return self.wikimetrics_engine
 
@@ -149,25 +155,46 @@ class Database(object):
             new sqlalchemy session connected to the appropriate database.  This method
             caches sqlalchemy session makers and creates sessions from those.
         """
-        if project not in self.mediawiki_sessions:
-            import wikimetrics.models.mediawiki
-            engine = self.get_mw_engine(project)
-            if self.config['DEBUG']:
-                self.MediawikiBase.metadata.create_all(
-                    engine,
-                    checkfirst=True
+        with self.mediawiki_lock:
+            if project not in self.mediawiki_sessions:
+                import wikimetrics.models.mediawiki
+                engine = self.get_mw_engine(project)
+                if self.config['DEBUG']:
+                    self.MediawikiBase.metadata.create_all(
+                        engine,
+                        checkfirst=True
+                    )
+
+                self.mediawiki_sessions[project] = scoped_session(
+                    sessionmaker(engine)
                 )
 
-            self.mediawiki_sessions[project] = scoped_session(sessionmaker(engine))
-
         # an unhandled exception would leave the session in a bad state, roll it back:
         if not self.mediawiki_sessions[project].is_active:
             self.mediawiki_sessions[project].rollback()
         return self.mediawiki_sessions[project]
 
+    def get_mw_project(self, session):
+        """
+        Parameters:
+            session : a session returned by get_mw_session
+
+        Returns:
+            the name of the mediawiki project the session is open on, or None
+        """
+        with self.mediawiki_lock:
+            for project, engine in self.mediawiki_engines.items():
+                if session.bind is engine:
+                    return project
+        return None
+
     def get_mw_engine(self, project):
         """
         Based on the mediawiki project passed in, create a sqlalchemy engine.
+        If MEDIAWIKI_HOST_ENGINE_URL_TEMPLATE is configured and the project's
+        database host is known, the engine shares the pooled engine of that host
+        (see get_mw_host_engine) and switches to the project's database on use.
+        Otherwise, the engine connects to the project's database directly.
 
         Parameters:
             project : string name of the mediawiki project (for example: wiki, arwiki)
@@ -175,24 +202,75 @@ class Database(object):
         Returns:
             new or cached sqlalchemy engine connected to the appropriate database.
         """
-        if project not in self.mediawiki_engines:
-            engine_template = self.config['MEDIAWIKI_ENGINE_URL_TEMPLATE']
-
-            self.mediawiki_engines[project] = create_engine(
-                engine_template.format(project),
-                echo=self.config['SQL_ECHO'],
-                convert_unicode=True,
-                # because we are hitting 900 projects in parallel at the same time,
-                # pooling does not work as we exhaust our allowed connections for the
-                # labsdb user.  This is because we connect with database-specific URIs
-                # TODO: connect to all mediawiki databases with one generic URI and
-                #       re-enable pooling
-                # NOTE: when doing this, don't use s4.labsdb as quarry has dibs :)
-                poolclass=NullPool,
-            )
+        with self.mediawiki_lock:
+            if project not in self.mediawiki_engines:
+                host_engine = None
+                if self.config.get('MEDIAWIKI_HOST_ENGINE_URL_TEMPLATE'):
+                    host = self.get_project_host_map().get(project)
+                    if host:
+                        host_engine = self.get_mw_host_engine(host)
+
+                if host_engine is not None:
+                    database_template = self.config.get(
+                        'MEDIAWIKI_DATABASE_TEMPLATE', '{0}'
+                    )
+                    # shares the pool, dialect and events of the host engine
+                    self.mediawiki_engines[project] = host_engine.execution_options(
+                        mediawiki_database=database_template.format(project)
+                    )
+                else:
+                    engine_template = self.config['MEDIAWIKI_ENGINE_URL_TEMPLATE']
+
+                    self.mediawiki_engines[project] = create_engine(
+                        engine_template.format(project),
+                        echo=self.config['SQL_ECHO'],
+                        convert_unicode=True,
+                        # because we are hitting 900 projects in parallel at the same
+                        # time, pooling does not work as we exhaust our allowed
+                        # connections for the labsdb user.  This is because we
+                        # connect with database-specific URIs.  Configure
+                        # MEDIAWIKI_HOST_ENGINE_URL_TEMPLATE to pool by host instead
+                        # NOTE: when doing this, don't use s4.labsdb as quarry has dibs
+                        poolclass=NullPool,
+                    )
+                    self.instrument(self.mediawiki_engines[project], 'mediawiki')
 
         return self.mediawiki_engines[project]
 
+    def get_mw_host_engine(self, host):
+        """
+        Create a pooled sqlalchemy engine for a mediawiki database host.  All the
+        projects on that host share its pool, so connections are reused across
+        projects instead of paying a new handshake for each MetricReport.
+        The pool keeps as many connections as MEDIAWIKI_MAX_CONNECTIONS_PER_HOST
+        lets a process use at once, plus up to MEDIAWIKI_MAX_OVERFLOW temporary
+        ones, and reconnects the ones older than MEDIAWIKI_POOL_RECYCLE seconds
+        so the host's idle timeout does not drop them under a query.
+
+        Parameters:
+            host    : name of the database host, as found in get_project_host_map
+
+        Returns:
+            new or cached sqlalchemy engine connected to the host, without a database
+        """
+        with self.mediawiki_lock:
+            if host not in self.mediawiki_host_engines:
+                engine_template = self.config['MEDIAWIKI_HOST_ENGINE_URL_TEMPLATE']
+                engine = create_engine(
+                    engine_template.format(host),
+                    echo=self.config['SQL_ECHO'],
+                    convert_unicode=True,
+                    pool_size=self.config.get('MEDIAWIKI_MAX_CONNECTIONS_PER_HOST') or 4,
+                    max_overflow=self.config.get('MEDIAWIKI_MAX_OVERFLOW', 2),
+                    pool_recycle=self.config.get('MEDIAWIKI_POOL_RECYCLE', 300),
+                    pool_timeout=self.config.get('MEDIAWIKI_POOL_TIMEOUT', 60),
+                )
+                event.listen(engine, 'before_cursor_execute', use_mediawiki_database)
+                self.instrument(engine, 'mediawiki')
+                self.mediawiki_host_engines[host] = engine
+
+        return self.mediawiki_host_engines[host]
+
     def get_ca_session(self):
         """
         On the first run, instantiates the centralauth session maker.
@@ -241,8 +319,21 @@ class Database(object):
                 convert_unicode=True,
                 poolclass=NullPool,
             )
+            self.instrument(self.centralauth_engine, 'centralauth')
         return self.centralauth_engine
 
+    def instrument(self, engine, database):
+        """
+        Records the queries sent by engine in wikimetrics.query_stats,
+        unless QUERY_STATS is turned off
+
+        Parameters:
+            engine      : a new sqlalchemy engine
+            database    : the name to record its queries under
+        """
+        if self.config.get('QUERY_STATS', True):
+            instrument_engine(engine, database)
+
     def get_project_host_map(self, usecache=True):
         """
         Retrieves the list of mediawiki projects from noc.wikimedia.org.
@@ -286,6 +377,20 @@ class Database(object):
             return self._project_host_map
 
 
+def use_mediawiki_database(conn, cursor, statement, parameters, context, executemany):
+    """
+    Switches a pooled mediawiki host connection to the database of the project
+    that is using it, see Database.get_mw_host_engine.  The current database is
+    remembered on the pooled connection so USE is only issued when it changes.
+    """
+    if context is None:
+        return
+    database = context.execution_options.get('mediawiki_database')
+    if database and conn.connection.info.get('mediawiki_database') != database:
+        cursor.execute('USE `{0}`'.format(database.replace('`', '``')))
+        conn.connection.info['mediawiki_database'] = database
+
+
 @event.listens_for(Pool, "checkout")
 def ping_connection(dbapi_connection, connection_record, connection_proxy):
     """
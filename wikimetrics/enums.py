@@ -5,6 +5,11 @@ class Aggregation(object):
     STD = 'Standard Deviation'
 
 
+class ReportStatus(object):
+    # used alongside celery.states while a report shows how far along it is
+    PROGRESS = 'PROGRESS'
+
+
 class CohortUserRole(object):
     OWNER = 'OWNER'
     VIEWER = 'VIEWER'
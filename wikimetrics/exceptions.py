@@ -32,3 +32,10 @@ class InvalidCohort(Exception):
     Thrown when invalid cohorts are retrieved from the database for reporting
     """
     pass
+
+
+class Cancelled(Exception):
+    """
+    Thrown in a worker thread of parallel_map when the map was cancelled
+    """
+    pass
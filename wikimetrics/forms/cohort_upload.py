@@ -51,7 +51,9 @@ class CohortUpload(WikimetricsSecureForm):
 
         Returns
             nothing, but sets self.records to the parsed lines of the csv
-            as string types
+            as string types.  Uploads of more than CENTRALAUTH_SYNC_EXPANSION_LIMIT
+            users are not expanded via centralauth here, self.centralauth_deferred
+            is set instead and the validation task expands them.
         """
 
         if self.csv.data:
@@ -64,9 +66,16 @@ class CohortUpload(WikimetricsSecureForm):
 
         records = format_records(csv_lines, self.project.data)
 
+        self.centralauth_deferred = False
         if self.centralauth.data is True:
-            ca_session = db.get_ca_session()
-            records = g.centralauth_service.expand_via_centralauth(records, ca_session)
+            limit = db.config.get('CENTRALAUTH_SYNC_EXPANSION_LIMIT')
+            if limit is not None and len(records) > limit:
+                self.centralauth_deferred = True
+            else:
+                ca_session = db.get_ca_session()
+                records = g.centralauth_service.expand_via_centralauth(
+                    records, ca_session
+                )
 
         self.records = records
 
@@ -1,5 +1,7 @@
+from sqlalchemy import select
+from wikimetrics.configurables import db
 from wikimetrics.forms import WikimetricsSecureForm
-from wikimetrics.models import Revision
+from wikimetrics.models import Revision, create_cohort_table
 
 
 class Metric(WikimetricsSecureForm):
@@ -35,10 +37,31 @@ class Metric(WikimetricsSecureForm):
         """
         return {user: None for user in user_ids}
 
+    def supports_chunking(self):
+        """
+        Whether the results for a list of users are the same as the merged
+        results for any split of that list.  If so, MetricReport can run this
+        metric on huge cohorts one chunk of users at a time.  Metrics that
+        compute results across users should return False.
+        """
+        return True
+
+    def supports_backfill(self):
+        """
+        Whether the result for each day of a date range is the same as the result
+        of running this metric over the whole range with a daily timeseries, and
+        taking that day's slice.  If so, missed runs of a recurrent report on this
+        metric can be backfilled with one query, see BackfillReport.
+        """
+        return False
+
     def filter(self, query, user_ids, column=Revision.rev_user):
         """
         Filters the query by the provided user_ids.
         If user_ids is an empty list, does nothing.
+        If there are more than COHORT_TEMPORARY_TABLE_THRESHOLD user_ids, they are
+        inserted into a temporary table which the query then selects from.  This
+        avoids sending huge IN() lists that MySQL parses slowly and plans badly.
 
         Parameters
             query       : A sqlalchemy query that may need to be filtered
@@ -50,5 +73,10 @@ class Metric(WikimetricsSecureForm):
             The same query passed in, with any user_id filters necessary
         """
         if user_ids and len(user_ids):
-            query = query.filter(column.in_(user_ids))
+            threshold = db.config.get('COHORT_TEMPORARY_TABLE_THRESHOLD')
+            if threshold and len(user_ids) > threshold:
+                cohort = create_cohort_table(query.session, user_ids)
+                query = query.filter(column.in_(select([cohort.c.user_id])))
+            else:
+                query = query.filter(column.in_(user_ids))
         return query
@@ -3,7 +3,10 @@ from sqlalchemy.sql.expression import label
 from wtforms.validators import Required
 
 from wikimetrics.utils import thirty_days_ago, today
+from wikimetrics.enums import TimeseriesChoices
 from wikimetrics.models import Page, Revision, Archive
+from wikimetrics.models.storage import EditRollupStore
+from wikimetrics.api import EditRollupService
 from wikimetrics.forms.fields import CommaSeparatedIntegerListField, BetterBooleanField
 from timeseries_metric import TimeseriesMetric
 
@@ -37,6 +40,10 @@ class NamespaceEdits(TimeseriesMetric):
 
     NOTE: on September 2014, this metric was updated to count archived revisions
           this is now the default behavior, but is an option that you can turn off
+
+    NOTE: when archived revisions are counted in all namespaces, the edits of
+          projects with an edit rollup are counted from it, see EditRollupService,
+          except in backfill mode, see TimeseriesMetric.apply_timeseries
     """
 
     show_in_ui  = True
@@ -72,6 +79,28 @@ class NamespaceEdits(TimeseriesMetric):
         start_date = self.start_date.data
         end_date = self.end_date.data
 
+        rollup = EditRollupService()
+        if (
+            self.include_deleted.data and
+            not self.namespaces.data and
+            self.timeseries.data != TimeseriesChoices.HOUR and
+            not self.backfill and
+            rollup.covers(session, start_date, end_date)
+        ):
+            with rollup.session() as rollup_session:
+                query = rollup.count_query(
+                    rollup_session, session, start_date, end_date,
+                    ['edits', 'archived_edits'], 'midnight_edits',
+                )
+                query = self.filter(query, user_ids, column=EditRollupStore.user_id)
+                query = self.apply_timeseries(query, column=EditRollupStore.day)
+                return self.results_by_user(
+                    user_ids,
+                    query,
+                    [(self.id, 1, 0)],
+                    date_index=2,
+                )
+
         revisions = session\
             .query(
                 label('user_id', Revision.rev_user),
@@ -3,8 +3,11 @@ from sqlalchemy.sql.expression import label
 from wtforms.validators import Required
 
 from wikimetrics.utils import thirty_days_ago, today
+from wikimetrics.enums import TimeseriesChoices
 from wikimetrics.forms.fields import CommaSeparatedIntegerListField, BetterBooleanField
 from wikimetrics.models import Page, Revision, Archive
+from wikimetrics.models.storage import EditRollupStore
+from wikimetrics.api import EditRollupService
 from timeseries_metric import TimeseriesMetric
 
 
@@ -23,6 +26,10 @@ class PagesCreated(TimeseriesMetric):
         AND rev_user = %(user)s
         AND rev_timestamp > %(start)s
         AND rev_timestamp <= %(end)s
+
+    When deleted pages are counted in all namespaces, the creations of projects
+    with an edit rollup are counted from it, see EditRollupService, except in
+    backfill mode, see TimeseriesMetric.apply_timeseries
     """
     
     show_in_ui  = True
@@ -59,6 +66,28 @@ class PagesCreated(TimeseriesMetric):
         start_date = self.start_date.data
         end_date = self.end_date.data
         
+        rollup = EditRollupService()
+        if (
+            self.include_deleted.data and
+            not self.namespaces.data and
+            self.timeseries.data != TimeseriesChoices.HOUR and
+            not self.backfill and
+            rollup.covers(session, start_date, end_date)
+        ):
+            with rollup.session() as rollup_session:
+                query = rollup.count_query(
+                    rollup_session, session, start_date, end_date,
+                    ['creations', 'archived_creations'], 'midnight_creations',
+                )
+                query = self.filter(query, user_ids, column=EditRollupStore.user_id)
+                query = self.apply_timeseries(query, column=EditRollupStore.day)
+                return self.results_by_user(
+                    user_ids,
+                    query,
+                    [(self.id, 1, 0)],
+                    date_index=2,
+                )
+        
         revisions = session\
             .query(
                 label('user_id', Revision.rev_user),
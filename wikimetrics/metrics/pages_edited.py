@@ -69,6 +69,10 @@ class PagesEdited(Metric):
                     ' rolled up to one number.',
     )
 
+    def supports_chunking(self):
+        # deduplicating across users rolls the whole cohort up to one number
+        return not self.deduplicate_across_users.data
+
     def __call__(self, user_ids, session):
         """
         Parameters:
@@ -1,14 +1,17 @@
+from collections import OrderedDict
 from sqlalchemy import func
-from sqlalchemy.sql.expression import label, between
+from sqlalchemy.sql.expression import label, between, case
 from datetime import timedelta
 from wtforms.validators import Required
-from wtforms import IntegerField
+from wtforms import IntegerField, SelectField, ValidationError
 
+from wikimetrics.enums import TimeseriesChoices
 from wikimetrics.forms.fields import BetterDateTimeField
-from wikimetrics.utils import today
+from wikimetrics.utils import today, thirty_days_ago, strip_time, format_pretty_date
 from wikimetrics.models.mediawiki import (
     Revision, MediawikiUser, Archive, MediawikiUserGroups
 )
+from wikimetrics.api import EditRollupService
 from metric import Metric
 
 
@@ -51,6 +54,15 @@ class RollingActiveEditor(Metric):
      SELECT ug_user
        FROM user_groups
       WHERE ug_group = 'bot'
+
+    NOTE: the edits of projects with an edit rollup are counted from it when the
+          end date is at midnight, see EditRollupService
+
+    NOTE: with a daily timeseries, the result for each day from the start date to
+          the end date is the result as of the midnight that ends it, which is
+          what a recurrent run on the next day computes.  The daily edits of each
+          user are fetched once for all the days, and the rolling window is slid
+          over them, see active_by_day.
     """
 
     show_in_ui  = True
@@ -68,11 +80,35 @@ class RollingActiveEditor(Metric):
 
     number_of_edits = IntegerField(default=5)
     rolling_days    = IntegerField(default=30)
+    start_date      = BetterDateTimeField(
+        default=thirty_days_ago,
+        description='The first day of the timeseries, not used without one'
+    )
     end_date        = BetterDateTimeField(
         label='As Of Date',
         default=today,
         description='Editors making Number Of Edits within Rolling Days of this date'
     )
+    timeseries      = SelectField(
+        'Time Series by',
+        default=TimeseriesChoices.NONE,
+        choices=[
+            (TimeseriesChoices.NONE, TimeseriesChoices.NONE),
+            (TimeseriesChoices.DAY, TimeseriesChoices.DAY),
+        ],
+        description='Report results as of the end of each day from Start Date',
+    )
+
+    def validate_start_date(self, field):
+        if self.timeseries.data == TimeseriesChoices.NONE:
+            return
+        if field.data and self.end_date.data and field.data > self.end_date.data:
+            raise ValidationError(
+                'Please make sure Start Date is not greater than As Of Date.'
+            )
+
+    def supports_backfill(self):
+        return True
 
     def __call__(self, user_ids, session):
         """
@@ -81,13 +117,24 @@ class RollingActiveEditor(Metric):
             session     : sqlalchemy session open on a mediawiki database
 
         Returns:
-            dictionary from user ids to: 1 if they're a rolling active editor, 0 if not
+            dictionary from user ids to: 1 if they're a rolling active editor, 0 if not,
+            or to a dictionary from each day to that if this is a timeseries
         """
+        if self.timeseries.data != TimeseriesChoices.NONE:
+            return self.timeseries_results(user_ids, session)
+
         number_of_edits = int(self.number_of_edits.data)
         rolling_days = int(self.rolling_days.data)
         end_date = self.end_date.data
         start_date = end_date - timedelta(days=rolling_days)
 
+        rollup = EditRollupService()
+        if rollup.covers(session, start_date, end_date):
+            active = rollup.active_editors(
+                self, session, user_ids, start_date, end_date, number_of_edits
+            )
+            return self.active_results(user_ids, active)
+
         rev_user = label('user_id', Revision.rev_user)
         ar_user = label('user_id', Archive.ar_user)
         count = label('count', func.count())
@@ -112,7 +159,15 @@ class RollingActiveEditor(Metric):
             .group_by(edits.c.user_id)\
             .having(func.SUM(edits.c.count) >= number_of_edits)
 
-        metric_results = {r[0]: {self.id : 1} for r in edits_by_user.all()}
+        return self.active_results(user_ids, [r[0] for r in edits_by_user.all()])
+
+    def active_results(self, user_ids, active):
+        """
+        Parameters:
+            user_ids    : list of mediawiki user ids to restrict computation to
+            active      : ids of the users that are rolling active editors
+        """
+        metric_results = {user_id: {self.id : 1} for user_id in active}
 
         if user_ids is None:
             return metric_results
@@ -121,3 +176,130 @@ class RollingActiveEditor(Metric):
                 uid: metric_results.get(uid, self.default_result)
                 for uid in user_ids
             }
+
+    def timeseries_results(self, user_ids, session):
+        """
+        Same as __call__, for each day from the start date to the end date
+        """
+        number_of_edits = int(self.number_of_edits.data)
+        rolling_days = int(self.rolling_days.data)
+        days = []
+        day = strip_time(self.start_date.data)
+        while day < self.end_date.data:
+            days.append(day)
+            day += timedelta(days=1)
+        if not days:
+            return {} if user_ids is None else {uid: {self.id: {}} for uid in user_ids}
+
+        # the windows of all the days, the last one includes the midnight ending it
+        start_date = days[0] + timedelta(days=1 - rolling_days)
+        end_date = days[-1] + timedelta(days=1)
+
+        rollup = EditRollupService()
+        if rollup.covers(session, start_date, end_date):
+            edits = rollup.daily_edits(self, session, user_ids, start_date, end_date)
+        else:
+            edits = self.daily_edits(user_ids, session, start_date, end_date)
+
+        keys = map(format_pretty_date, days)
+        # like TimeseriesMetric, the first slice is keyed by the start date
+        keys[0] = format_pretty_date(self.start_date.data)
+        metric_results = {}
+        for user_id, by_day in edits.iteritems():
+            active = self.active_by_day(by_day, days, rolling_days, number_of_edits)
+            if any(active):
+                metric_results[user_id] = {self.id: OrderedDict(zip(keys, active))}
+
+        if user_ids is None:
+            return metric_results
+        return {
+            uid: metric_results.get(uid, {self.id: OrderedDict.fromkeys(keys, 0)})
+            for uid in user_ids
+        }
+
+    def daily_edits(self, user_ids, session, start_date, end_date):
+        """
+        Parameters:
+            user_ids    : list of mediawiki user ids to restrict computation to
+            session     : sqlalchemy session open on a mediawiki database
+            start_date  : the start of the first day to count, at midnight
+            end_date    : the midnight after the last day to count, included
+
+        Returns:
+            a dictionary from the ids of the users that are not bots to a
+            dictionary from each day they edited on to a tuple of their edits,
+            deleted or not, and the edits made right at the midnight starting it
+        """
+        rev_user = label('user_id', Revision.rev_user)
+        rev_day = label('day', func.date(Revision.rev_timestamp))
+        ar_user = label('user_id', Archive.ar_user)
+        ar_day = label('day', func.date(Archive.ar_timestamp))
+        count = label('count', func.count())
+
+        def at_midnight(column):
+            midnight = case([(column.like('%000000'), 1)], else_=0)
+            return label('midnight', func.sum(midnight))
+
+        revisions = session.query(
+            rev_user, rev_day, count, at_midnight(Revision.rev_timestamp)
+        )\
+            .filter(between(Revision.rev_timestamp, start_date, end_date))\
+            .group_by(Revision.rev_user, rev_day)
+        revisions = self.filter(revisions, user_ids, column=Revision.rev_user)
+
+        archived = session.query(
+            ar_user, ar_day, count, at_midnight(Archive.ar_timestamp)
+        )\
+            .filter(between(Archive.ar_timestamp, start_date, end_date))\
+            .group_by(Archive.ar_user, ar_day)
+        archived = self.filter(archived, user_ids, column=Archive.ar_user)
+
+        bot_user_ids = session.query(MediawikiUserGroups.ug_user)\
+            .filter(MediawikiUserGroups.ug_group == 'bot')\
+            .subquery()
+
+        edits = revisions.union_all(archived).subquery()
+        edits_by_day = session.query(
+            edits.c.user_id,
+            edits.c.day,
+            func.SUM(edits.c.count),
+            func.SUM(edits.c.midnight),
+        )\
+            .filter(edits.c.user_id.notin_(bot_user_ids))\
+            .group_by(edits.c.user_id, edits.c.day)
+
+        results = {}
+        for user_id, day, count, midnight in edits_by_day.all():
+            results.setdefault(user_id, {})[day] = (int(count), int(midnight or 0))
+        return results
+
+    def active_by_day(self, edits, days, rolling_days, number_of_edits):
+        """
+        Slides the rolling window over one user's daily edits, in one pass
+
+        Parameters:
+            edits           : dictionary from day to a tuple of the edits made
+                              that day and the edits made right at its midnight
+            days            : the consecutive days to report on, at midnight
+            rolling_days    : the length of the window, in days
+            number_of_edits : the edits in the window that make the user active
+
+        Returns:
+            a list with, for each of days, 1 if the user was active as of the
+            midnight ending it, 0 if not.  That window counts the days from
+            rolling_days before that midnight included, and the edits made at it
+        """
+        def edits_on(day, index=0):
+            return edits.get(day.date(), (0, 0))[index]
+
+        window = 0
+        day = days[0] - timedelta(days=rolling_days)
+        active = []
+        while day <= days[-1]:
+            window += edits_on(day)
+            window -= edits_on(day - timedelta(days=rolling_days))
+            if day >= days[0]:
+                at_midnight = edits_on(day + timedelta(days=1), index=1)
+                active.append(int(window + at_midnight >= number_of_edits))
+            day += timedelta(days=1)
+        return active
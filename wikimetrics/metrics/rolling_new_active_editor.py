@@ -6,6 +6,7 @@ from wtforms import IntegerField
 from wikimetrics.forms.fields import BetterDateTimeField
 from wikimetrics.utils import today
 from wikimetrics.models.mediawiki import Revision, Archive, Logging, MediawikiUserGroups
+from wikimetrics.api import EditRollupService
 from metric import Metric
 
 
@@ -57,6 +58,9 @@ class RollingNewActiveEditor(Metric):
      SELECT ug_user
        FROM user_groups
       WHERE ug_group = 'bot'
+
+    NOTE: the edits of projects with an edit rollup are counted from it when the
+          end date is at midnight, see EditRollupService
     """
 
     show_in_ui  = True
@@ -103,7 +107,27 @@ class RollingNewActiveEditor(Metric):
             .filter(Logging.log_action == 'create') \
             .filter(between(Logging.log_timestamp, start_date, end_date))
 
-        filtered_new = self.filter(
+        rollup = EditRollupService()
+        if rollup.covers(session, start_date, end_date):
+            new_user_ids = [
+                row[0] for row in
+                self.filter(newly_registered, user_ids, column=Logging.log_user).all()
+            ]
+            active = []
+            if new_user_ids:
+                active = rollup.active_editors(
+                    self, session, new_user_ids, start_date, end_date, number_of_edits
+                )
+            return self.active_results(user_ids, active)
+
+        # subqueries to select only the users registered between start and end date
+        # NOTE: each half of the union below needs its own subquery, because
+        # self.filter may use a temporary table, and MySQL can only reference
+        # a temporary table once per query
+        filtered_new_revisions = self.filter(
+            newly_registered, user_ids, column=Logging.log_user
+        ).subquery()
+        filtered_new_archived = self.filter(
             newly_registered, user_ids, column=Logging.log_user
         ).subquery()
 
@@ -113,12 +137,12 @@ class RollingNewActiveEditor(Metric):
 
         revisions = session.query(rev_user, count)\
             .filter(between(Revision.rev_timestamp, start_date, end_date))\
-            .filter(Revision.rev_user.in_(filtered_new))\
+            .filter(Revision.rev_user.in_(filtered_new_revisions))\
             .group_by(Revision.rev_user)
 
         archived = session.query(ar_user, count)\
             .filter(between(Archive.ar_timestamp, start_date, end_date))\
-            .filter(Archive.ar_user.in_(filtered_new))\
+            .filter(Archive.ar_user.in_(filtered_new_archived))\
             .group_by(Archive.ar_user)
 
         bot_user_ids = session.query(MediawikiUserGroups.ug_user)\
@@ -131,7 +155,15 @@ class RollingNewActiveEditor(Metric):
             .group_by(new_edits.c.user_id)\
             .having(func.SUM(new_edits.c.count) >= number_of_edits)
 
-        metric_results = {r[0]: {self.id : 1} for r in new_edits_by_user.all()}
+        return self.active_results(user_ids, [r[0] for r in new_edits_by_user.all()])
+
+    def active_results(self, user_ids, active):
+        """
+        Parameters:
+            user_ids    : list of mediawiki user ids to restrict computation to
+            active      : ids of the users that are rolling new active editors
+        """
+        metric_results = {user_id: {self.id : 1} for user_id in active}
 
         if user_ids is None:
             return metric_results
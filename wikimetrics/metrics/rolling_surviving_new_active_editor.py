@@ -109,8 +109,14 @@ SET @T = <<end date passed in, or each date between start and end if timeseries>
             .filter(Logging.log_action == 'create') \
             .filter(between(Logging.log_timestamp, start_date, mid_date))
 
-        # subquery to select only the users registered between start and mid date
-        filtered_new = self.filter(
+        # subqueries to select only the users registered between start and mid date
+        # NOTE: each half of the union below needs its own subquery, because
+        # self.filter may use a temporary table, and MySQL can only reference
+        # a temporary table once per query
+        filtered_new_revisions = self.filter(
+            newly_registered, user_ids, column=Logging.log_user
+        ).subquery()
+        filtered_new_archived = self.filter(
             newly_registered, user_ids, column=Logging.log_user
         ).subquery()
 
@@ -128,13 +134,13 @@ SET @T = <<end date passed in, or each date between start and end if timeseries>
         # get both counts by user for Revision
         revisions = session.query(rev_user, rev_count_one, rev_count_two)\
             .filter(between(Revision.rev_timestamp, start_date, end_date))\
-            .filter(Revision.rev_user.in_(filtered_new))\
+            .filter(Revision.rev_user.in_(filtered_new_revisions))\
             .group_by(Revision.rev_user)
 
         # get both counts by user for Archive
         archived = session.query(ar_user, ar_count_one, ar_count_two)\
             .filter(between(Archive.ar_timestamp, start_date, end_date))\
-            .filter(Archive.ar_user.in_(filtered_new))\
+            .filter(Archive.ar_user.in_(filtered_new_archived))\
             .group_by(Archive.ar_user)
 
         bot_user_ids = session.query(MediawikiUserGroups.ug_user)\
@@ -1,7 +1,7 @@
 import datetime
 import calendar
+from itertools import groupby
 from sqlalchemy import func, case, Integer
-from sqlalchemy.orm import aliased
 from sqlalchemy.sql.expression import label, between, and_, or_
 from wtforms.validators import Required
 from wtforms import BooleanField, IntegerField
@@ -49,6 +49,11 @@ class Threshold(Metric):
         user            on user.user_id = ordered_revisions.rev_user
                         and ordered_revisions.number = <number_of_edits>
   WHERE user_id IN (<cohort>)
+    
+    NOTE: the self join is quadratic in the edits of each user, so the revisions
+          are now read once, ordered by user and timestamp, and the number of
+          each revision is counted as they stream by, see time_to_threshold.
+          The results are the same as the ones of the query above.
     """
     
     show_in_ui              = True
@@ -95,72 +100,112 @@ class Threshold(Metric):
         threshold_secs  = threshold_hours * 3600
         number_of_edits = int(self.number_of_edits.data)
         
-        Revision2 = aliased(Revision, name='r2')
-        ordered_revisions = session \
+        registration = func.unix_timestamp(MediawikiUser.user_registration)
+        revisions = session \
             .query(
                 Revision.rev_user,
                 Revision.rev_timestamp,
-                label('number', func.count()),
+                label('in_namespaces', Page.page_namespace.in_(self.namespaces.data)),
+                label(
+                    Threshold.time_to_threshold_id,
+                    (func.unix_timestamp(Revision.rev_timestamp) - registration) / 3600
+                ),
             ) \
             .join(MediawikiUser) \
-            .join(Page) \
-            .join(
-                Revision2,
-                and_(
-                    Revision.rev_user == Revision2.rev_user,
-                    Revision.rev_timestamp >= Revision2.rev_timestamp
-                )
-            ) \
-            .group_by(Revision.rev_user) \
-            .group_by(Revision.rev_timestamp) \
-            .filter(Page.page_namespace.in_(self.namespaces.data)) \
+            .outerjoin(Page) \
             .filter(
-                func.unix_timestamp(Revision.rev_timestamp) -
-                func.unix_timestamp(MediawikiUser.user_registration) <= threshold_secs
-            )
-        
-        o_r = self.filter(ordered_revisions, user_ids).subquery()
+                func.unix_timestamp(Revision.rev_timestamp) - registration
+                <= threshold_secs
+            ) \
+            .order_by(Revision.rev_user, Revision.rev_timestamp)
+        revisions = self.filter(revisions, user_ids)
+        reached = self.time_to_threshold(self.stream(revisions), number_of_edits)
         
-        metric = session.query(
+        users = session.query(
             MediawikiUser.user_id,
-            label(
-                Threshold.id,
-                func.IF(o_r.c.rev_timestamp != None, 1, 0)
-            ),
-            label(
-                Threshold.time_to_threshold_id,
-                func.IF(
-                    o_r.c.rev_timestamp != None,
-                    (func.unix_timestamp(o_r.c.rev_timestamp) -
-                        func.unix_timestamp(MediawikiUser.user_registration)) / 3600,
-                    None
-                )
-            ),
             label(CENSORED, func.IF(
-                o_r.c.rev_timestamp != None,
-                0,
-                func.IF(
-                    func.unix_timestamp(MediawikiUser.user_registration) + threshold_secs
-                    >
-                    func.unix_timestamp(func.now()),
-                    1,
-                    0
-                )
+                registration + threshold_secs > func.unix_timestamp(func.now()), 1, 0
             ))
-        ) \
-            .outerjoin(
-                o_r,
-                and_(
-                    MediawikiUser.user_id == o_r.c.rev_user,
-                    o_r.c.number == number_of_edits))
-
-        metric = self.filter(metric, user_ids, MediawikiUser.user_id)
+        )
+        users = self.filter(users, user_ids, MediawikiUser.user_id)
         
         return {
             u.user_id: {
-                Threshold.id                    : u.threshold,
-                Threshold.time_to_threshold_id  : u.time_to_threshold,
+                Threshold.id                    : 1,
+                Threshold.time_to_threshold_id  : reached[u.user_id],
+                CENSORED                        : 0,
+            } if u.user_id in reached else {
+                Threshold.id                    : 0,
+                Threshold.time_to_threshold_id  : None,
                 CENSORED                        : u.censored,
             }
-            for u in metric.all()
+            for u in users.all()
         }
+    
+    def stream(self, query):
+        """
+        Reads the rows of a query from a server side cursor, so the revisions of
+        a big cohort are not all held in memory at once.  MySQLdb's default
+        cursor fetches every row as soon as the query runs, whatever the
+        execution options of the query.
+        
+        Parameters:
+            query   : a sqlalchemy query on a mediawiki database
+        
+        Returns:
+            a generator of the rows of the query, as tuples.  They have to be
+            read to the end before the session runs another query.
+        """
+        from MySQLdb.cursors import SSCursor
+        
+        connection = query.session.connection()
+        compiled = query.statement.compile(dialect=connection.dialect)
+        parameters = compiled.construct_params()
+        processors = compiled._bind_processors
+        for name, process in processors.items():
+            parameters[name] = process(parameters[name])
+        
+        cursor = connection.connection.cursor(SSCursor)
+        try:
+            cursor.execute(
+                unicode(compiled),
+                tuple(parameters[name] for name in compiled.positiontup),
+            )
+            for row in cursor:
+                yield row
+        finally:
+            cursor.close()
+    
+    def time_to_threshold(self, revisions, number_of_edits):
+        """
+        Finds the revision that each user reached the threshold with, in one pass
+        
+        Parameters:
+            revisions       : rows of (user id, timestamp, whether the revision is
+                              in one of the namespaces, hours since registration)
+                              for each revision up to the end of the threshold
+                              window, ordered by user id and timestamp
+            number_of_edits : the number of edits that reaches the threshold
+        
+        Returns:
+            dictionary from the ids of the users that reached the threshold to
+            the hours it took them
+        """
+        reached = {}
+        by_timestamp = groupby(revisions, key=lambda r: (r[0], r[1]))
+        user_id = None
+        for (rev_user, rev_timestamp), same_time in by_timestamp:
+            if rev_user != user_id:
+                user_id = rev_user
+                edits = 0
+            same_time = list(same_time)
+            # edits in any namespace count towards the number of the revision
+            edits += len(same_time)
+            if user_id in reached:
+                continue
+            # revisions made at the same time share their number, multiplied by
+            # how many of them are in the namespaces, like the original self join
+            in_namespaces = sum(1 for r in same_time if r[2])
+            if in_namespaces and in_namespaces * edits == number_of_edits:
+                reached[user_id] = same_time[0][3]
+        return reached
@@ -1,5 +1,5 @@
 from collections import OrderedDict
-from sqlalchemy import func
+from sqlalchemy import func, text
 from datetime import datetime
 from dateutil.relativedelta import relativedelta
 from wtforms import SelectField
@@ -35,6 +35,18 @@ class TimeseriesMetric(Metric):
         description='Report results by year, month, day, or hour',
     )
     
+    # set by BackfillReport, see apply_timeseries
+    backfill = False
+    
+    def supports_backfill(self):
+        """
+        A run for one day counts what happened after its start date, up to and
+        including its end date.  In backfill mode, daily slices hold the same
+        range, see apply_timeseries.  Hourly slices can not, so hourly reports
+        are not backfilled.
+        """
+        return self.timeseries.data != TimeseriesChoices.HOUR
+    
     def apply_timeseries(self, query, column=Revision.rev_timestamp):
         """
         Take a query and slice it up into equal time intervals
@@ -52,6 +64,11 @@ class TimeseriesMetric(Metric):
         if choice == TimeseriesChoices.NONE:
             return query
         
+        if self.backfill:
+            # a run for one day counts from after midnight up to and including
+            # the next midnight, so slice (midnight, next midnight] instead
+            column = func.date_sub(column, text('INTERVAL 1 SECOND'))
+        
         query = query.add_column(func.year(column))
         query = query.group_by(func.year(column))
         
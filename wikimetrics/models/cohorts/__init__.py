@@ -3,6 +3,7 @@ from validated_cohort import *
 from fixed_cohort import *
 from centralauth_cohort import *
 from wiki_cohort import *
+from cohort_snapshot import *
 
 # ignore flake8 because of F403 violation
 # flake8: noqa
@@ -42,3 +42,5 @@ class Cohort(object):
     enabled             = CohortProperty()
     public              = CohortProperty()
     has_validation_info = False
+    # the CohortSnapshot of the members, if it was loaded with the cohort
+    snapshot            = None
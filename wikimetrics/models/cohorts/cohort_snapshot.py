@@ -0,0 +1,131 @@
+import sys
+import numpy
+from wikimetrics.models.storage.wikiuser import WikiUserKey
+
+
+__all__ = ['CohortSnapshot']
+
+
+class CohortSnapshot(object):
+    """
+    The members of a cohort, as they were when a report was created.  It is loaded
+    with a single query (see CohortService.get_snapshot) and then passed down the
+    report tree with the logical cohort, so the size of the cohort, its users by
+    project, and their names all come from the same read of the database.
+
+    Members are kept sorted by project, in compact arrays:
+        projects        : tuple of the distinct projects
+        project_index   : for each member, the index of its project in projects
+        user_ids        : for each member, its mediawiki user id
+        usernames       : for each member, its mediawiki user name
+
+    A snapshot is immutable.  It records the version of the cohort it was read
+    from (CohortStore.membership_version), which is bumped when the cohort is
+    validated or members are deleted, so a stale snapshot can be detected with
+    is_current, and snapshots can be cached by (cohort_id, version).
+    """
+
+    def __init__(self, cohort_id, default_project, version, members):
+        """
+        Parameters
+            cohort_id       : the id of the cohort
+            default_project : the project to use for cohorts with no members
+            version         : CohortStore.membership_version when members were read
+            members         : list of (project, user_id, username), sorted by project
+        """
+        self.cohort_id = cohort_id
+        self.default_project = default_project
+        self.version = version
+
+        projects = []
+        project_index = numpy.empty(len(members), dtype=numpy.int32)
+        user_ids = numpy.empty(len(members), dtype=numpy.int64)
+        usernames = []
+        for i, (project, user_id, username) in enumerate(members):
+            if not projects or projects[-1] != project:
+                projects.append(project)
+            project_index[i] = len(projects) - 1
+            user_ids[i] = user_id
+            usernames.append(username)
+
+        self.projects = tuple(projects)
+        self.project_index = project_index
+        self.user_ids = user_ids
+        self.usernames = tuple(usernames)
+        self.freeze()
+
+    def freeze(self):
+        self.project_index.flags.writeable = False
+        self.user_ids.flags.writeable = False
+
+    def __setstate__(self, state):
+        # numpy arrays come back writeable from a pickle
+        self.__dict__.update(state)
+        self.freeze()
+
+    def __len__(self):
+        return len(self.user_ids)
+
+    def memory_size(self):
+        """
+        Returns
+            an estimate of the memory used by this snapshot, in bytes
+        """
+        return (
+            self.user_ids.nbytes + self.project_index.nbytes +
+            sys.getsizeof(self.usernames) +
+            sum(sys.getsizeof(username) for username in self.usernames) +
+            sum(sys.getsizeof(project) for project in self.projects)
+        )
+
+    def __repr__(self):
+        return '<CohortSnapshot("{0}", {1} users)>'.format(self.cohort_id, len(self))
+
+    def is_current(self, cohort):
+        """
+        Parameters
+            cohort  : the CohortStore this snapshot was read from
+
+        Returns
+            True if the cohort's membership has not changed since the snapshot
+        """
+        return (
+            cohort.id == self.cohort_id and
+            cohort.membership_version == self.version
+        )
+
+    def group_by_project(self):
+        """
+        Same as CohortStore.group_by_project, but from the snapshot
+
+        Returns:
+            list of tuples of the form:
+                (project, <iterable_of_user_ids>)
+        """
+        if not len(self):
+            return [(self.default_project, None)]
+
+        boundaries = numpy.flatnonzero(numpy.diff(self.project_index)) + 1
+        starts = [0] + boundaries.tolist()
+        ends = boundaries.tolist() + [len(self)]
+        return [
+            (
+                self.projects[self.project_index[start]] or self.default_project,
+                iter(self.user_ids[start:end].tolist())
+            )
+            for start, end in zip(starts, ends)
+        ]
+
+    def usernames_by_key(self):
+        """
+        Same as CohortService.get_wikiusernames_for_cohort, but from the snapshot
+
+        Returns
+            Dictionary of user names keyed by WikiUserKey
+        """
+        return {
+            WikiUserKey(user_id, self.projects[index], self.cohort_id): username
+            for user_id, index, username in zip(
+                self.user_ids.tolist(), self.project_index.tolist(), self.usernames
+            )
+        }
@@ -6,6 +6,7 @@ from user import *
 from user_groups import *
 from logging import *
 from archive import *
+from cohort_table import *
 
 # ignore flake8 because of F403 violation
 # flake8: noqa
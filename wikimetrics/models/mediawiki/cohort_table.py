@@ -0,0 +1,65 @@
+from uuid import uuid4
+from sqlalchemy import Table, Column, Integer, MetaData
+
+from wikimetrics.utils import chunk
+
+__all__ = [
+    'create_cohort_table',
+    'drop_cohort_tables',
+]
+
+
+# key in the pooled connection's info dictionary listing its cohort tables
+COHORT_TABLES = 'wikimetrics_cohort_tables'
+# rows sent to the database with each insert
+INSERT_BATCH_SIZE = 10000
+
+
+def create_cohort_table(session, user_ids):
+    """
+    Materializes a list of user ids into a new temporary table on the connection
+    used by session.  Metric queries can then be filtered by selecting from this
+    table instead of sending a huge IN() list to the database.
+
+    NOTE: MySQL does not allow referencing the same temporary table more than once
+    in a query, so each use needs its own table.  Temporary tables live as long as
+    the connection they were created on, so they are remembered on that connection
+    and removed with `drop_cohort_tables`.
+
+    Parameters
+        session     : sqlalchemy session open on a mediawiki database
+        user_ids    : list of mediawiki user ids
+
+    Returns
+        the sqlalchemy Table, with one integer column: user_id
+    """
+    connection = session.connection()
+    table = Table(
+        'wikimetrics_cohort_{0}'.format(uuid4().hex),
+        MetaData(),
+        Column('user_id', Integer, primary_key=True, autoincrement=False),
+        prefixes=['TEMPORARY'],
+    )
+    table.create(connection)
+    connection.info.setdefault(COHORT_TABLES, []).append(table.name)
+
+    for user_id_chunk in chunk(sorted(set(user_ids)), INSERT_BATCH_SIZE):
+        connection.execute(
+            table.insert(),
+            [{'user_id': user_id} for user_id in user_id_chunk]
+        )
+    return table
+
+
+def drop_cohort_tables(session):
+    """
+    Drops the temporary tables created by `create_cohort_table` on the connection
+    used by session.  This is important when connections are pooled, since the
+    temporary tables would otherwise outlive the report that created them.
+
+    Parameters
+        session     : sqlalchemy session open on a mediawiki database
+    """
+    connection = session.connection()
+    for name in connection.info.pop(COHORT_TABLES, []):
+        connection.execute('DROP TEMPORARY TABLE IF EXISTS `{0}`'.format(name))
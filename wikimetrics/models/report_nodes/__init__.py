@@ -4,6 +4,7 @@ from multi_project_metric_report import *
 from sum_aggregate_by_user_report import *
 from report import *
 from run_report import *
+from backfill_report import *
 from run_program_metrics_report import *
 from validate_program_metrics_report import *
 # ignore flake8 because of F403 violation
@@ -1,6 +1,7 @@
 from math import sqrt
 from decimal import Decimal
 from collections import OrderedDict
+import numpy
 from celery.utils.log import get_task_logger
 
 from wikimetrics.utils import stringify, CENSORED, NO_RESULTS, r
@@ -23,6 +24,10 @@ class AggregateReport(ReportNode):
         * the standard deviation over the individual results
     
     Whether or not to return these is controlled by parameters passed to the constructor.
+    
+    The aggregates are accumulated as the results for each project come in, so
+    aggregation overlaps with running the metric on the other projects, and the
+    individual results are only merged if they are requested.
     """
     
     show_in_ui = False
@@ -49,33 +54,40 @@ class AggregateReport(ReportNode):
         self.aggregate_average = options.get('aggregateAverage', False)
         self.aggregate_std_deviation = options.get('aggregateStandardDeviation', False)
         
-        self.children = [MultiProjectMetricReport(cohort, metric, *args, **kwargs)]
+        self.accumulator = None
+        child = MultiProjectMetricReport(cohort, metric, *args, **kwargs)
+        child.merge_results = self.individual
+        self.children = [child]
+    
+    def run_children(self):
+        # a new accumulator for each run, so running again does not count twice
+        self.accumulator = ResultAccumulator()
+        for child in self.children:
+            child.result_accumulator = self.accumulator
+        return super(AggregateReport, self).run_children()
     
     def finish(self, child_results):
         aggregated_results = dict()
         results_by_user = child_results[0]
         
         if self.aggregate:
+            types_of_aggregate = []
             if self.aggregate_sum:
-                aggregated_results[Aggregation.SUM] = self.calculate(
-                    results_by_user,
-                    Aggregation.SUM
-                )
+                types_of_aggregate.append(Aggregation.SUM)
             if self.aggregate_average:
-                aggregated_results[Aggregation.AVG] = self.calculate(
-                    results_by_user,
-                    Aggregation.AVG
-                )
+                types_of_aggregate.append(Aggregation.AVG)
             if self.aggregate_std_deviation:
-                if Aggregation.AVG not in aggregated_results:
-                    average = self.calculate(results_by_user, Aggregation.AVG)
+                types_of_aggregate.append(Aggregation.STD)
+            if types_of_aggregate:
+                if self.accumulator is None or self.accumulator.empty():
+                    # the results did not stream in through the child report
+                    aggregated_results.update(
+                        self.calculate_all(results_by_user, types_of_aggregate)
+                    )
                 else:
-                    average = aggregated_results[Aggregation.AVG]
-                aggregated_results[Aggregation.STD] = self.calculate(
-                    results_by_user,
-                    Aggregation.STD,
-                    average=average
-                )
+                    aggregated_results.update(
+                        self.accumulator.aggregate(types_of_aggregate)
+                    )
         
         if self.individual:
             if NO_RESULTS in results_by_user:
@@ -84,102 +96,334 @@ class AggregateReport(ReportNode):
         
         return aggregated_results
     
-    def calculate(self, results_by_user, type_of_aggregate, average=None):
-        # TODO: terrible redo this
+    def calculate(self, results_by_user, type_of_aggregate):
+        """
+        Calculates one type of aggregate, see calculate_all
+        """
+        return self.calculate_all(results_by_user, [type_of_aggregate])[type_of_aggregate]
+    
+    def calculate_all(self, results_by_user, types_of_aggregate):
         """
-        Calculates one type of aggregate by just iterating over the individual results
+        Calculates the requested aggregates in one pass over the individual results.
         Takes into account that results and aggregates may be split up by timeseries
         Also makes sure to ignore censored records when appropriate
         
         Parameters
-            list_of_results     : list of individual results
-            type_of_aggregate   : can be SUM, AVG, STD
-            average             : None by default but required when computing STD
+            results_by_user     : dictionary of individual results
+            types_of_aggregate  : list of aggregates to compute: SUM, AVG, STD
         
         Returns
-            The aggregate specified, computed at the timeseries level if applicable
-        """
-        aggregation = dict()
-        helper = dict()
-        for user_id in results_by_user.keys():
-            for key in results_by_user[user_id]:
-                # the CENSORED key indicates that this user has censored
-                # results for this metric.  It is not aggregate-able
+            A dictionary from each type of aggregate to the aggregate computed
+            for each submetric, at the timeseries level if applicable
+        """
+        accumulator = ResultAccumulator()
+        accumulator.add(results_by_user)
+        return accumulator.aggregate(types_of_aggregate)
+
+
+class ResultAccumulator(object):
+    """
+    Accumulates running statistics for each submetric (and timeseries slice) of
+    individual results, fed one dictionary of results at a time.  The order in
+    which results are fed does not matter: the aggregates are rounded far above
+    the precision of the floats they come from.
+    
+    NOTE: this is not thread safe, callers feeding it from several threads
+    should hold a lock (see MultiProjectMetricReport.run_children)
+    """
+    
+    def __init__(self):
+        self.submetrics = OrderedDict()
+        self.seen_no_results = False
+    
+    def empty(self):
+        return not self.submetrics and not self.seen_no_results
+    
+    def add(self, results_by_user):
+        """
+        Parameters
+            results_by_user : dictionary of individual results
+        """
+        tables = OrderedDict()
+        for user_id, result in results_by_user.iteritems():
+            if user_id == NO_RESULTS:
+                # merged results only keep one of these, so only count one
+                if self.seen_no_results:
+                    continue
+                self.seen_no_results = True
+            # the CENSORED key indicates that this user has censored
+            # results for this metric.  It is not aggregate-able
+            censored = result.get(CENSORED) == 1
+            for key, value in result.iteritems():
                 if key == CENSORED:
                     continue
-                
-                value = results_by_user[user_id][key]
-                value_is_not_censored = CENSORED not in results_by_user[user_id]\
-                    or results_by_user[user_id][CENSORED] != 1
-                
-                # handle timeseries aggregation
-                if isinstance(value, dict):
-                    if key not in aggregation:
-                        aggregation[key] = OrderedDict()
-                        helper[key] = dict()
-                    
-                    for subkey in value:
-                        if subkey not in aggregation[key]:
-                            aggregation[key][subkey] = 0
-                            helper[key][subkey] = dict()
-                            helper[key][subkey]['sum'] = Decimal(0.0)
-                            helper[key][subkey]['square_diffs'] = Decimal(0.0)
-                            helper[key][subkey]['count'] = 0
-                        
-                        if value_is_not_censored and not value[subkey] is None:
-                            helper[key][subkey]['sum'] += Decimal(value[subkey])
-                            helper[key][subkey]['count'] += 1
-                            if type_of_aggregate == Aggregation.STD:
-                                diff = Decimal(value[subkey]) - average[key][subkey]
-                                helper[key][subkey]['square_diffs'] += Decimal(
-                                    pow(diff, 2)
-                                )
-                        
-                        if type_of_aggregate == Aggregation.SUM:
-                            aggregation[key][subkey] = r(helper[key][subkey]['sum'])
-                        elif type_of_aggregate == Aggregation.AVG:
-                            aggregation[key][subkey] = r(safe_average(
-                                helper[key][subkey]['sum'],
-                                helper[key][subkey]['count']
-                            ))
-                        elif type_of_aggregate == Aggregation.STD:
-                            aggregation[key][subkey] = r(sqrt(safe_average(
-                                helper[key][subkey]['square_diffs'],
-                                helper[key][subkey]['count']
-                            )))
-                
-                # handle normal aggregation
-                else:
-                    if key not in aggregation:
-                        aggregation[key] = 0
-                        helper[key] = dict()
-                        helper[key]['sum'] = Decimal(0.0)
-                        helper[key]['square_diffs'] = Decimal(0.0)
-                        helper[key]['count'] = 0
-                    
-                    if value_is_not_censored and value is not None:
-                        helper[key]['sum'] += Decimal(value)
-                        helper[key]['count'] += 1
-                        if type_of_aggregate == Aggregation.STD:
-                            diff = Decimal(value) - average[key]
-                            helper[key]['square_diffs'] += Decimal(pow(diff, 2))
-                    
-                    if type_of_aggregate == Aggregation.SUM:
-                        aggregation[key] = r(helper[key]['sum'])
-                    elif type_of_aggregate == Aggregation.AVG:
-                        aggregation[key] = r(safe_average(
-                            helper[key]['sum'],
-                            helper[key]['count']
-                        ))
-                    elif type_of_aggregate == Aggregation.STD:
-                        aggregation[key] = r(sqrt(safe_average(
-                            helper[key]['square_diffs'],
-                            helper[key]['count']
-                        )))
+                if key not in tables:
+                    tables[key] = SubmetricTable(isinstance(value, dict))
+                tables[key].add(value, censored)
         
+        for key, table in tables.iteritems():
+            if key not in self.submetrics:
+                self.submetrics[key] = SubmetricStatistics(table.timeseries)
+            self.submetrics[key].add(table)
+    
+    def aggregate(self, types_of_aggregate):
+        """
+        Returns
+            A dictionary from each type of aggregate to the aggregate computed
+            for each submetric, as an OrderedDict by slice for timeseries
+        """
+        aggregation = {
+            type_of_aggregate: dict() for type_of_aggregate in types_of_aggregate
+        }
+        for key, submetric in self.submetrics.iteritems():
+            aggregates = submetric.aggregate(types_of_aggregate)
+            for type_of_aggregate, value in aggregates.items():
+                aggregation[type_of_aggregate][key] = value
         return aggregation
 
 
+class SubmetricStatistics(object):
+    """
+    Running statistics for each slice of one submetric.  Non-timeseries
+    submetrics have a single slice.
+    """
+    
+    def __init__(self, timeseries):
+        self.timeseries = timeseries
+        self.slices = OrderedDict()
+    
+    def add(self, table):
+        """
+        Merges in the statistics of a SubmetricTable
+        """
+        if table.timeseries != self.timeseries:
+            raise ValueError('Timeseries results mixed with non-timeseries results')
+        slices = table.slices if self.timeseries else [None]
+        for subkey, statistics in zip(slices, table.statistics()):
+            if subkey not in self.slices:
+                self.slices[subkey] = RunningStatistics()
+            self.slices[subkey].merge(statistics)
+    
+    def aggregate(self, types_of_aggregate):
+        """
+        Returns
+            A dictionary from each type of aggregate to its value, which is an
+            OrderedDict from slice to value for timeseries submetrics
+        """
+        aggregation = {type_of_aggregate: [] for type_of_aggregate in types_of_aggregate}
+        for statistics in self.slices.itervalues():
+            aggregates = statistics.aggregate(types_of_aggregate)
+            for type_of_aggregate in types_of_aggregate:
+                aggregation[type_of_aggregate].append(aggregates[type_of_aggregate])
+        
+        if self.timeseries:
+            return {
+                type_of_aggregate: OrderedDict(zip(self.slices, values))
+                for type_of_aggregate, values in aggregation.items()
+            }
+        return {
+            type_of_aggregate: values[0]
+            for type_of_aggregate, values in aggregation.items()
+        }
+
+
+class RunningStatistics(object):
+    """
+    Count, sum, mean, and sum of squared differences from the mean (M2) of a
+    series of values, updated one value at a time with Welford's algorithm, or
+    one block of values at a time with its parallel form (Chan et al.)
+    
+    Integers are summed exactly.  Other values are summed as floats with
+    Neumaier's compensated summation, so the sum is as close to the exact one
+    as a float can be, and comes out of r() as adding up Decimals would.
+    The mean and M2 are floats, they only feed the standard deviation.
+    """
+    
+    def __init__(self, count=0, total=0, mean=0.0, m2=0.0):
+        self.count = count
+        self.total = total
+        self.float_total = 0.0
+        self.compensation = 0.0
+        self.mean = float(mean)
+        self.m2 = float(m2)
+    
+    @classmethod
+    def from_sums(cls, count, total, total_of_squares):
+        """
+        Creates statistics from the integer count, sum, and sum of squares of a block
+        """
+        if not count:
+            return cls()
+        # the numerator is exact, only the division is rounded
+        m2 = float(total_of_squares * count - total * total) / count
+        return cls(count, total, float(total) / count, m2)
+    
+    def add(self, value):
+        if isinstance(value, (int, long)):
+            self.total += value
+        else:
+            value = float(value)
+            self.add_float(value)
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+    
+    def add_float(self, value):
+        total = self.float_total + value
+        if abs(self.float_total) >= abs(value):
+            self.compensation += (self.float_total - total) + value
+        else:
+            self.compensation += (value - total) + self.float_total
+        self.float_total = total
+    
+    def merge(self, other):
+        if not other.count:
+            return
+        count = self.count + other.count
+        delta = other.mean - self.mean
+        self.total += other.total
+        self.add_float(other.float_total)
+        self.compensation += other.compensation
+        self.mean += delta * other.count / count
+        self.m2 += other.m2 + delta * delta * self.count * other.count / count
+        self.count = count
+    
+    def get_total(self):
+        """
+        Returns
+            the sum of the values, as a Decimal
+        """
+        float_total = self.float_total + self.compensation
+        if not float_total:
+            return Decimal(self.total)
+        # repr is the shortest string that reads back as the same float
+        return self.total + Decimal(repr(float_total))
+    
+    def aggregate(self, types_of_aggregate):
+        """
+        Computes the aggregates, rounded with r().  The standard deviation is
+        computed around the rounded average, using
+            sum((x - a) ** 2) = M2 + count * (mean - a) ** 2
+        """
+        aggregates = dict()
+        total = self.get_total()
+        average = r(safe_average(total, self.count))
+        if Aggregation.SUM in types_of_aggregate:
+            aggregates[Aggregation.SUM] = r(total)
+        if Aggregation.AVG in types_of_aggregate:
+            aggregates[Aggregation.AVG] = average
+        if Aggregation.STD in types_of_aggregate:
+            difference = self.mean - float(average)
+            square_diffs = max(self.m2 + self.count * difference * difference, 0.0)
+            aggregates[Aggregation.STD] = r(sqrt(safe_average(square_diffs, self.count)))
+        return aggregates
+
+
+class SubmetricTable(object):
+    """
+    Collects the values of one submetric for every user, as the rows of a
+    user x slice table.  Timeseries submetrics have a column per slice, in the
+    order the slices were first seen.  Other submetrics have a single column.
+    
+    Columns of integers are reduced with vectorized numpy operations to exact
+    int64 sums.  Other columns are fed to RunningStatistics one value at a time.
+    """
+    
+    def __init__(self, timeseries):
+        self.timeseries = timeseries
+        self.slices = []
+        self.slice_index = dict()
+        self.rows = []
+        self.censored = []
+        self.types = set()
+    
+    def add(self, value, censored):
+        if self.timeseries:
+            if not isinstance(value, dict):
+                raise ValueError('Timeseries results mixed with non-timeseries results')
+            if not value.viewkeys() <= self.slice_index.viewkeys():
+                for subkey in value:
+                    if subkey not in self.slice_index:
+                        self.slice_index[subkey] = len(self.slices)
+                        self.slices.append(subkey)
+            row = map(value.get, self.slices)
+        else:
+            if isinstance(value, dict):
+                raise ValueError('Timeseries results mixed with non-timeseries results')
+            row = [value]
+        
+        self.rows.append(row)
+        self.censored.append(censored)
+        self.types.update(map(type, row))
+    
+    def statistics(self):
+        """
+        Returns
+            a list with the RunningStatistics of each column
+        """
+        width = len(self.slices) if self.timeseries else 1
+        columns = None
+        if width and self.types <= NUMPY_TYPES:
+            columns = self.integer_columns(width)
+        
+        if columns:
+            return [
+                RunningStatistics.from_sums(int(count), int(total), int(squares))
+                for count, total, squares in zip(*columns)
+            ]
+        
+        statistics = [RunningStatistics() for column in range(width)]
+        for row, censored in zip(self.rows, self.censored):
+            if censored:
+                continue
+            for column, value in enumerate(row):
+                if value is not None:
+                    statistics[column].add(value)
+        return statistics
+    
+    def integer_columns(self, width):
+        """
+        Computes the count, sum, and sum of squares of each column, if all the
+        values are integers small enough for these to be exact in int64.
+        
+        Returns
+            a tuple of three numpy arrays, or None if the values don't qualify
+        """
+        for row in self.rows:
+            if len(row) < width:
+                row.extend([None] * (width - len(row)))
+        
+        # None becomes NaN
+        values = numpy.array(self.rows, dtype=float).reshape(len(self.rows), width)
+        valid = ~numpy.isnan(values)
+        valid &= ~numpy.array(self.censored, dtype=bool).reshape(len(self.rows), 1)
+        values[~valid] = 0
+        
+        if values.size:
+            largest = numpy.abs(values).max()
+            if (
+                largest >= MAX_EXACT_INTEGER or
+                len(self.rows) * largest * largest >= MAX_INT64 or
+                not numpy.all(values == numpy.floor(values))
+            ):
+                return None
+        
+        values = values.astype(numpy.int64)
+        return (
+            valid.sum(axis=0),
+            values.sum(axis=0),
+            (values * values).sum(axis=0),
+        )
+
+
+# values of these types are converted to numpy floats to check if they are integers
+NUMPY_TYPES = set([int, long, bool, float, type(None)])
+# integers up to this size are exact as floats, and their squares fit in an int64
+MAX_EXACT_INTEGER = 2 ** 31
+MAX_INT64 = 2 ** 63 - 1
+
+
 def safe_average(cummulative_sum, count):
     if count != 0:
         return r(cummulative_sum / count)
@@ -0,0 +1,216 @@
+import json
+import celery
+from collections import OrderedDict
+from copy import deepcopy
+from datetime import timedelta
+from celery import current_task
+from celery.utils.log import get_task_logger
+
+from wikimetrics.api import CohortService
+from wikimetrics.configurables import db
+from wikimetrics.enums import Aggregation, TimeseriesChoices
+from wikimetrics.metrics import metric_classes
+from wikimetrics.utils import format_pretty_date, strip_time
+from report import ReportNode
+from aggregate_report import AggregateReport
+
+
+__all__ = ['BackfillReport']
+
+task_logger = get_task_logger(__name__)
+
+
+class BackfillReport(ReportNode):
+    """
+    Runs a range of consecutive missed days of a recurrent report with a single
+    query.  The metric is run once over the whole range with a daily (or hourly)
+    timeseries, and the results are split into the results each day's RunReport
+    would have computed on its own.  Each RunReport then stores its results and
+    writes its public file as if it had run by itself.
+
+    This only works for metrics where a day's result is that day's timeseries
+    slice, see Metric.supports_backfill.  Use create_backfills to group the runs
+    created by RunReport.create_reports_for_missed_days.
+    """
+
+    show_in_ui = False
+
+    def __init__(self, runs, parameters, user_id=0):
+        """
+        Parameters:
+            runs        : RunReports for consecutive days, in chronological order
+            parameters  : the parameters of the parent recurrent report
+            user_id     : the user that owns the recurrent report
+        """
+        super(BackfillReport, self).__init__(user_id=user_id)
+
+        self.runs = runs
+        self.days = [run.created - timedelta(days=1) for run in runs]
+
+        metric_dict = deepcopy(parameters['metric'])
+        self.timeseries = metric_dict.get('timeseries', TimeseriesChoices.NONE)
+        metric_dict['start_date'] = self.days[0]
+        metric_dict['end_date'] = runs[-1].created
+        if self.timeseries != TimeseriesChoices.HOUR:
+            metric_dict['timeseries'] = TimeseriesChoices.DAY
+        metric = metric_classes[metric_dict['name']](**metric_dict)
+        metric.backfill = True
+
+        session = db.get_session()
+        cohort = CohortService().get(
+            session, user_id, by_id=parameters['cohort']['id'], snapshot=True
+        )
+        self.children = [AggregateReport(
+            metric, cohort, metric_dict, parameters=parameters, user_id=user_id
+        )]
+
+    def __repr__(self):
+        return '<BackfillReport({0} to {1})>'.format(
+            self.runs[0].persistent_id, self.runs[-1].persistent_id
+        )
+
+    @classmethod
+    def create_backfills(cls, report, runs, min_days=2):
+        """
+        Groups the missed runs of a recurrent report into backfills of consecutive
+        days.  Runs that can not be backfilled are returned as they are.
+
+        Parameters:
+            report      : the parent recurrent report
+            runs        : RunReports as created by create_reports_for_missed_days
+            min_days    : do not backfill fewer consecutive days than this
+
+        Returns:
+            A list of reports to run, BackfillReports and RunReports
+        """
+        runs = list(runs)
+        parameters = json.loads(report.parameters)
+        metric_dict = parameters['metric']
+        try:
+            metric = metric_classes[metric_dict['name']](**metric_dict)
+            supported = metric.supports_backfill()
+        except Exception:
+            task_logger.exception('Could not check backfill for {0}'.format(report))
+            supported = False
+        if not supported:
+            return runs
+
+        ranges = []
+        for run in runs:
+            if not cls.can_backfill(run):
+                ranges.append([run])
+            elif (
+                ranges and cls.can_backfill(ranges[-1][-1]) and
+                ranges[-1][-1].created + timedelta(days=1) == run.created
+            ):
+                ranges[-1].append(run)
+            else:
+                ranges.append([run])
+
+        reports = []
+        for day_runs in ranges:
+            if len(day_runs) < min_days:
+                reports.extend(day_runs)
+                continue
+            try:
+                reports.append(cls(day_runs, parameters, user_id=report.user_id))
+            except Exception:
+                task_logger.exception('Could not backfill {0}'.format(day_runs))
+                reports.extend(day_runs)
+        return reports
+
+    @staticmethod
+    def can_backfill(run):
+        """
+        Only valid runs that cover exactly one day can be backfilled
+        """
+        return (
+            run.created is not None and
+            run.created == strip_time(run.created) and
+            len(run.children) == 1 and
+            isinstance(run.children[0], AggregateReport)
+        )
+
+    def run(self):
+        """
+        Runs the metric over all the days, then lets each day's RunReport finish
+        with its part of the results.  Days that could not finish are marked as
+        failed, so the scheduler retries them.
+        """
+        task_id = current_task.request.id
+        for run in self.runs:
+            run.set_status(celery.states.STARTED, task_id=task_id)
+
+        merged = {}
+        finished = 0
+        try:
+            results = self.children[0].run()
+            by_day = split_results_by_day(results, self.days, self.timeseries)
+            for run, day_results in zip(self.runs, by_day):
+                with run.profile('RunReport.finish'):
+                    run_results = run.finish([day_results])
+                run.set_status(celery.states.SUCCESS)
+                finished += 1
+                merged.update(run_results)
+                with run.profile('RunReport.post_process'):
+                    run.post_process(run_results)
+        except Exception:
+            task_logger.exception('backfill failed for {0}'.format(self))
+            for run in self.runs[finished:]:
+                run.set_status(celery.states.FAILURE)
+            raise
+
+        self.result_stored = all(run.result_stored for run in self.runs)
+        return merged
+
+
+def split_results_by_day(results, days, timeseries):
+    """
+    Splits the results of an AggregateReport run over many days with a daily or
+    hourly timeseries into the results of running it on each day.
+
+    Parameters
+        results     : the results over all days, as computed by AggregateReport
+        days        : the start of each day to split out, at midnight
+        timeseries  : the timeseries choice of the report run for each day
+
+    Yields
+        The results for each day, shaped as if the report had been run
+        from the start of that day to the start of the next, with timeseries.
+        Without a timeseries, the values are the day's slice.  By day, month, or
+        year, there is a single slice for the day.  By hour, the day's slices.
+    """
+    def day_slices(day):
+        if timeseries == TimeseriesChoices.HOUR:
+            return [
+                format_pretty_date(day + timedelta(hours=hour)) for hour in range(24)
+            ]
+        return [format_pretty_date(day)]
+
+    def split(value, slices):
+        if not isinstance(value, dict):
+            return value
+        if timeseries == TimeseriesChoices.NONE:
+            return value.get(slices[0])
+        return OrderedDict((key, value[key]) for key in slices if key in value)
+
+    def split_submetrics(submetrics, slices):
+        if not isinstance(submetrics, dict):
+            return submetrics
+        return {
+            submetric: split(value, slices)
+            for submetric, value in submetrics.iteritems()
+        }
+
+    for day in days:
+        slices = day_slices(day)
+        day_results = {}
+        for key, value in results.iteritems():
+            if key == Aggregation.IND:
+                day_results[key] = {
+                    user: split_submetrics(submetrics, slices)
+                    for user, submetrics in value.iteritems()
+                }
+            else:
+                day_results[key] = split_submetrics(value, slices)
+        yield day_results
@@ -1,7 +1,16 @@
+import json
+from celery.utils.log import get_task_logger
+from sqlalchemy.exc import OperationalError
 from wikimetrics.configurables import db
+from wikimetrics.api import metric_result_cache
 from report import ReportLeaf
 from wikimetrics.models.storage.wikiuser import WikiUserKey
-from wikimetrics.utils import NO_RESULTS
+from wikimetrics.models.mediawiki import drop_cohort_tables
+from wikimetrics.utils import NO_RESULTS, chunk, check_cancelled
+from wikimetrics.query_stats import query_context
+
+
+task_logger = get_task_logger(__name__)
 
 
 class MetricReport(ReportLeaf):
@@ -10,7 +19,7 @@ class MetricReport(ReportLeaf):
     homogenous list of user_ids.  Like all reports, the database session
     is constructed within MetricReport.run()
     """
-    
+
     def __init__(self, metric, cohort_id, user_ids, project, *args, **kwargs):
         """
         Parameters:
@@ -29,8 +38,11 @@ class MetricReport(ReportLeaf):
         self.project = project
 
     def run(self):
-        session = db.get_mw_session(self.project)
-        results_by_user = self.metric(self.user_ids, session)
+        with self.profile('MetricReport {0}'.format(self.project)):
+            results_by_user = metric_result_cache.get(
+                self.metric, self.project, self.user_ids, self.compute
+            )
+
         results = {
             str(WikiUserKey(key, self.project, self.cohort_id)) : value
             for key, value in results_by_user.items()
@@ -38,3 +50,76 @@ class MetricReport(ReportLeaf):
         if not len(results):
             results = {NO_RESULTS : self.metric.default_result}
         return results
+
+    def compute(self):
+        """
+        Runs the metric on the mediawiki database, when its results are not cached
+
+        Returns:
+            the results of the metric by user id
+        """
+        session = db.get_mw_session(self.project)
+        chunk_size = db.config.get('METRIC_CHUNK_SIZE')
+        labels = dict(
+            metric=self.metric.id, project=self.project, cohort=self.cohort_id
+        )
+        with query_context(**labels) as queries:
+            if (
+                chunk_size and self.user_ids and len(self.user_ids) > chunk_size and
+                self.metric.supports_chunking()
+            ):
+                results_by_user = self.run_in_chunks(session, chunk_size)
+            else:
+                results_by_user = self.run_metric(self.user_ids, session)
+        queries['users'] = len(self.user_ids) if self.user_ids is not None else None
+        task_logger.info('queries of {0}: {1}'.format(
+            self, json.dumps(queries, sort_keys=True)
+        ))
+        return results_by_user
+
+    def run_in_chunks(self, session, chunk_size):
+        """
+        Runs the metric on chunks of at most chunk_size users, so that each
+        query stays small enough to finish on huge cohorts.  Each chunk is
+        retried up to METRIC_CHUNK_RETRIES times if the database fails, and
+        progress is shown on the status of the report after each chunk.  This
+        stops after the current chunk if the parallel_map running this report
+        is cancelled, so it does not overwrite the final status of the report.
+
+        Returns:
+            the results of all the chunks, merged into one dictionary by user id
+        """
+        retries = db.config.get('METRIC_CHUNK_RETRIES', 0)
+        chunks = list(chunk(self.user_ids, chunk_size))
+        results_by_user = {}
+        for done, user_ids in enumerate(chunks, 1):
+            with query_context(chunk=done) as queries:
+                results_by_user.update(self.run_metric(user_ids, session, retries))
+            task_logger.info('queries of {0}: {1}'.format(
+                self, json.dumps(queries, sort_keys=True)
+            ))
+            check_cancelled()
+            self.set_progress('{0}/{1} {2}'.format(done, len(chunks), self.project))
+        return results_by_user
+
+    def run_metric(self, user_ids, session, retries=0):
+        """
+        Runs the metric, retrying if the database fails with an OperationalError
+        (lost connection, query killed for running too long, etc.)
+        """
+        attempt = 0
+        while True:
+            try:
+                try:
+                    return self.metric(user_ids, session)
+                finally:
+                    # the metric may have materialized the cohort into temporary tables
+                    drop_cohort_tables(session)
+            except OperationalError, e:
+                if attempt >= retries:
+                    raise
+                attempt += 1
+                task_logger.warning('retrying {0} users of {1} on {2} ({3}): {4}'.format(
+                    len(user_ids), self.metric.id, self.project, attempt, e
+                ))
+                session.rollback()
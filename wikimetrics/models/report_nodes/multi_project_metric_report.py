@@ -1,5 +1,8 @@
+from threading import Lock
 from celery.utils.log import get_task_logger
 from wikimetrics.api import CohortService
+from wikimetrics.configurables import db
+from wikimetrics.utils import parallel_map
 from report import ReportNode
 from metric_report import MetricReport
 
@@ -15,6 +18,11 @@ class MultiProjectMetricReport(ReportNode):
     project-heterogenous cohort. This just abstracts away the task
     of grouping the cohort by project and calling a MetricReport on
     each project-homogenous list of user_ids.
+    
+    A parent report can set result_accumulator to an object with an add method,
+    which is then fed the results of each project as soon as they are ready.
+    If the parent only needs the accumulated results, it can set merge_results
+    to False so the individual results are not kept around and merged.
     """
     show_in_ui = False
     
@@ -35,6 +43,64 @@ class MultiProjectMetricReport(ReportNode):
             self.children.append(
                 MetricReport(metric, cohort.id, user_ids, project, *args, **kwargs)
             )
+        self.result_accumulator = None
+        self.merge_results = True
+    
+    def run_children(self):
+        """
+        Runs the per-project MetricReports in a bounded pool of threads, because
+        most of their time is spent waiting on the mediawiki databases.  The pool
+        size is MEDIAWIKI_PARALLEL_PROJECTS and at most
+        MEDIAWIKI_MAX_CONNECTIONS_PER_HOST children hit the same database host
+        at once.  Results are returned in the order of self.children, so finish
+        merges them deterministically.
+        """
+        accumulator_lock = Lock()
+        max_workers = db.config.get('MEDIAWIKI_PARALLEL_PROJECTS', 1)
+        if max_workers <= 1 or len(self.children) <= 1:
+            return [
+                self.collect(child.run(), accumulator_lock)
+                for child in self.children
+            ]
+        
+        project_host_map = db.get_project_host_map()
+        
+        def host(child):
+            return project_host_map.get(child.project, child.project)
+        
+        def run_child(child):
+            return self.collect(self.run_child(child), accumulator_lock)
+        
+        return parallel_map(
+            run_child,
+            self.children,
+            max_workers,
+            group=host,
+            max_per_group=db.config.get('MEDIAWIKI_MAX_CONNECTIONS_PER_HOST'),
+        )
+    
+    def run_child(self, child):
+        """
+        Runs a child MetricReport in a worker thread.  Mediawiki sessions are
+        thread-local, so the session used by this thread is removed afterwards
+        to give its connection back.
+        """
+        try:
+            return child.run()
+        finally:
+            db.get_mw_session(child.project).remove()
+    
+    def collect(self, results, accumulator_lock):
+        """
+        Feeds the results of a child to the result accumulator, if any, and
+        returns what should be kept for finish.
+        """
+        if self.result_accumulator is not None:
+            with accumulator_lock:
+                self.result_accumulator.add(results)
+        if not self.merge_results:
+            return {}
+        return results
     
     def finish(self, metric_results):
         merged_individual_results = {}
@@ -1,5 +1,7 @@
+import time
 import celery
 import traceback
+from contextlib import contextmanager
 from uuid import uuid4
 from celery import current_task
 from datetime import datetime
@@ -11,8 +13,12 @@ from celery.utils.log import get_task_logger
 # from celery.contrib.methods import task_method
 from flask.ext.login import current_user
 from wikimetrics.configurables import db, queue
+from wikimetrics.api.status_buffer import report_status_buffer
+from wikimetrics.api.report_profiler import report_profiler
 from wikimetrics.utils import stringify
+from wikimetrics.enums import ReportStatus
 from wikimetrics.models.storage import ReportStore, TaskErrorStore
+from wikimetrics.models.storage.report import RESULT_STORED
 
 
 __all__ = [
@@ -50,7 +56,13 @@ def queue_task(report):
         current_task.request.id,
     ))
     try:
-        return report.run()
+        # the updates to the stored reports of this tree are written together
+        with report_status_buffer.batch():
+            results = report.run()
+        if report.result_stored and not db.config.get('RESULT_STORE_QUEUE_RESULTS'):
+            # the results are read from the result store, keep them out of the queue
+            return {result_key: RESULT_STORED for result_key in results}
+        return results
     except Exception, e:
         # Create a task error with the failure information.
         if report.persistent_id is not None:
@@ -58,6 +70,11 @@ def queue_task(report):
             trace = traceback.format_exc()
             TaskErrorStore.add('report', report.persistent_id, message, trace)
         raise e
+    finally:
+        try:
+            report_profiler.flush()
+        except Exception:
+            task_logger.exception('could not store the profile of {0}'.format(report))
 
 
 class Report(object):
@@ -99,6 +116,10 @@ class Report(object):
         self.store = store
         self.persistent_id = persistent_id
         self.created = None
+        # the stored report, up the tree, that shows the progress of this report
+        self.progress_report_id = None
+        # whether report_result wrote the results of this report to the result store
+        self.result_stored = False
 
         if self.store is True and self.persistent_id is None:
             # store report to database
@@ -135,16 +156,49 @@ class Report(object):
     def set_status(self, status, task_id=None):
         """
         helper function for updating database status after celery
-        task has been started
+        task has been started.  Inside a task, the update is buffered
+        with the others of the report tree, see ReportStatusBuffer.
         """
         self.status = status
         if self.store is True:
-            session = db.get_session()
-            pj = session.query(ReportStore).get(self.persistent_id)
-            pj.status = status
+            values = {'status': status}
             if task_id:
-                pj.queue_result_key = task_id
-            session.commit()
+                values['queue_result_key'] = task_id
+            report_status_buffer.update(self.persistent_id, **values)
+    
+    def set_progress(self, message):
+        """
+        Shows how far along this report is in the status of the stored report
+        it runs under, as "PROGRESS <message>".  The final status overwrites it.
+        This does not use the session, so it is safe to call from worker threads.
+        """
+        report_id = self.get_stored_report_id()
+        if report_id is None:
+            return
+        
+        status = '{0} {1}'.format(ReportStatus.PROGRESS, message)
+        # the status column is only 50 characters long
+        report_status_buffer.update(report_id, status=status[:50])
+    
+    def get_stored_report_id(self):
+        """
+        Returns
+            the id of the stored report that this report runs under, if any
+        """
+        return self.persistent_id if self.store else self.progress_report_id
+    
+    @contextmanager
+    def profile(self, node):
+        """
+        Adds the time spent inside this context to the profile of the stored
+        report this report runs under, as the time spent in node.
+        The profile is stored when the task ends, see ReportProfileStore.
+        """
+        start = time.time()
+        try:
+            yield
+        finally:
+            report_profiler.add(self.get_stored_report_id(), node, time.time() - start)
     
     def run(self):
         """
@@ -168,21 +222,35 @@ class ReportNode(Report):
         """
         self.set_status(celery.states.STARTED, task_id=current_task.request.id)
         results = []
-        if self.children:
-            try:
-                child_results = [child.run() for child in self.children]
-                results = self.finish(child_results)
-            except SoftTimeLimitExceeded:
-                self.set_status(celery.states.FAILURE)
-                task_logger.error('timeout exceeded for {0}'.format(
-                    current_task.request.id
-                ))
-                raise
+        node = type(self).__name__
+        with self.profile(node):
+            if self.children:
+                for child in self.children:
+                    child.progress_report_id = self.get_stored_report_id()
+                try:
+                    child_results = self.run_children()
+                    with self.profile(node + '.finish'):
+                        results = self.finish(child_results)
+                except SoftTimeLimitExceeded:
+                    self.set_status(celery.states.FAILURE)
+                    task_logger.error('timeout exceeded for {0}'.format(
+                        current_task.request.id
+                    ))
+                    raise
         
         self.set_status(celery.states.SUCCESS)
-        self.post_process(results)
+        with self.profile(node + '.post_process'):
+            self.post_process(results)
         return results
     
+    def run_children(self):
+        """
+        Runs the children of this node and returns their results, in the same
+        order as self.children.  Subclasses can override this to run their
+        children differently, for example in parallel.
+        """
+        return [child.run() for child in self.children]
+    
     def finish(self, child_results):
         """
         Each ReportNode subclass should implement this method to deal with
@@ -214,7 +282,8 @@ class ReportNode(Report):
         Creates a unique identifier for this ReportNode, and returns a one element
         dictionary with that identifier as the key and its results as the value.
         This allows ReportNode results to be merged as the tree of ReportNodes is
-        evaluated.
+        evaluated.  The results of stored reports are also written to the result
+        store, under the same identifier.
         
         Parameters
             results         : Anything that the ReportNode compiles in its finish step
@@ -228,11 +297,16 @@ class ReportNode(Report):
         self.result_key = str(uuid4())
 
         if self.store:
-            db_session = db.get_session()
-            pj = db_session.query(ReportStore).get(self.persistent_id)
-            pj.result_key = self.result_key
-            db_session.add(pj)
-            db_session.commit()
+            report_status_buffer.update(self.persistent_id, result_key=self.result_key)
+            
+            try:
+                ReportStore.get_result_store().write(self.result_key, results)
+                self.result_stored = True
+            except EnvironmentError:
+                # the results still go back through the queue
+                task_logger.exception(
+                    'could not store result {0}'.format(self.result_key)
+                )
         
         merged = {self.result_key: results}
         for child_result in child_results:
@@ -54,7 +54,7 @@ class RunProgramMetricsReport(ReportNode):
         cohort_store_object = cohort_service.fetch_by_id(self.cohort_id)
         # First make sure this is a valid cohort
         if cohort_store_object is not None and cohort_store_object.validated:
-            self.cohort = cohort_service.convert(cohort_store_object)
+            self.cohort = cohort_service.convert(cohort_store_object, snapshot=True)
             validate_report = ValidateProgramMetricsReport(self.cohort,
                                                            db.get_session(),
                                                            user_id=self.user_id)
@@ -18,7 +18,7 @@ from aggregate_report import AggregateReport
 from null_report import NullReport
 from validate_report import ValidateReport
 from metric_report import MetricReport
-from wikimetrics.api import ReportService, CohortService
+from wikimetrics.api import ReportService, CohortService, report_single_flight
 from wikimetrics.utils import stringify
 from wikimetrics.schedules import recurring_reports
 
@@ -73,7 +73,10 @@ class RunReport(ReportNode):
         cohort_service = CohortService()
         cohort_dict = parameters['cohort']
         session = db.get_session()
-        cohort = cohort_service.get(session, user_id, by_id=cohort_dict['id'])
+        # the members are read once, and shared by all the nodes of this report
+        cohort = cohort_service.get(
+            session, user_id, by_id=cohort_dict['id'], snapshot=True
+        )
 
         parameters['cohort']['size'] = cohort.size
 
@@ -102,6 +105,9 @@ class RunReport(ReportNode):
 
         self.recurrent_parent_id = recurrent_parent_id
         self.public = public
+        # identical reports running at the same time share one computation
+        self.flight_key = None
+        self.leading = False
 
         validate_report = ValidateReport(
             metric, cohort, recurrent_parent_id is None, user_id=user_id
@@ -121,13 +127,63 @@ class RunReport(ReportNode):
                     metric, cohort, metric_dict, parameters=parameters,
                     user_id=user_id
                 )]
+                if report_single_flight.enabled():
+                    self.flight_key = report_single_flight.key(
+                        cohort.id, cohort.snapshot.version, metric_dict
+                    )
         else:
             self.children = [validate_report]
 
+    def run(self):
+        try:
+            return super(RunReport, self).run()
+        finally:
+            # lets identical reports run themselves if this one failed
+            self.land()
+
+    def run_children(self):
+        """
+        Runs the children, unless an identical report is already running.  Then
+        this waits for it, and makes its results from the stored result of that
+        report, see ReportSingleFlight.
+        """
+        if self.flight_key is None:
+            return super(RunReport, self).run_children()
+
+        leader_id = report_single_flight.lead(self.flight_key, self.persistent_id)
+        if leader_id is None:
+            self.leading = True
+            return super(RunReport, self).run_children()
+
+        self.set_progress('waiting for report {0}'.format(leader_id))
+        result_key = report_single_flight.wait(self.flight_key)
+        if result_key is not None:
+            results = ReportStore.get_result_store().read(result_key)
+            if results is not None:
+                task_logger.info('{0} reused the result of report {1}'.format(
+                    self, leader_id
+                ))
+                return [results]
+        return super(RunReport, self).run_children()
+
     def finish(self, aggregated_results):
         result = self.report_result(aggregated_results[0])
+        self.land()
         return result
 
+    def land(self):
+        """
+        If this report led identical ones, lets them use its stored result
+        """
+        if not self.leading:
+            return
+        self.leading = False
+        report_single_flight.land(
+            self.flight_key,
+            self.persistent_id,
+            self.result_key if self.result_stored else None,
+        )
+
     def post_process(self, results):
         """
          If the report is public and this task went well,
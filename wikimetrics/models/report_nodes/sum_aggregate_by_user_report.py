@@ -29,9 +29,13 @@ class SumAggregateByUserReport(ReportNode):
         super(SumAggregateByUserReport, self).__init__(*args, **kwargs)
 
         # Get mediawiki's username map to be able to aggregate.
-        service = CohortService()
-        session = db.get_session()
-        self.usernames = service.get_wikiusernames_for_cohort(cohort.id, session)
+        snapshot = getattr(cohort, 'snapshot', None)
+        if snapshot is not None:
+            self.usernames = snapshot.usernames_by_key()
+        else:
+            service = CohortService()
+            session = db.get_session()
+            self.usernames = service.get_wikiusernames_for_cohort(cohort.id, session)
 
         self.children = [
             MultiProjectMetricReport(cohort, metric, *args, **kwargs)
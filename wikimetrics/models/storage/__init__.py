@@ -4,6 +4,8 @@ from cohort import *
 from cohort_user import *
 from cohort_wikiuser import *
 from report import *
+from report_profile import *
+from edit_rollup import *
 from user import *
 from wikiuser import *
 from task_error import *
@@ -37,6 +37,8 @@ class CohortStore(db.WikimetricsBase):
     validated               = Column(Boolean, default=False)
     validate_as_user_ids    = Column(Boolean, default=True)
     validation_queue_key    = Column(String(50))
+    # bumped whenever the members change, see CohortSnapshot
+    membership_version      = Column(Integer, default=0, nullable=False)
 
     def __repr__(self):
         return '<CohortStore("{0}")>'.format(self.id)
@@ -61,6 +63,7 @@ class CohortStore(db.WikimetricsBase):
         NOTE: this can be different than the length of the result of __iter__,
         because database changes might occur in between calls.  So any code that
         depends on that not being the case *may* fail in unexpected and wild ways.
+        Reports avoid this by reading the size and the users from a CohortSnapshot.
 
         Returns:
             the number of users in this cohort
@@ -0,0 +1,59 @@
+from sqlalchemy import Column, Integer, String, Date
+from wikimetrics.configurables import db
+
+
+__all__ = [
+    'EditRollupStore',
+    'EditRollupCoverageStore',
+]
+
+
+class EditRollupStore(db.WikimetricsBase):
+    """
+    The edits of each user of a mediawiki project, by day and namespace, counted
+    from the replicas by EditRollupService.build.  Counting metrics can answer
+    from this table instead of scanning the revision and archive tables, for the
+    days covered by EditRollupCoverageStore.
+        namespace           : the namespace of the page when the day was counted
+        edits               : revisions on existing pages
+        archived_edits      : revisions on deleted pages
+        creations           : page creations, among edits
+        archived_creations  : page creations, among archived_edits
+        midnight_edits      : edits and archived_edits made right at the midnight
+                              starting the day
+        midnight_creations  : page creations among midnight_edits
+    """
+    __tablename__ = 'edit_rollup'
+
+    project = Column(String(45), primary_key=True)
+    user_id = Column(Integer, primary_key=True, autoincrement=False)
+    day = Column(Date, primary_key=True)
+    namespace = Column(Integer, primary_key=True, autoincrement=False)
+    edits = Column(Integer, nullable=False, default=0)
+    archived_edits = Column(Integer, nullable=False, default=0)
+    creations = Column(Integer, nullable=False, default=0)
+    archived_creations = Column(Integer, nullable=False, default=0)
+    midnight_edits = Column(Integer, nullable=False, default=0)
+    midnight_creations = Column(Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return '<EditRollupStore("{0}", "{1}", "{2}", "{3}")>'.format(
+            self.project, self.user_id, self.day, self.namespace
+        )
+
+
+class EditRollupCoverageStore(db.WikimetricsBase):
+    """
+    The days of each project counted in EditRollupStore, from start included to
+    end excluded.
+    """
+    __tablename__ = 'edit_rollup_coverage'
+
+    project = Column(String(45), primary_key=True)
+    start = Column(Date, nullable=False)
+    end = Column(Date, nullable=False)
+
+    def __repr__(self):
+        return '<EditRollupCoverageStore("{0}", "{1}", "{2}")>'.format(
+            self.project, self.start, self.end
+        )
@@ -1,3 +1,4 @@
+import os.path
 import celery
 import json
 from sqlalchemy import Column, Integer, String, DateTime, Boolean, func, ForeignKey
@@ -6,15 +7,20 @@ from sqlalchemy.schema import UniqueConstraint, Index
 from sqlalchemy.sql.expression import and_
 from sqlalchemy.exc import SQLAlchemyError
 from sqlalchemy.dialects.mysql import VARBINARY
-from wikimetrics.configurables import db, app
+from wikimetrics.configurables import db, app, get_absolute_path
+from wikimetrics.enums import ReportStatus
 from wikimetrics.exceptions import UnauthorizedReportAccessError, PublicReportIOError
 
 
+# Returned through the queue instead of results that were written to the result store
+RESULT_STORED = 'result stored'
+
+
 class ReportStore(db.WikimetricsBase):
     """
     Stores each report node that runs in a report node tree to the database.
-    Stores the necessary information to fetch the results from Celery as
-    well as to re-run the node.
+    Stores the necessary information to fetch the results from the result store
+    or from Celery as well as to re-run the node.
     """
     __tablename__ = 'report'
 
@@ -48,6 +54,12 @@ class ReportStore(db.WikimetricsBase):
             # TODO: inline import.  Can't import up above because of circular reference
             from wikimetrics.models.report_nodes import Report
             celery_task = Report.task.AsyncResult(self.queue_result_key)
+            # keep progress reported by the running task until celery has a result
+            if (
+                celery_task.status not in celery.states.READY_STATES and
+                self.status and self.status.startswith(ReportStatus.PROGRESS)
+            ):
+                return
             self.status = celery_task.status
             existing_session = Session.object_session(self)
             if not existing_session:
@@ -176,13 +188,44 @@ class ReportStore(db.WikimetricsBase):
             ReportStore.update_reports([report_id], owner_id, public=not public)
             raise e
 
-    def get_result_safely(self, result):
-        if result and isinstance(result, dict) and self.result_key in result:
+    @staticmethod
+    def get_result_store():
+        # TODO: inline import.  Can't import up above because of circular reference
+        from wikimetrics.api import ReportResultStore
+        # relative paths do not depend on the directory the worker was started in
+        root_dir = os.path.join(get_absolute_path(), db.config['RESULT_STORE_PATH'])
+        return ReportResultStore(app.logger, os.path.normpath(root_dir))
+
+    def get_stored_result(self):
+        """
+        Returns
+            the results of this report from the result store, None if they are not there
+        """
+        if not self.result_key:
+            return None
+        return ReportStore.get_result_store().read(self.result_key)
+
+    def get_result_safely(self, result=None):
+        """
+        Parameters
+            result  : the result of this report's task, as returned by Celery
+
+        Returns
+            the results of this report from result if they are in it, otherwise from
+            the result store, otherwise a failure
+        """
+        if (
+            result and isinstance(result, dict) and self.result_key in result and
+            result[self.result_key] != RESULT_STORED
+        ):
             return result[self.result_key]
-        else:
-            return {'failure': 'result not available'}
 
-    def get_json_result(self, result):
+        stored = self.get_stored_result()
+        if stored is not None:
+            return stored
+        return {'failure': 'result not available'}
+
+    def get_json_result(self, result=None):
         result = self.get_result_safely(result)
         return {
             'result': result,
@@ -0,0 +1,61 @@
+from sqlalchemy import Column, Integer, String, Float, ForeignKey
+from sqlalchemy.sql.expression import and_, or_
+from wikimetrics.configurables import db
+
+
+class ReportProfileStore(db.WikimetricsBase):
+    """
+    Stores how long the last run of a report spent in each kind of node of its
+    report tree, for example in each project's MetricReport, in finish,
+    post_process, or writing the public report file.  See Report.profile.
+    """
+    __tablename__ = 'report_profile'
+
+    report_id = Column(Integer, ForeignKey('report.id'),
+                       primary_key=True, autoincrement=False)
+    node = Column(String(100), primary_key=True)
+    seconds = Column(Float, nullable=False)
+    count = Column(Integer, nullable=False)
+
+    @staticmethod
+    def replace(timings):
+        """
+        Writes timings in one transaction, replacing any stored for the same
+        report and node by a previous run.  This does not use the session, so
+        it is safe to call from worker threads.
+
+        Parameters
+            timings : list of dictionaries with report_id, node, seconds and count
+        """
+        if not timings:
+            return
+        table = ReportProfileStore.__table__
+        with db.get_engine().begin() as connection:
+            connection.execute(table.delete().where(or_(*[
+                and_(table.c.report_id == t['report_id'], table.c.node == t['node'])
+                for t in timings
+            ])))
+            connection.execute(table.insert(), timings)
+
+    @staticmethod
+    def get_profiles(db_session, report_ids):
+        """
+        Returns
+            dictionary of the profile of each report, the slowest nodes first,
+            as lists of dictionaries with the node, seconds and count
+        """
+        profiles = {}
+        if not report_ids:
+            return profiles
+        rows = db_session.query(ReportProfileStore)\
+            .filter(ReportProfileStore.report_id.in_(report_ids))\
+            .order_by(ReportProfileStore.seconds.desc())\
+            .all()
+        for row in rows:
+            profiles.setdefault(row.report_id, []).append({
+                'node': row.node, 'seconds': row.seconds, 'count': row.count,
+            })
+        return profiles
+
+    def __repr__(self):
+        return '<ReportProfileStore("{0}", "{1}")>'.format(self.report_id, self.node)
@@ -3,19 +3,29 @@ from celery import current_task
 from celery.utils.log import get_task_logger
 from flask.ext.login import current_user
 import traceback
+from datetime import datetime
 from wikimetrics.configurables import app, db, queue
 from sqlalchemy.orm.exc import NoResultFound, MultipleResultsFound
-from sqlalchemy.sql.expression import label, between, and_, or_
+from sqlalchemy.sql.expression import label, between, and_, or_, bindparam
+from sqlalchemy.sql.expression import select, literal, func, union_all
 from sqlalchemy.exc import OperationalError
-from wikimetrics.utils import deduplicate_by_key
+from wikimetrics.utils import deduplicate_by_key, chunk, parallel_map
 from wikimetrics.models import (
     MediawikiUser, CohortStore, CohortUserStore, WikiUserStore, CohortWikiUserStore,
 )
 from wikimetrics.enums import CohortUserRole
+from wikimetrics.api import CentralAuthService
 
 
 task_logger = get_task_logger(__name__)
 
+# wiki users are validated and committed this many at a time
+VALIDATION_BATCH_SIZE = 1000
+# the wiki_user columns written when a wiki user is validated
+VALIDATION_RESULT_COLUMNS = (
+    'mediawiki_username', 'mediawiki_userid', 'valid', 'reason_invalid'
+)
+
 
 @queue.task()
 def async_validate(validate_cohort):
@@ -45,9 +55,12 @@ class ValidateCohort(object):
             cohort_id               : id of an existing cohort with validated == False
             validate_as_user_ids    : if True, records will be checked against user_id
                                       if False, records are checked against user_name
+            expand_centralauth      : if True, the uploaded records are expanded
+                                      via centralauth before they are validated
         """
         self.cohort_id = cohort.id
         self.validate_as_user_ids = cohort.validate_as_user_ids
+        self.expand_centralauth = False
 
     @classmethod
     def from_upload(cls, cohort_upload, owner_user_id, session=None):
@@ -102,7 +115,11 @@ class ValidateCohort(object):
                 ]
             )
             session.commit()
-            return cls(cohort)
+            validate_cohort = cls(cohort)
+            validate_cohort.expand_centralauth = getattr(
+                cohort_upload, 'centralauth_deferred', False
+            )
+            return validate_cohort
         except Exception, e:
             session.rollback()
             app.logger.error(str(e))
@@ -113,8 +130,52 @@ class ValidateCohort(object):
         cohort = session.query(CohortStore).get(self.cohort_id)
         cohort.validation_queue_key = current_task.request.id
         session.commit()
+        if self.expand_centralauth:
+            self.expand_records(session, cohort)
         self.validate_records(session, cohort)
 
+    def expand_records(self, session, cohort):
+        """
+        Adds the accounts that the wiki_user(s) uploaded for self.cohort_id have
+        in other projects, as found by CentralAuthService.expand_via_centralauth.
+        Large uploads are expanded here, so the upload request does not wait on
+        the centralauth database.
+
+        Parameters
+            session : an active wikimetrics db session to use
+            cohort  : the cohort being validated; must belong to session
+        """
+        uploaded = set(
+            session.query(WikiUserStore.raw_id_or_name, WikiUserStore.project)
+            .filter(WikiUserStore.validating_cohort == cohort.id)
+            .all()
+        )
+        expanded = CentralAuthService().expand_via_centralauth(
+            [
+                {'raw_id_or_name': raw_id_or_name, 'project': project}
+                for raw_id_or_name, project in uploaded
+            ],
+            db.get_ca_session()
+        )
+        added = [
+            record for record in expanded
+            if (record['raw_id_or_name'], record['project']) not in uploaded
+        ]
+        if added:
+            session.execute(
+                WikiUserStore.__table__.insert(), [
+                    {
+                        'raw_id_or_name'    : record['raw_id_or_name'],
+                        'project'           : record['project'],
+                        'valid'             : None,
+                        'reason_invalid'    : '',
+                        'validating_cohort' : cohort.id,
+                    } for record in added
+                ]
+            )
+            session.commit()
+        self.expand_centralauth = False
+
     def validate_records(self, session, cohort):
         """
         Fetches the wiki_user(s) already added for self.cohort_id and validates
@@ -130,7 +191,10 @@ class ValidateCohort(object):
             cohort  : the cohort to validate; must belong to session
         """
         # reset the cohort validation status so it can't be used for reports
+        # and make existing snapshots of the cohort stale
         cohort.validated = False
+        cohort.changed = datetime.now()
+        cohort.membership_version = CohortStore.membership_version + 1
         session.execute(
             WikiUserStore.__table__.update().values(valid=None).where(
                 WikiUserStore.validating_cohort == cohort.id
@@ -164,41 +228,76 @@ class ValidateCohort(object):
             wu.project = normalized_project
             if wu.project not in wikiusers_by_project:
                 wikiusers_by_project[wu.project] = []
-            wikiusers_by_project[wu.project].append(wu)
-
-            # validate bunches of records to update the UI but not kill performance
-            if len(wikiusers_by_project[wu.project]) > 999:
-                validate_users(
-                    wikiusers_by_project[wu.project],
-                    wu.project,
-                    self.validate_as_user_ids
-                )
-                session.commit()
-                wikiusers_by_project[wu.project] = []
-
-        # validate anything that wasn't big enough for a batch
-        for project, wikiusers in wikiusers_by_project.iteritems():
-            if len(wikiusers) > 0:
-                validate_users(wikiusers, project, self.validate_as_user_ids)
+            wikiusers_by_project[wu.project].append((wu.id, wu.raw_id_or_name))
+        deduplicated_ids = [wu.id for wu in deduplicated]
+        # the batches are validated with bulk updates that bypass these objects
         session.commit()
 
+        # validate bunches of records to update the UI but not kill performance
+        batches = [
+            (project, batch)
+            for project, project_wikiusers in sorted(wikiusers_by_project.items())
+            for batch in chunk(project_wikiusers, VALIDATION_BATCH_SIZE)
+        ]
+        self.validate_batches(batches)
+
         session.execute(
             CohortWikiUserStore.__table__.insert(), [
                 {
                     'cohort_id'     : cohort.id,
-                    'wiki_user_id'  : wu.id,
-                } for wu in deduplicated
+                    'wiki_user_id'  : wiki_user_id,
+                } for wiki_user_id in deduplicated_ids
             ]
         )
 
         # clean up any duplicate wiki_user records
         session.execute(WikiUserStore.__table__.delete().where(and_(
             WikiUserStore.validating_cohort == cohort.id,
-            WikiUserStore.id.notin_([wu.id for wu in deduplicated])
+            WikiUserStore.id.notin_(deduplicated_ids)
         )))
         cohort.validated = True
+        cohort.changed = datetime.now()
+        cohort.membership_version = CohortStore.membership_version + 1
         session.commit()
 
+    def validate_batches(self, batches):
+        """
+        Validates batches of wiki users in a bounded pool of threads, because most
+        of the time is spent waiting on the mediawiki databases.  The pool size is
+        MEDIAWIKI_PARALLEL_PROJECTS and at most MEDIAWIKI_MAX_CONNECTIONS_PER_HOST
+        batches query the same database host at once.  Each batch commits its
+        results as it finishes, so get_validation_info shows the progress.
+
+        Parameters
+            batches : list of (project, list of (wiki_user id, raw_id_or_name))
+        """
+        max_workers = db.config.get('MEDIAWIKI_PARALLEL_PROJECTS', 1)
+        if max_workers <= 1 or len(batches) <= 1:
+            for project, wikiusers in batches:
+                validate_users(wikiusers, project, self.validate_as_user_ids)
+            return
+
+        project_host_map = db.get_project_host_map()
+
+        def host(batch):
+            return project_host_map.get(batch[0], batch[0])
+
+        def validate_batch(batch):
+            project, wikiusers = batch
+            try:
+                validate_users(wikiusers, project, self.validate_as_user_ids)
+            finally:
+                # mediawiki sessions are thread-local, give the connection back
+                db.get_mw_session(project).remove()
+
+        parallel_map(
+            validate_batch,
+            batches,
+            max_workers,
+            group=host,
+            max_per_group=db.config.get('MEDIAWIKI_MAX_CONNECTIONS_PER_HOST'),
+        )
+
     def __repr__(self):
         return '<ValidateCohort("{0}")>'.format(self.cohort_id)
 
@@ -225,24 +324,29 @@ def normalize_project(project):
 
 def validate_users(wikiusers, project, validate_as_user_ids):
     """
+    Looks the wikiusers up in the project's user table, and writes whether they
+    are valid with one bulk statement, committed right away.  This does not use the
+    wikimetrics session, so it is safe to call from worker threads.
+
     Parameters
-        wikiusers               : the wikiusers with a candidate mediawiki_username
+        wikiusers               : list of (wiki_user id, raw_id_or_name)
         project                 : the project these wikiusers should belong to
         validate_as_user_ids    : if True, records will be checked against user_id
                                   if False, records are checked against user_name
     """
-    users_dict = {wu.raw_id_or_name : wu for wu in wikiusers}
+    raw_ids_or_names = [raw_id_or_name for wiki_user_id, raw_id_or_name in wikiusers]
     valid_project = True
 
     # validate
     try:
         session = db.get_mw_session(project)
         if validate_as_user_ids:
-            keys_as_ints = [int(k) for k in users_dict.keys() if k.isdigit()]
+            keys_as_ints = [int(k) for k in raw_ids_or_names if k.isdigit()]
             clause = MediawikiUser.user_id.in_(keys_as_ints)
         else:
-            clause = MediawikiUser.user_name.in_(users_dict.keys())
-        matches = session.query(MediawikiUser).filter(clause).all()
+            clause = MediawikiUser.user_name.in_(raw_ids_or_names)
+        matches = session.query(MediawikiUser.user_id, MediawikiUser.user_name)\
+            .filter(clause).all()
 
     # no need to roll back session because it's just a query
     except OperationalError:
@@ -259,31 +363,96 @@ def validate_users(wikiusers, project, validate_as_user_ids):
         task_logger.error(msg)
         raise e
 
-    # update results
+    matches_by_key = {}
     for match in matches:
         if validate_as_user_ids:
             key = str(match.user_id)
         else:
             key = match.user_name
+        matches_by_key[key] = match
 
-        users_dict[key].mediawiki_username = match.user_name
-        users_dict[key].mediawiki_userid = match.user_id
-        users_dict[key].valid = True
-        users_dict[key].reason_invalid = None
-        # remove valid matches
-        users_dict.pop(key)
-
-    # mark the rest invalid
     # key is going to be a string if bindings are correct, but careful!
     # it might be a string with chars that cannot be represented w/ ascii
     # the 'reason_invalid' does not need to have the user_id,
     # it is on the record on the table
-    for key in users_dict.keys():
-        if not valid_project:
-            reason_invalid = 'invalid project'
-        elif validate_as_user_ids:
-            reason_invalid = 'invalid user_id'
+    if not valid_project:
+        reason_invalid = 'invalid project'
+    elif validate_as_user_ids:
+        reason_invalid = 'invalid user_id'
+    else:
+        reason_invalid = 'invalid user_name'
+
+    outcomes = []
+    for wiki_user_id, raw_id_or_name in wikiusers:
+        match = matches_by_key.get(raw_id_or_name)
+        if match is not None:
+            outcomes.append((wiki_user_id, match.user_name, match.user_id, True, None))
+        else:
+            outcomes.append((wiki_user_id, None, None, False, reason_invalid))
+
+    # update results, in one transaction
+    with db.get_engine().begin() as connection:
+        write_validation_results(connection, outcomes)
+
+
+def write_validation_results(connection, outcomes):
+    """
+    Writes the outcome of validating wiki users.  On MySQL, each batch of
+    VALIDATION_BATCH_SIZE outcomes is written with a single UPDATE joined to
+    the outcomes, see update_wiki_users, other databases get one executemany
+    UPDATE per batch.  Invalid wiki users keep their mediawiki_username and
+    mediawiki_userid, as outcomes have None for these.
+
+    Parameters
+        connection  : a connection to the wikimetrics database
+        outcomes    : list of (wiki_user id, mediawiki_username, mediawiki_userid,
+                      valid, reason_invalid)
+    """
+    table = WikiUserStore.__table__
+    for batch in chunk(outcomes, VALIDATION_BATCH_SIZE):
+        if connection.dialect.name == 'mysql':
+            connection.execute(update_wiki_users(batch))
         else:
-            reason_invalid = 'invalid user_name'
-        users_dict[key].reason_invalid = reason_invalid
-        users_dict[key].valid = False
+            columns = ('b_id',) + tuple('b_' + c for c in VALIDATION_RESULT_COLUMNS)
+            connection.execute(
+                table.update().where(table.c.id == bindparam('b_id')).values(
+                    validation_results(table, {
+                        column: bindparam('b_' + column)
+                        for column in VALIDATION_RESULT_COLUMNS
+                    })
+                ),
+                [dict(zip(columns, outcome)) for outcome in batch]
+            )
+
+
+def update_wiki_users(outcomes):
+    """
+    Returns
+        a single multi-table UPDATE of the wiki_user rows with these outcomes,
+        joined by primary key to a derived table of the outcomes.  Only rows that
+        exist are updated.  Only compiles for MySQL.
+    """
+    table = WikiUserStore.__table__
+    columns = ('id',) + VALIDATION_RESULT_COLUMNS
+    validated = union_all(*[
+        select([
+            literal(value, table.c[column].type).label(column)
+            for column, value in zip(columns, outcome)
+        ])
+        for outcome in outcomes
+    ]).alias('validated')
+    return table.update().where(table.c.id == validated.c.id).values(
+        validation_results(table, validated.c)
+    )
+
+
+def validation_results(table, values):
+    """
+    Returns
+        the values to set VALIDATION_RESULT_COLUMNS of table to, from the
+        values of the outcome by column, keeping the mediawiki user of invalid rows
+    """
+    results = {column: values[column] for column in VALIDATION_RESULT_COLUMNS}
+    for column in ('mediawiki_username', 'mediawiki_userid'):
+        results[column] = func.coalesce(values[column], table.c[column])
+    return results
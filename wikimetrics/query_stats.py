@@ -0,0 +1,197 @@
+"""
+This module times the queries sent to the wikimetrics, mediawiki, and centralauth
+databases, and attributes them to the report that sent them.
+
+Engines are instrumented with `instrument_engine`, which listens to their
+before_cursor_execute and after_cursor_execute events.  Reports label the queries
+they send with `query_context`, for example MetricReport labels them with its
+metric, project, cohort and chunk.  The time, rows and statement bytes of each
+query are then added to:
+    * every query_context open in the thread that sent it, so a report can log
+      what its own queries cost
+    * the process-wide `query_stats`, aggregated by database, metric and project.
+      Not by cohort, there is no end to those, and each would stay in the
+      aggregates of every process and in redis forever
+
+Each process publishes its aggregates to a redis hash after every task, so the
+aggregates of all the queue workers can be read from any process with `collect`.
+"""
+import json
+import time
+import threading
+from contextlib import contextmanager
+from sqlalchemy import event
+
+__all__ = [
+    'QueryStats',
+    'query_stats',
+    'query_context',
+    'instrument_engine',
+]
+
+
+COUNTERS = ('queries', 'seconds', 'rows', 'bytes_sent')
+LABELS = ('database', 'metric', 'project')
+REDIS_KEY = 'wikimetrics:query_stats'
+
+contexts = threading.local()
+
+
+@contextmanager
+def query_context(**labels):
+    """
+    Labels the queries sent by this thread inside the context.  Contexts can be
+    nested, the inner labels are added to the outer ones.
+
+    Parameters
+        labels  : any of metric, project, cohort, chunk, ...
+
+    Yields
+        a dictionary with the labels and the COUNTERS of the queries sent so far
+        inside the context
+    """
+    stack = getattr(contexts, 'stack', None)
+    if stack is None:
+        stack = contexts.stack = []
+
+    context = dict(stack[-1]) if stack else {}
+    context.update(labels)
+    context.update({counter: 0 for counter in COUNTERS})
+    stack.append(context)
+    try:
+        yield context
+    finally:
+        stack.pop()
+
+
+class QueryStats(object):
+    """
+    Aggregates query counters by LABELS.  This is thread safe.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        with self.lock:
+            self.totals = {}
+            self.unpublished = {}
+
+    def record(self, database, seconds, rows, bytes_sent):
+        """
+        Adds a query to the aggregate of the current query_context, and to the
+        counters of every open query_context of this thread
+        """
+        stack = getattr(contexts, 'stack', None) or []
+        increments = {
+            'queries': 1, 'seconds': seconds, 'rows': rows, 'bytes_sent': bytes_sent
+        }
+        for context in stack:
+            for counter, value in increments.items():
+                context[counter] += value
+
+        current = stack[-1] if stack else {}
+        key = (database, current.get('metric'), current.get('project'))
+        with self.lock:
+            for aggregate in (self.totals, self.unpublished):
+                counters = aggregate.setdefault(key, dict.fromkeys(COUNTERS, 0))
+                for counter, value in increments.items():
+                    counters[counter] += value
+
+    def as_list(self, totals=None):
+        """
+        Returns
+            the aggregates as a list of dictionaries with the LABELS and COUNTERS,
+            the most time consuming first
+        """
+        if totals is None:
+            with self.lock:
+                totals = {key: dict(counters) for key, counters in self.totals.items()}
+        rows = []
+        for key, counters in totals.items():
+            row = dict(zip(LABELS, key))
+            row.update(counters)
+            rows.append(row)
+        rows.sort(key=lambda row: row['seconds'], reverse=True)
+        return rows
+
+    def publish(self, redis):
+        """
+        Adds the aggregates recorded since the last publish to the shared redis hash
+
+        Parameters
+            redis   : a redis client
+        """
+        with self.lock:
+            unpublished = self.unpublished
+            self.unpublished = {}
+        if not unpublished:
+            return
+
+        try:
+            pipeline = redis.pipeline()
+            for key, counters in unpublished.items():
+                for counter, value in counters.items():
+                    field = json.dumps(list(key) + [counter])
+                    if isinstance(value, float):
+                        pipeline.hincrbyfloat(REDIS_KEY, field, value)
+                    else:
+                        pipeline.hincrby(REDIS_KEY, field, value)
+            pipeline.execute()
+        except Exception:
+            # keep them for the next publish
+            with self.lock:
+                for key, counters in unpublished.items():
+                    mine = self.unpublished.setdefault(key, dict.fromkeys(COUNTERS, 0))
+                    for counter, value in counters.items():
+                        mine[counter] += value
+            raise
+
+    def collect(self, redis):
+        """
+        Parameters
+            redis   : a redis client
+
+        Returns
+            the aggregates published by all processes, as returned by as_list
+        """
+        totals = {}
+        for field, value in redis.hgetall(REDIS_KEY).items():
+            labels = json.loads(field)
+            # fields published with more labels, like the cohort, are added up
+            key, counter = tuple(labels[:len(LABELS)]), labels[-1]
+            counters = totals.setdefault(key, dict.fromkeys(COUNTERS, 0))
+            counters[counter] += float(value) if counter == 'seconds' else int(value)
+        return self.as_list(totals)
+
+
+query_stats = QueryStats()
+
+
+def instrument_engine(engine, database):
+    """
+    Records the queries sent by engine in query_stats
+
+    Parameters
+        engine      : a sqlalchemy engine
+        database    : the name to record its queries under, like 'mediawiki'
+    """
+    def before_cursor_execute(conn, cursor, statement, parameters, context,
+                              executemany):
+        conn.info['query_start_time'] = time.time()
+
+    def after_cursor_execute(conn, cursor, statement, parameters, context,
+                             executemany):
+        started = conn.info.pop('query_start_time', None)
+        if started is None:
+            return
+        query_stats.record(
+            database,
+            time.time() - started,
+            max(cursor.rowcount, 0),
+            len(statement),
+        )
+
+    event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+    event.listen(engine, 'after_cursor_execute', after_cursor_execute)
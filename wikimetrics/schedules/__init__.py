@@ -1,4 +1,6 @@
 from daily import *
+from edit_rollup import *
+from result_store import *
 
 # ignore flake8 because of F403 violation
 # flake8: noqa
@@ -24,7 +24,7 @@ new_limit = 3 * configured_soft_limit
 @queue.task(time_limit=new_limit, soft_time_limit=new_limit)
 def recurring_reports(report_id=None):
     from wikimetrics.configurables import db
-    from wikimetrics.models import ReportStore, RunReport
+    from wikimetrics.models import ReportStore, RunReport, BackfillReport
     
     replication_lag_service = ReplicationLagService()
     if replication_lag_service.is_any_lagged():
@@ -55,8 +55,10 @@ def recurring_reports(report_id=None):
                     session,
                     **kwargs
                 )
-                for day_to_run in days_to_run:
-                    day_to_run.task.delay(day_to_run)
+                # consecutive days are computed together when the metric allows it
+                reports_to_run = BackfillReport.create_backfills(report, days_to_run)
+                for report_to_run in reports_to_run:
+                    report_to_run.task.delay(report_to_run)
             
             except Exception:
                 task_logger.error('Problem running recurring report "{}": {}'.format(
@@ -0,0 +1,32 @@
+import traceback
+from celery.utils.log import get_task_logger
+
+from wikimetrics.api import EditRollupService
+from wikimetrics.configurables import queue
+
+__all__ = ['update_edit_rollups']
+
+task_logger = get_task_logger(__name__)
+
+
+# the first run counts every day since EDIT_ROLLUP_START_DATE, give it time
+configured_soft_limit = queue.conf.get('CELERYD_TASK_SOFT_TIME_LIMIT', 3600)
+rollup_limit = 24 * configured_soft_limit
+
+
+@queue.task(time_limit=rollup_limit, soft_time_limit=rollup_limit)
+def update_edit_rollups(project=None):
+    """
+    Counts the days that are not in the edit rollup of each of the
+    EDIT_ROLLUP_PROJECTS yet, see EditRollupService
+    """
+    service = EditRollupService()
+    projects = [project] if project else service.get_projects()
+    for project in projects:
+        try:
+            days = service.build(project)
+            task_logger.info('Counted {0} days of edits of "{1}"'.format(days, project))
+        except Exception:
+            task_logger.error('Problem updating the edit rollup of "{0}": {1}'.format(
+                project, traceback.format_exc()
+            ))
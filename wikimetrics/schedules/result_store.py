@@ -0,0 +1,22 @@
+from datetime import timedelta
+from celery.utils.log import get_task_logger
+
+from wikimetrics.configurables import queue
+
+__all__ = ['expire_results']
+
+task_logger = get_task_logger(__name__)
+
+
+@queue.task
+def expire_results():
+    """
+    Removes the report results written more than RESULT_STORE_MAX_AGE_DAYS ago,
+    see ReportResultStore.expire
+    """
+    from wikimetrics.configurables import db
+    from wikimetrics.models import ReportStore
+
+    max_age = timedelta(days=db.config.get('RESULT_STORE_MAX_AGE_DAYS', 30))
+    removed = ReportStore.get_result_store().expire(max_age)
+    task_logger.info('Removed {0} expired report results'.format(removed))
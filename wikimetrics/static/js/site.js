@@ -132,8 +132,12 @@ var site = {
                         report.success = report.status === 'SUCCESS';
                         report.failure = report.status === 'FAILURE';
                         report.publicResult = report.recurrent ?
-                            '/static/public/' + report.id + '/full_report.json' :
+                            '/reports/public/' + report.id + '/full_report.json' :
                             '/static/public/' + report.id + '.json';
+                        report.profileSummary = (report.profile || []).map(function(timing){
+                            return timing.node + ': ' + timing.seconds.toFixed(1) + 's' +
+                                (timing.count > 1 ? ' (' + timing.count + ' times)' : '');
+                        }).join('\n');
                     });
                     viewModel.reports(data.reports);
                 }
@@ -3,9 +3,12 @@ import os
 import os.path
 import collections
 import re
+import sys
+import threading
 from decimal import Decimal, ROUND_HALF_UP
 from datetime import datetime, timedelta, date
 from flask import Response
+from wikimetrics.exceptions import Cancelled
 
 
 # Format string for datetime.strptime for MediaWiki timestamps.
@@ -62,6 +65,7 @@ def json_response(*args, **kwargs):
         * datetime.datetime objects encoded via BetterEncoder
         * datetime.date objects encoded via BetterEncoder
         * Decimal objects encoded via BetterEncoder
+        * other Mapping objects encoded via BetterEncoder
     """
     data = stringify(*args, **kwargs)
     return Response(data, content_type='application/json; charset=utf-8')
@@ -137,6 +141,10 @@ class BetterEncoder(json.JSONEncoder):
 
         if isinstance(obj, Decimal):
             return float(obj)
+
+        # for example, individual results read from the result store
+        if isinstance(obj, collections.Mapping):
+            return dict(obj.iteritems())
         return json.JSONEncoder.default(self, obj)
 
 
@@ -305,6 +313,119 @@ def chunk(array, chunk_size):
         yield array[i : i + chunk_size]
 
 
+# the cancel events of the parallel_maps running the current worker thread
+parallel_map_state = threading.local()
+
+
+def check_cancelled():
+    """
+    Raises Cancelled if the parallel_map running this thread, or one running it,
+    was cancelled.  Long functions passed to parallel_map should call this
+    between steps, so they stop soon after an error or an interruption instead
+    of holding on to their database connections.
+    """
+    for cancelled in getattr(parallel_map_state, 'cancelled', ()):
+        if cancelled.is_set():
+            raise Cancelled()
+
+
+def parallel_map(function, items, max_workers, group=None, max_per_group=None,
+                 poll_interval=0.5):
+    """
+    Maps function over items using a bounded pool of threads
+
+    Parameters
+        function        : called once for each item, in a worker thread
+        items           : an iterable of items to process
+        max_workers     : maximum number of threads, 1 or less means run serially
+        group           : optional function that assigns each item to a group
+        max_per_group   : if set, at most this many items of the same group
+                          are processed at the same time
+        poll_interval   : seconds between checks, so that signals such as celery's
+                          SoftTimeLimitExceeded can interrupt the calling thread
+
+    Returns
+        a list with the results, in the same order as items.  If any call raises,
+        the remaining items are cancelled and the first exception (by item order)
+        is re-raised in the calling thread.  If the calling thread is interrupted,
+        the remaining items are cancelled as well.  Either way, the calls already
+        running are told with check_cancelled, and waited for before raising.
+    """
+    items = list(items)
+    if max_workers <= 1 or len(items) <= 1:
+        return [function(item) for item in items]
+
+    results = [None] * len(items)
+    errors = {}
+    pending = collections.deque(enumerate(items))
+    running = collections.defaultdict(int)
+    condition = threading.Condition()
+    cancelled = threading.Event()
+    # workers also stop if a parallel_map running this one is cancelled
+    cancel_events = getattr(parallel_map_state, 'cancelled', ()) + (cancelled,)
+
+    def next_item():
+        # must be called while holding the condition
+        for position, (index, item) in enumerate(pending):
+            key = group(item) if group else None
+            if not max_per_group or running[key] < max_per_group:
+                del pending[position]
+                running[key] += 1
+                return index, item, key
+        return None
+
+    def work():
+        parallel_map_state.cancelled = cancel_events
+        while True:
+            with condition:
+                picked = None
+                while pending and not cancelled.is_set():
+                    picked = next_item()
+                    if picked:
+                        break
+                    condition.wait(poll_interval)
+                if picked is None:
+                    return
+            index, item, key = picked
+            try:
+                results[index] = function(item)
+            except Cancelled:
+                pass
+            except Exception:
+                errors[index] = sys.exc_info()
+                cancelled.set()
+            finally:
+                with condition:
+                    running[key] -= 1
+                    condition.notify_all()
+
+    workers = [
+        threading.Thread(target=work, name='parallel_map-{0}'.format(i))
+        for i in range(min(max_workers, len(items)))
+    ]
+    for worker in workers:
+        worker.daemon = True
+        worker.start()
+    try:
+        for worker in workers:
+            while worker.is_alive():
+                worker.join(poll_interval)
+    except BaseException:
+        cancelled.set()
+        # running calls still use their connections and report progress
+        for worker in workers:
+            while worker.is_alive():
+                worker.join(poll_interval)
+        raise
+
+    if any(event.is_set() for event in cancel_events[:-1]):
+        raise Cancelled()
+    if errors:
+        exc_type, exc_value, exc_traceback = errors[min(errors)]
+        raise exc_type, exc_value, exc_traceback
+    return results
+
+
 def update_dict(target, source):
     """
     Updates a target dictionary recursively from a source dictionary